@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+GitHub 下载中转服务的离线压测
+
+启动本地模拟 GitHub（fake_github.py）和待测的中转服务，用 N 个并发客户端按给定的文件大小下载，
+输出每轮的吞吐量、TTFB/总耗时的 p50/p99、服务端 RSS 峰值、CPU 时间（每 GB）以及上游流量。
+不访问外网，可以在同一台机器上对比不同的服务模式、缓存和分段设置。
+
+用法示例:
+    # threaded 模式，两轮（第一轮冷缓存，第二轮命中缓存）
+    python3 deploy/bench/bench.py --server threaded --sizes 1M,16M,64M --clients 16 --requests 64 --rounds 2
+
+    # gunicorn 4 个 worker，模拟 50ms RTT、每连接 8MB/s，开启 4 段并行，不用缓存
+    python3 deploy/bench/bench.py --server gunicorn --workers 4 --latency 0.05 --bandwidth 8M \\
+        --env GHPROXY_SEGMENTS=4 --env GHPROXY_SEGMENT_MIN=8388608 --no-cache --json seg4.json
+
+    # 压测已经在运行的服务（仍使用本地模拟 GitHub；指定 --pid 才统计 RSS/CPU）
+    python3 deploy/bench/bench.py --proxy-url http://127.0.0.1:18080 --pid 12345
+
+    # 对比多次结果
+    python3 deploy/bench/bench.py --compare threaded.json asgi.json seg4.json
+
+服务端 RSS 和 CPU 从 /proc 读取（仅 Linux），统计待测进程及其所有子进程（gunicorn worker）。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import signal
+import socket
+import hashlib
+import argparse
+import tempfile
+import contextlib
+import threading
+import subprocess
+import http.client
+import urllib.parse
+import urllib.request
+
+from fake_github import make_server, parse_size, expected_digest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+TARGETS = {
+    'deploy': os.path.join(REPO_DIR, 'deploy', 'guangzhou-github-proxy.py'),
+    'gz': os.path.join(REPO_DIR, 'scripts', 'github_proxy_gz.py'),
+}
+GUNICORN_CONF = os.path.join(REPO_DIR, 'deploy', 'gunicorn.conf.py')
+# 两个服务脚本都固定监听 18080
+PROXY_PORT = 18080
+READ_SIZE = 1024 * 1024
+MB = 1024 * 1024
+GB = 1024 ** 3
+
+
+def format_size(nbytes):
+    for unit, scale in (('G', GB), ('M', MB), ('K', 1024)):
+        if nbytes >= scale and nbytes % scale == 0:
+            return f'{nbytes // scale}{unit}'
+    return str(nbytes)
+
+
+def percentile(values, p):
+    """最近秩百分位数，空列表返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# ==================== 服务端进程 ====================
+
+class ProxyProcess:
+    """启动并停止待测的中转服务"""
+
+    def __init__(self, args, fake_url, workdir):
+        self.args = args
+        self.fake_url = fake_url
+        self.workdir = workdir
+        self.process = None
+
+    def command(self):
+        script = self.args.script or TARGETS[self.args.target]
+        if self.args.server in ('threaded', 'asgi'):
+            return [sys.executable, script]
+        # gunicorn 按模块名导入应用，用符号链接把脚本变成 app.py
+        app_dir = os.path.join(self.workdir, 'app')
+        os.makedirs(app_dir, exist_ok=True)
+        link = os.path.join(app_dir, 'app.py')
+        if not os.path.exists(link):
+            os.symlink(script, link)
+        return [sys.executable, '-m', 'gunicorn', '-c', GUNICORN_CONF, '--chdir', app_dir]
+
+    def environment(self):
+        env = dict(os.environ)
+        env.update({
+            'HTTP_PROXY': '',
+            'HTTPS_PROXY': '',
+            'GHPROXY_UPSTREAMS': 'direct',
+            'GHPROXY_UPSTREAM_PROBE_URL': f'{self.fake_url}/github.com/robots.txt',
+            'GHPROXY_SERVER': 'asgi' if self.args.server in ('asgi', 'gunicorn-asgi') else 'threaded',
+            'GHPROXY_BIND': f'127.0.0.1:{PROXY_PORT}',
+            'GHPROXY_WORKERS': str(self.args.workers),
+            # 不读取本机的运行时配置文件
+            'GHPROXY_ENV_FILE': os.path.join(self.workdir, 'proxy.env'),
+        })
+        if self.args.threads:
+            env['GHPROXY_THREADS'] = str(self.args.threads)
+        if self.args.no_cache:
+            env['GHPROXY_CACHE_MAX_BYTES'] = '0'
+        else:
+            env['GHPROXY_CACHE_DIR'] = self.args.cache_dir or os.path.join(self.workdir, 'cache')
+        for item in self.args.env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        return env
+
+    def start(self):
+        if port_in_use(PROXY_PORT):
+            raise SystemExit(f'端口 {PROXY_PORT} 已被占用，请先停止正在运行的中转服务，或使用 --proxy-url')
+        self.log = open(self.args.log or os.path.join(self.workdir, 'proxy.log'), 'wb')
+        self.process = subprocess.Popen(
+            self.command(), env=self.environment(), cwd=self.workdir,
+            stdout=self.log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f'中转服务启动失败:\n{self.log_tail()}')
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{PROXY_PORT}/status', timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise SystemExit(f'中转服务 30 秒内未就绪:\n{self.log_tail()}')
+
+    def log_tail(self, lines=20):
+        self.log.flush()
+        with open(self.log.name, 'r', encoding='utf-8', errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+def port_in_use(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+
+# ==================== 资源采样 ====================
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_tree(root_pid):
+    """root_pid 及其所有子孙进程"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'r') as f:
+                # comm 字段可能含空格，从最后一个 ')' 之后解析
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+    pids, queue = [], [root_pid]
+    while queue:
+        pid = queue.pop()
+        pids.append(pid)
+        queue.extend(children.get(pid, []))
+    return pids
+
+
+def read_usage(pids):
+    """进程组的 (CPU 秒数, RSS 字节数)"""
+    cpu, rss = 0.0, 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{pid}/statm', 'r') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+        # utime、stime 为第 14、15 个字段（这里从第 3 个字段 state 开始计数）
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu, rss
+
+
+class ResourceSampler:
+    """定期采样服务端进程树的 RSS，记录一轮前后的 CPU 时间"""
+
+    INTERVAL = 0.25
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss = 0
+        self.samples = []
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.cpu_start, _ = read_usage(process_tree(self.pid))
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            _, rss = read_usage(process_tree(self.pid))
+            self.peak_rss = max(self.peak_rss, rss)
+            self.samples.append(rss)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self.thread.join()
+        self.cpu_seconds, rss = read_usage(process_tree(self.pid))
+        self.cpu_seconds -= self.cpu_start
+        self.peak_rss = max(self.peak_rss, rss)
+        return False
+
+
+# ==================== 客户端 ====================
+
+# 两种请求：Release 资源（302 到 objects.githubusercontent.com）与 raw.githubusercontent.com 文本文件
+KINDS = {
+    'release': ('github.com/bench/assets/releases/download/v1', '.bin'),
+    'raw': ('raw.githubusercontent.com/bench/assets/main', '.sh'),
+}
+
+
+class Workload:
+    """每轮要下载的请求列表：(文件名, 大小, Range 或 None)"""
+
+    def __init__(self, sizes, distinct, range_ratio, seed, kind='release'):
+        self.prefix, ext = KINDS[kind]
+        self.files = [(f'bench{i}-{format_size(size)}{ext}', size) for size in sizes for i in range(distinct)]
+        self.range_ratio = range_ratio
+        self.random = random.Random(seed)
+
+    def requests(self, count):
+        jobs = []
+        for i in range(count):
+            name, size = self.files[i % len(self.files)]
+            byte_range = None
+            if self.random.random() < self.range_ratio:
+                start = self.random.randrange(size)
+                byte_range = (start, self.random.randrange(start, size))
+            jobs.append((name, size, byte_range))
+        self.random.shuffle(jobs)
+        return jobs
+
+
+class Client(threading.Thread):
+    """一个压测客户端：复用一条 keep-alive 连接，依次完成分到的请求"""
+
+    def __init__(self, proxy, fake_url, prefix, jobs, verify, results):
+        super().__init__(daemon=True)
+        self.proxy = urllib.parse.urlsplit(proxy)
+        self.prefix = self.proxy.path.rstrip('/')
+        self.fake_url = fake_url
+        self.upstream_prefix = prefix
+        self.jobs = jobs
+        self.verify = verify
+        self.results = results
+        self.connection = None
+
+    def run(self):
+        buffer = bytearray(READ_SIZE)
+        view = memoryview(buffer)
+        while True:
+            try:
+                name, size, byte_range = self.jobs.pop()
+            except IndexError:
+                break
+            self.results.append(self.fetch(name, size, byte_range, view))
+        if self.connection:
+            self.connection.close()
+
+    def fetch(self, name, size, byte_range, view):
+        upstream = f'{self.fake_url}/{self.upstream_prefix}/{name}'
+        path = f'{self.prefix}/download?url={urllib.parse.quote(upstream, safe=":/")}'
+        headers = {}
+        expected = size
+        if byte_range:
+            headers['Range'] = f'bytes={byte_range[0]}-{byte_range[1]}'
+            expected = byte_range[1] - byte_range[0] + 1
+        result = {'size': size, 'range': byte_range is not None, 'bytes': 0, 'ttfb': None, 'error': None}
+        digest = hashlib.sha256() if self.verify and not byte_range else None
+        started = time.monotonic()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.proxy.hostname, self.proxy.port or 80, timeout=120)
+            self.connection.request('GET', path, headers=headers)
+            response = self.connection.getresponse()
+            if response.status != (206 if byte_range else 200):
+                response.read()
+                raise ValueError(f'HTTP {response.status}')
+            while True:
+                n = response.readinto(view)
+                if not n:
+                    break
+                if result['ttfb'] is None:
+                    result['ttfb'] = time.monotonic() - started
+                result['bytes'] += n
+                if digest:
+                    digest.update(view[:n])
+            if result['bytes'] != expected:
+                raise ValueError(f'长度不符: {result["bytes"]} != {expected}')
+            if digest and digest.hexdigest() != expected_digest(name, size):
+                raise ValueError('内容校验失败')
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+        result['elapsed'] = time.monotonic() - started
+        return result
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def run_round(args, proxy_url, fake_url, workload, pid):
+    jobs = workload.requests(args.requests)
+    results = []
+    before = fetch_json(f'{fake_url}/_stats')
+    with ResourceSampler(pid) if pid else contextlib.nullcontext() as sampler:
+        started = time.monotonic()
+        clients = [Client(proxy_url, fake_url, workload.prefix, jobs, args.verify, results) for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        wall = time.monotonic() - started
+    after = fetch_json(f'{fake_url}/_stats')
+    summary = summarize(results, wall, sampler, {key: after[key] - before[key] for key in after})
+    try:
+        # 缓冲区预算的占用峰值（多 worker 时只是响应 /status 的那个 worker）
+        summary['buffers'] = fetch_json(f'{proxy_url}/status').get('buffers')
+    except (OSError, ValueError):
+        pass
+    return summary
+
+
+def summarize(results, wall, sampler, upstream):
+    ok = [r for r in results if not r['error']]
+    served = sum(r['bytes'] for r in results)
+    summary = {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'error_samples': sorted({r['error'] for r in results if r['error']})[:5],
+        'wall_seconds': wall,
+        'bytes_served': served,
+        'throughput': served / wall if wall else 0,
+        'ttfb_p50': percentile([r['ttfb'] for r in ok if r['ttfb'] is not None], 50),
+        'ttfb_p99': percentile([r['ttfb'] for r in ok if r['ttfb'] is not None], 99),
+        'elapsed_p50': percentile([r['elapsed'] for r in ok], 50),
+        'elapsed_p99': percentile([r['elapsed'] for r in ok], 99),
+        'upstream_bytes': upstream['bytes_sent'],
+        'upstream_requests': upstream['objects'],
+        'by_size': {},
+    }
+    for size in sorted({r['size'] for r in results}):
+        group = [r for r in ok if r['size'] == size and not r['range']]
+        summary['by_size'][format_size(size)] = {
+            'requests': len(group),
+            'rate_p50': percentile([r['bytes'] / r['elapsed'] for r in group if r['elapsed']], 50),
+            'ttfb_p50': percentile([r['ttfb'] for r in group if r['ttfb'] is not None], 50),
+            'ttfb_p99': percentile([r['ttfb'] for r in group if r['ttfb'] is not None], 99),
+        }
+    if sampler:
+        summary['peak_rss'] = sampler.peak_rss
+        summary['cpu_seconds'] = sampler.cpu_seconds
+        summary['cpu_per_gb'] = sampler.cpu_seconds / (served / GB) if served else None
+    return summary
+
+
+# ==================== 输出 ====================
+
+def ms(value):
+    return '-' if value is None else f'{value * 1000:.1f}'
+
+
+def print_round(index, s):
+    print(f'\n第 {index} 轮: {s["requests"]} 个请求，失败 {s["errors"]}，'
+          f'{s["bytes_served"] / MB:.1f} MB，用时 {s["wall_seconds"]:.2f} s')
+    print(f'  总吞吐量        {s["throughput"] / MB:.1f} MB/s')
+    print(f'  TTFB p50/p99    {ms(s["ttfb_p50"])} / {ms(s["ttfb_p99"])} ms')
+    print(f'  耗时 p50/p99    {ms(s["elapsed_p50"])} / {ms(s["elapsed_p99"])} ms')
+    if 'peak_rss' in s:
+        per_gb = '-' if s['cpu_per_gb'] is None else f'{s["cpu_per_gb"]:.2f}'
+        print(f'  服务端 RSS 峰值 {s["peak_rss"] / MB:.1f} MB')
+        print(f'  服务端 CPU      {s["cpu_seconds"]:.2f} s（{per_gb} s/GB）')
+    print(f'  上游流量        {s["upstream_bytes"] / MB:.1f} MB，{s["upstream_requests"]} 个请求')
+    if s.get('buffers'):
+        b = s['buffers']
+        print(f'  缓冲区峰值      {b["peak"] / MB:.1f} MB（预算 {b["max_bytes"] / MB:.1f} MB，等待 {b["waits"]} 次）')
+    print(f'  {"大小":<8}{"请求数":>8}{"单请求速率 p50":>18}{"TTFB p50":>12}{"TTFB p99":>12}')
+    for size, group in s['by_size'].items():
+        rate = '-' if group['rate_p50'] is None else f'{group["rate_p50"] / MB:.1f} MB/s'
+        print(f'  {size:<8}{group["requests"]:>8}{rate:>18}{ms(group["ttfb_p50"]):>12}{ms(group["ttfb_p99"]):>12}')
+    for error in s['error_samples']:
+        print(f'  错误: {error}')
+
+
+def compare(paths):
+    """并排输出多个 --json 结果（每个结果取最后一轮）"""
+    rows = [
+        ('吞吐量 MB/s', lambda s: f'{s["throughput"] / MB:.1f}'),
+        ('TTFB p50 ms', lambda s: ms(s['ttfb_p50'])),
+        ('TTFB p99 ms', lambda s: ms(s['ttfb_p99'])),
+        ('耗时 p99 ms', lambda s: ms(s['elapsed_p99'])),
+        ('失败数', lambda s: str(s['errors'])),
+        ('RSS 峰值 MB', lambda s: f'{s["peak_rss"] / MB:.1f}' if 'peak_rss' in s else '-'),
+        ('CPU s/GB', lambda s: f'{s["cpu_per_gb"]:.2f}' if s.get('cpu_per_gb') is not None else '-'),
+        ('上游流量 MB', lambda s: f'{s["upstream_bytes"] / MB:.1f}'),
+    ]
+    reports = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    labels = [report['label'] for report in reports]
+    width = max(14, *(len(label) + 2 for label in labels))
+    print(f'{"":<14}' + ''.join(f'{label:>{width}}' for label in labels))
+    for title, value in rows:
+        print(f'{title:<14}' + ''.join(f'{value(report["rounds"][-1]):>{width}}' for report in reports))
+
+
+# ==================== 入口 ====================
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='GitHub 下载中转服务离线压测')
+    target = parser.add_argument_group('待测服务')
+    target.add_argument('--target', choices=sorted(TARGETS), default='deploy',
+                        help='deploy: deploy/guangzhou-github-proxy.py；gz: scripts/github_proxy_gz.py')
+    target.add_argument('--script', help='其他服务脚本路径（覆盖 --target）')
+    target.add_argument('--server', choices=['threaded', 'asgi', 'gunicorn', 'gunicorn-asgi'], default='threaded')
+    target.add_argument('--workers', type=int, default=2, help='gunicorn worker 数')
+    target.add_argument('--threads', type=int, help='gunicorn 每个 worker 的线程数')
+    target.add_argument('--cache-dir', help='缓存目录（默认每次使用新的临时目录）')
+    target.add_argument('--no-cache', action='store_true', help='关闭磁盘缓存')
+    target.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='传给中转服务的环境变量')
+    target.add_argument('--log', help='中转服务日志文件（默认写入临时目录，结束后删除）')
+    target.add_argument('--proxy-url', help='压测已运行的服务，不启动新进程')
+    target.add_argument('--pid', type=int, help='配合 --proxy-url，统计该进程树的 RSS/CPU')
+
+    upstream = parser.add_argument_group('模拟 GitHub')
+    upstream.add_argument('--latency', type=float, default=0.0, help='响应头之前的延迟（秒）')
+    upstream.add_argument('--bandwidth', type=parse_size, default=0, help='每条上游连接的速率上限，如 8M')
+    upstream.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的概率')
+    upstream.add_argument('--drop-rate', type=float, default=0.0, help='响应体中途断开的概率')
+
+    load = parser.add_argument_group('负载')
+    load.add_argument('--clients', type=int, default=8, help='并发客户端数')
+    load.add_argument('--requests', type=int, default=32, help='每轮请求数')
+    load.add_argument('--kind', choices=sorted(KINDS), default='release',
+                      help='release: Release 资源（经 302 跳转）；raw: raw.githubusercontent.com 文本文件')
+    load.add_argument('--sizes', default='1M,16M,64M', help='文件大小列表')
+    load.add_argument('--distinct', type=int, default=2, help='每种大小的不同文件数')
+    load.add_argument('--range-ratio', type=float, default=0.0, help='带随机 Range 的请求比例')
+    load.add_argument('--rounds', type=int, default=1, help='轮数（缓存在轮之间保留）')
+    load.add_argument('--verify', action='store_true', help='校验完整下载的 sha256')
+    load.add_argument('--seed', type=int, default=1)
+
+    parser.add_argument('--label', help='结果名称（默认由服务模式生成）')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', nargs='+', metavar='JSON', help='对比多个结果文件后退出')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.compare:
+        compare(args.compare)
+        return 0
+
+    random.seed(args.seed)
+    fake = make_server('127.0.0.1', 0, args.latency, args.bandwidth, args.error_rate, args.drop_rate)
+    fake_url = f'http://127.0.0.1:{fake.server_address[1]}'
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix='ghproxy-bench-')
+    proxy = None
+    label = args.label or ('external' if args.proxy_url else
+                           f'{args.target}-{args.server}' + ('-nocache' if args.no_cache else ''))
+    report = {'label': label, 'config': {key: value for key, value in vars(args).items() if key != 'compare'},
+              'rounds': []}
+    try:
+        if args.proxy_url:
+            proxy_url, pid = args.proxy_url, args.pid
+        else:
+            proxy = ProxyProcess(args, fake_url, workdir)
+            proxy.start()
+            proxy_url, pid = f'http://127.0.0.1:{PROXY_PORT}', proxy.process.pid
+        print(f'{label}: {args.clients} 个客户端，每轮 {args.requests} 个请求，文件 {args.sizes}，上游 {fake_url}')
+        workload = Workload([parse_size(size) for size in args.sizes.split(',')],
+                            args.distinct, args.range_ratio, args.seed, args.kind)
+        for index in range(1, args.rounds + 1):
+            summary = run_round(args, proxy_url, fake_url, workload, pid)
+            report['rounds'].append(summary)
+            print_round(index, summary)
+    finally:
+        if proxy:
+            proxy.stop()
+        fake.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if any(summary['errors'] for summary in report['rounds']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
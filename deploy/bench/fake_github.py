@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的 github.com / objects.githubusercontent.com（压测用，完全离线）
+
+只依赖标准库。为了通过中转服务的域名校验，主机名写在路径的第一段：
+
+    http://127.0.0.1:9900/github.com/<owner>/<repo>/releases/download/<tag>/<name>
+        -> 302 到 /objects.githubusercontent.com/release-assets/<name>?X-Amz-Date=...&X-Amz-Expires=300
+    http://127.0.0.1:9900/objects.githubusercontent.com/.../<name>    文件内容
+    http://127.0.0.1:9900/raw.githubusercontent.com/.../<name>        文件内容（无重定向）
+    http://127.0.0.1:9900/github.com/robots.txt                       健康探测
+    http://127.0.0.1:9900/api.github.com/repos/<owner>/<repo>/releases/latest
+        -> 固定的 Release（RELEASE_ASSETS），资源地址指向本服务（预热测试用，GHPROXY_GITHUB_API 指向
+           http://127.0.0.1:9900/api.github.com）
+    http://127.0.0.1:9900/_stats                                      请求数与发送字节数（JSON）
+
+文件大小写在文件名中：asset-64M.bin、small-512K.tgz、x-1000.bin（支持 K/M/G 后缀）。
+内容由文件名确定性生成，压测客户端用 expected_digest() 校验下载结果；
+.sh / .txt / .json 等文本文件的内容是可压缩的十六进制文本，Content-Type 为 text/plain。
+
+支持 Range（单区间、后缀区间）、If-Range、If-None-Match 和 HEAD，以及以下模拟:
+    --latency     每个响应头之前的延迟（秒），模拟跨境 RTT
+    --bandwidth   每条连接的发送速率上限（如 2M 表示 2MB/s），0 为不限速
+    --error-rate  文件请求直接返回 503 的概率
+    --drop-rate   文件请求在响应体中途断开连接的概率
+
+用法:
+    python3 fake_github.py --port 9900 --latency 0.05 --bandwidth 4M --drop-rate 0.05
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 生成内容时重复使用的块大小
+BLOCK_SIZE = 1024 * 1024
+# 单次写入 socket 的大小；限速时也按这个粒度休眠
+WRITE_SIZE = 64 * 1024
+
+SIZE_PATTERN = re.compile(r'-(\d+)([KMG]?)(?:\.[\w.]+)?$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+TEXT_EXTENSIONS = ('.sh', '.txt', '.json', '.yml', '.yaml', '.md')
+# releases/latest 返回的 Release
+RELEASE_TAG = 'v1.0.0'
+RELEASE_ASSETS = ('app-linux-amd64-8M.tar.gz', 'app-darwin-arm64-8M.tar.gz', 'checksums-2K.txt')
+
+
+def parse_size(text):
+    """解析 4M、512K、1G、1000 这样的大小"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMG]?)B?', text.strip(), re.IGNORECASE)
+    if not match:
+        raise ValueError(f'无法解析大小: {text}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def size_from_name(name):
+    """从文件名中取出大小，没有大小后缀时返回 None"""
+    match = SIZE_PATTERN.search(name)
+    if not match:
+        return None
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def is_text(name):
+    return name.lower().endswith(TEXT_EXTENSIONS)
+
+
+@lru_cache(maxsize=64)
+def content_block(name):
+    """文件 name 的内容是这个块的重复"""
+    seed = hashlib.sha256(name.encode('utf-8')).digest()
+    if is_text(name):
+        # 每行 64 个十六进制字符，约可压缩一半
+        lines = (hashlib.sha256(seed + i.to_bytes(4, 'big')).hexdigest().encode() + b'\n'
+                 for i in range(BLOCK_SIZE // 65 + 1))
+        return b''.join(lines)[:BLOCK_SIZE]
+    return b''.join(hashlib.sha256(seed + i.to_bytes(4, 'big')).digest() for i in range(BLOCK_SIZE // 32))
+
+
+def iter_content(name, start, end):
+    """按块生成文件 [start, end] 区间的内容（memoryview，避免复制）"""
+    block = memoryview(content_block(name))
+    pos = start
+    while pos <= end:
+        offset = pos % BLOCK_SIZE
+        n = min(WRITE_SIZE, BLOCK_SIZE - offset, end + 1 - pos)
+        yield block[offset:offset + n]
+        pos += n
+
+
+@lru_cache(maxsize=256)
+def expected_digest(name, size):
+    """文件完整内容的 sha256（十六进制）"""
+    digest = hashlib.sha256()
+    for piece in iter_content(name, 0, size - 1):
+        digest.update(piece)
+    return digest.hexdigest()
+
+
+def etag_for(name, size):
+    return '"' + hashlib.md5(f'{name}:{size}'.encode('utf-8')).hexdigest() + '"'
+
+
+class Stats:
+    """模拟服务器的计数器，通过 /_stats 读取"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {
+            'requests': 0,
+            'redirects': 0,
+            'objects': 0,
+            'not_modified': 0,
+            'errors_injected': 0,
+            'drops_injected': 0,
+            'bytes_sent': 0,
+        }
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self.values[key] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 由 make_server 设置
+    options = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def do_GET(self):
+        self.handle_request(head=False)
+
+    def handle_request(self, head):
+        self.stats.add('requests')
+        path = self.path.split('?', 1)[0]
+        if path == '/_stats':
+            return self.send_json(self.stats.snapshot())
+        if path.endswith('/robots.txt'):
+            return self.send_body(200, b'User-agent: *\n', 'text/plain', head)
+
+        if self.options.latency:
+            time.sleep(self.options.latency)
+
+        host, _, rest = path.lstrip('/').partition('/')
+        name = rest.rsplit('/', 1)[-1]
+        if host == 'github.com' and '/releases/download/' in rest:
+            return self.redirect(name)
+        if host == 'api.github.com' and rest.startswith('repos/') and rest.endswith('/releases/latest'):
+            return self.send_release(rest[len('repos/'):-len('/releases/latest')])
+        if host in ('objects.githubusercontent.com', 'raw.githubusercontent.com', 'codeload.github.com'):
+            size = size_from_name(name)
+            if size is not None:
+                return self.send_object(name, size, head)
+        return self.send_body(404, b'Not Found\n', 'text/plain', head)
+
+    def redirect(self, name):
+        # 与 GitHub 一样签名 5 分钟有效，中转服务据此缓存重定向结果
+        signed_at = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        location = (f'/objects.githubusercontent.com/release-assets/{name}'
+                    f'?X-Amz-Date={signed_at}&X-Amz-Expires=300&X-Amz-Signature={random.getrandbits(64):016x}')
+        self.stats.add('redirects')
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_release(self, repo):
+        etag = '"' + hashlib.md5(f'{repo}:{RELEASE_TAG}'.encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.stats.add('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        base = f'http://{self.headers.get("Host", "127.0.0.1")}/github.com/{repo}/releases/download/{RELEASE_TAG}'
+        release = {
+            'tag_name': RELEASE_TAG,
+            'assets': [
+                {'name': name, 'size': size_from_name(name), 'browser_download_url': f'{base}/{name}'}
+                for name in RELEASE_ASSETS
+            ]
+        }
+        body = json.dumps(release).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_object(self, name, size, head):
+        self.stats.add('objects')
+        etag = etag_for(name, size)
+        if self.headers.get('If-None-Match') == etag:
+            self.stats.add('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        if not head and random.random() < self.options.error_rate:
+            self.stats.add('errors_injected')
+            return self.send_body(503, b'Service Unavailable\n', 'text/plain', head)
+
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') in (None, etag):
+            parsed = parse_range(range_header, size)
+            if parsed is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = parsed
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8' if is_text(name) else 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(0, usegmt=True))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if head:
+            return
+
+        drop_at = None
+        if random.random() < self.options.drop_rate:
+            drop_at = random.randint(0, end - start)
+            self.stats.add('drops_injected')
+        self.write_body(name, start, end, drop_at)
+
+    def write_body(self, name, start, end, drop_at):
+        rate = self.options.bandwidth
+        began = time.monotonic()
+        sent = 0
+        try:
+            for piece in iter_content(name, start, end):
+                if drop_at is not None and sent + len(piece) > drop_at:
+                    self.wfile.write(piece[:drop_at - sent])
+                    self.stats.add('bytes_sent', drop_at - sent)
+                    self.close_connection = True
+                    return
+                self.wfile.write(piece)
+                sent += len(piece)
+                self.stats.add('bytes_sent', len(piece))
+                if rate:
+                    # 按累计字节数计算应到的时间，超前则休眠
+                    ahead = sent / rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send_body(self, status, body, content_type, head):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send_body(200, json.dumps(data).encode('utf-8'), 'application/json', False)
+
+
+def parse_range(header, size):
+    """解析单区间 Range，返回 (start, end)；不可满足时返回 None"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.split(',')[0].strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        start, end = max(0, size - int(match.group(2))), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+def make_server(host, port, latency=0.0, bandwidth=0, error_rate=0.0, drop_rate=0.0):
+    """创建模拟服务器（不启动），port 为 0 时自动分配端口"""
+    options = argparse.Namespace(latency=latency, bandwidth=bandwidth, error_rate=error_rate, drop_rate=drop_rate)
+    handler = type('Handler', (FakeGitHubHandler,), {'options': options, 'stats': Stats()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='本地模拟 GitHub Release 下载（压测用）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9900)
+    parser.add_argument('--latency', type=float, default=0.0, help='响应头之前的延迟（秒）')
+    parser.add_argument('--bandwidth', type=parse_size, default=0, help='每条连接的速率上限，如 4M（字节/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='文件请求返回 503 的概率')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='响应体中途断开连接的概率')
+    parser.add_argument('--seed', type=int, help='故障注入的随机种子')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    server = make_server(args.host, args.port, args.latency, args.bandwidth, args.error_rate, args.drop_rate)
+    print(f'模拟 GitHub 监听 http://{args.host}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
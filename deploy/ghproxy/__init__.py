@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+"""
+GitHub 下载中转服务
+
+两个入口脚本都只是启动本包，所有节点使用同一套缓存、连接池、分段下载与异步服务实现:
+    deploy/guangzhou-github-proxy.py  部署为 /opt/github-proxy/app.py（gunicorn: app:app / app:asgi_app）
+    scripts/github_proxy_gz.py        scripts/deploy_gz.sh 使用（gunicorn: github_proxy_gz:app）
+    python3 -m ghproxy                直接运行
+
+部署时把本目录复制到入口脚本旁边（如 /opt/github-proxy/ghproxy/）。
+
+模块:
+    config     配置定义与加载（运行时配置文件 > 环境变量 > 默认值）
+    buffers    流式块大小与缓冲区内存预算
+    metrics    Prometheus 指标
+    accesslog  结构化访问日志（每个请求一条 JSON 记录，后台线程写出）
+    upstream   上游连接池、出口择优与熔断、分段下载、中断续传
+    peers      多节点分层缓存（一致性哈希归属、节点间请求与故障顺延）
+    cache      磁盘缓存与请求合并
+    responses  两种服务模式共用的响应构造
+    wsgi       线程模式 Flask 应用
+    asgi       ASGI 应用（需要 httpx）
+    server     命令行入口
+"""
+
+import logging
+
+# 子模块导入时就会输出日志（如加载磁盘缓存），需先配置
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+from .config import settings  # noqa: E402
+from .wsgi import app  # noqa: E402
+from .asgi import asgi_app  # noqa: E402
+from .server import main  # noqa: E402
+
+__all__ = ['app', 'asgi_app', 'main', 'settings']
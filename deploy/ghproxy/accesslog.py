@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""
+结构化访问日志
+
+每个请求一条 JSON 记录（一行），字段:
+    time      收到请求的时间（本地时区，ISO 8601）
+    pid       处理请求的 worker
+    method / path / url   请求方法、路径与下载的 GitHub 地址（git 请求为上游地址）
+    client    客户端标识（API key 只保留前 4 位，其余同带宽整形，见 shaping.client_key）
+    upstream  传输经过的上游出口（未访问上游时为 null）
+    cache     X-Cache 缓存状态（HIT / MISS / REVALIDATED / STALE，非下载请求为 null）
+    status    响应状态码
+    bytes     实际发送给客户端的字节数
+    ttfb_ms   收到请求到响应头就绪的时间（未命中时包含等待上游响应头）
+    duration_ms  收到请求到响应发送结束（或客户端断开）的时间
+    outcome   ok / aborted（未发送完整：客户端断开或上游中断）/ error（状态码 >= 400）
+    sample    该记录的采样比例，统计请求数时按 1 / sample 加权
+
+请求线程只创建一个记录对象并在结束时放入有界队列（不格式化、不做 I/O），由后台线程批量序列化写出；
+写出跟不上时丢弃新记录并计入 ghproxy_access_log_dropped_total，不会阻塞下载。
+成功的请求按 GHPROXY_ACCESS_LOG_SAMPLE 采样，出错和中断的请求总是记录。
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from datetime import datetime
+
+from .config import settings
+from .metrics import access_log_dropped_total
+
+logger = logging.getLogger(__name__)
+
+# 后台线程每批最多写出的记录数
+WRITE_BATCH = 512
+# 日志文件被 logrotate 移走后，最迟多久重新打开（秒）
+REOPEN_INTERVAL = 1.0
+
+
+class AccessRecord:
+    """一个请求的访问记录，各字段在处理请求的过程中逐步填入"""
+
+    __slots__ = ('time', 'started', 'method', 'path', 'url', 'client', 'upstream', 'cache',
+                 'status', 'length', 'ttfb', 'bytes', 'duration', 'outcome', 'sample')
+
+    def __init__(self, method, path):
+        self.time = time.time()
+        self.started = time.monotonic()
+        self.method = method
+        self.path = path
+        self.url = None
+        self.client = None
+        self.upstream = None
+        self.cache = None
+        self.status = None
+        self.length = None
+        self.ttfb = None
+        self.bytes = 0
+        self.duration = None
+        self.outcome = None
+        self.sample = 1.0
+
+    def as_dict(self, pid):
+        client = self.client
+        if client and client.startswith('key:'):
+            client = client[:8] + '…'
+        return {
+            'time': datetime.fromtimestamp(self.time).astimezone().isoformat(timespec='milliseconds'),
+            'pid': pid,
+            'method': self.method,
+            'path': self.path,
+            'url': self.url,
+            'client': client,
+            'upstream': self.upstream,
+            'cache': self.cache,
+            'status': self.status,
+            'bytes': self.bytes,
+            'ttfb_ms': round(self.ttfb * 1000, 1) if self.ttfb is not None else None,
+            'duration_ms': round(self.duration * 1000, 1),
+            'outcome': self.outcome,
+            'sample': self.sample
+        }
+
+
+class AccessLog:
+    """访问日志的采集与后台写出（每个进程一个写出线程）"""
+
+    def __init__(self, config):
+        self.target = config.access_log
+        self.sample = min(max(config.access_log_sample, 0.0), 1.0)
+        self.queue_size = max(config.access_log_queue, 1)
+        self._queue = None
+        self._started_pid = None
+        self._lock = threading.Lock()
+        # 当前请求的记录：线程模式下每个线程、ASGI 模式下每个请求任务各自一份
+        self._current = contextvars.ContextVar('access_record', default=None)
+
+    @property
+    def enabled(self):
+        return bool(self.target)
+
+    def start(self):
+        """在本进程启动写出线程（fork 之后每个 worker 各自一个队列和线程）"""
+        if not self.enabled or self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._started_pid = os.getpid()
+        threading.Thread(target=self._write_loop, args=(self._queue,), name='access-log', daemon=True).start()
+
+    def begin(self, method, path):
+        """请求开始：创建记录并设为当前请求的记录，未启用时返回 None"""
+        if not self.enabled:
+            return None
+        self.start()
+        record = AccessRecord(method, path)
+        self._current.set(record)
+        return record
+
+    def note(self, **fields):
+        """在处理请求的过程中补充当前请求的字段（url、upstream）"""
+        record = self._current.get()
+        if record is not None:
+            for name, value in fields.items():
+                setattr(record, name, value)
+
+    def current(self):
+        return self._current.get()
+
+    def respond(self, record, status, headers, client):
+        """响应头就绪：记录状态码、缓存状态、客户端与首字节时间"""
+        record.status = status
+        record.cache = headers.get('X-Cache')
+        record.client = client
+        length = headers.get('Content-Length')
+        # HEAD 与 304 没有消息体
+        if record.method != 'HEAD' and status != 304 and length and str(length).isdigit():
+            record.length = int(length)
+        record.ttfb = time.monotonic() - record.started
+
+    def finish(self, record, nbytes, complete):
+        """
+        响应发送结束：放入写出队列
+
+        参数:
+            nbytes: 发送的字节数，None 表示按 Content-Length 计
+            complete: 消息体是否完整发送（迭代正常结束）
+        """
+        record.duration = time.monotonic() - record.started
+        record.bytes = (record.length or 0) if nbytes is None else nbytes
+        if record.status is not None and record.status >= 400:
+            record.outcome = 'error'
+        elif not complete or (nbytes is not None and record.length is not None and nbytes < record.length):
+            record.outcome = 'aborted'
+        else:
+            record.outcome = 'ok'
+            if self.sample < 1.0:
+                if random.random() >= self.sample:
+                    return
+                record.sample = self.sample
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            access_log_dropped_total.inc()
+
+    def _open(self):
+        if self.target == '-':
+            return sys.stderr
+        return open(self.target, 'a', encoding='utf-8')
+
+    def _write_loop(self, records):
+        pid = os.getpid()
+        out = None
+        opened_ino = None
+        checked = 0
+        while True:
+            batch = [records.get()]
+            try:
+                while len(batch) < WRITE_BATCH:
+                    batch.append(records.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                now = time.monotonic()
+                if out is not None and out is not sys.stderr and now - checked >= REOPEN_INTERVAL:
+                    # logrotate 移走文件后 inode 变化，重新打开
+                    checked = now
+                    try:
+                        if os.stat(self.target).st_ino != opened_ino:
+                            out.close()
+                            out = None
+                    except OSError:
+                        out.close()
+                        out = None
+                if out is None:
+                    out = self._open()
+                    if out is not sys.stderr:
+                        opened_ino = os.fstat(out.fileno()).st_ino
+                        checked = now
+                out.write(''.join(json.dumps(record.as_dict(pid), ensure_ascii=False) + '\n' for record in batch))
+                out.flush()
+            except (OSError, ValueError) as e:
+                access_log_dropped_total.inc(amount=len(batch))
+                logger.warning(f'写入访问日志失败: {str(e)}')
+                if out is not None and out is not sys.stderr:
+                    out.close()
+                out = None
+                time.sleep(REOPEN_INTERVAL)
+
+
+access_log = AccessLog(settings)
@@ -0,0 +1,693 @@
+# -*- coding: utf-8 -*-
+
+"""
+异步（ASGI）服务模式
+
+线程模式下每个进行中的下载占用一个 OS 线程；ASGI 模式在单个事件循环里处理
+/download、/github/<path>、/status 等路由，上游使用 httpx 异步客户端，
+数百上千个慢速客户端只占用少量内存。磁盘缓存、Range、重定向缓存与线程模式共用。
+
+启动方式:
+    GHPROXY_SERVER=asgi python3 -m ghproxy
+    或 uvicorn ghproxy:asgi_app --host 0.0.0.0 --port 18080
+"""
+
+import json
+import time
+import asyncio
+import logging
+
+from .accesslog import access_log
+from .buffers import ChunkSizer, buffers
+from .cache import SpoolFile, cache, flights
+from .git import (
+    GIT_FORWARD_HEADERS, GIT_MAX_REQUEST_BYTES, GitRequest, check_git_request, git_cached_response,
+    git_error_response, git_lookup, git_path, git_response_headers, git_stale_entry
+)
+from .memory import memory_cache
+from .metrics import StreamMeter, metered_source, metrics
+from .peers import HOPS_HEADER, PEER_HEADER, cluster, peer_response_headers
+from .prefetch import ADMIN_MAX_REQUEST_BYTES, prefetch_admin, prefetcher
+from .responses import (
+    cached_response, check_download_url, download_filename, download_response_headers, index, memory_response,
+    range_request_headers, range_response_headers, status_info, upstream_error_status
+)
+from .shaping import client_key, shaper
+from .upstream import SegmentedFetch, UpstreamResumer, async_upstream, httpx, segmentable
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFlight:
+    """
+    ASGI 模式下的一次上游传输（single-flight）
+
+    与 Flight 相同：上游数据写入 SpoolFile，读者各自从文件读取；
+    等待与通知使用 asyncio 原语，文件读写放到线程池中执行以免阻塞事件循环
+    """
+
+    def __init__(self, url, headers, entry, method='GET', data=None, key=None, meta=None, peers=False, hops=0):
+        self.url = url
+        self.headers = headers
+        self.entry = entry
+        self.method = method
+        self.data = data
+        self.key = key or url
+        self.meta = meta
+        self.peers = peers
+        self.hops = hops
+        self.response = None
+        self.error = None
+        self.done = False
+        self.readers = 0
+        self.ready = asyncio.Event()
+        self.cond = asyncio.Condition()
+        self.spool = SpoolFile(cache, self.key)
+        self.task = None
+
+    def open_reader(self):
+        self.readers += 1
+        return AsyncFlightReader(self, open(self.spool.path, 'rb'))
+
+    async def release(self):
+        self.readers -= 1
+
+    async def run(self):
+        try:
+            await self._fetch()
+        except Exception as e:
+            self.error = e
+            if self.readers:
+                logger.error(f'上游传输失败: {self.url}, 错误: {str(e)}')
+            else:
+                logger.info(f'上游传输已终止: {self.url}, 原因: {str(e)}')
+        finally:
+            self.ready.set()
+            self.done = True
+            async with self.cond:
+                self.cond.notify_all()
+            if self.error is None and self.response is not None and self.response.status_code == 200:
+                if cache.cacheable(self.response.headers):
+                    await asyncio.to_thread(self.spool.commit)
+            async_flights.finish(self)
+            await asyncio.to_thread(self.spool.discard)
+
+    async def _fetch(self):
+        r = await cluster.arequest(self.url, self.headers, key=self.key, hops=self.hops) if self.peers else None
+        if r is None:
+            r = await async_upstream.request(self.method, self.url, self.headers, self.data)
+        self.response = r
+        try:
+            if r.status_code == 304 and self.entry:
+                cache.mark_validated(self.key, self.entry)
+            if r.status_code != 200:
+                self.ready.set()
+                return
+
+            self.spool.set_headers(r.headers)
+            if self.meta:
+                self.spool.meta.update(self.meta)
+            cacheable = cache.cacheable(r.headers)
+            self.ready.set()
+
+            if segmentable(r.headers) and not r.route.peer:
+                # 分段连接由线程池中的 SegmentedFetch 管理，数据写入 spool 后通知事件循环中的读者
+                await r.aclose()
+                await asyncio.to_thread(self._segmented_fetch, asyncio.get_running_loop(), r.headers, cacheable)
+                return
+
+            # 不指定 chunk_size：httpx 按网络读取的大小（约 64KB）交付数据，不会攒成大块
+            resumer = UpstreamResumer(self.url, self.headers, r.status_code, r.headers)
+            started = time.monotonic()
+            while True:
+                try:
+                    async for chunk in r.aiter_bytes():
+                        if not chunk:
+                            continue
+                        # 不可缓存且所有客户端都已断开时，没有必要继续拉取
+                        if not cacheable and self.readers == 0:
+                            raise IOError('所有客户端已断开')
+                        await asyncio.to_thread(self.spool.write, chunk)
+                        async with self.cond:
+                            self.cond.notify_all()
+                    break
+                except httpx.TransportError as e:
+                    r.route.record_failure(e)
+                    await r.aclose()
+                    r = await resumer.areopen(self.spool.size, e)
+            r.route.record_transfer(self.spool.size, time.monotonic() - started)
+        finally:
+            await r.aclose()
+            await self.response.aclose()
+
+        if not await asyncio.to_thread(self.spool.complete):
+            raise IOError('上游连接提前关闭')
+
+    def _segmented_fetch(self, loop, upstream_headers, cacheable):
+        def write(chunk):
+            if not cacheable and self.readers == 0:
+                raise IOError('所有客户端已断开')
+            self.spool.write(chunk)
+            asyncio.run_coroutine_threadsafe(self._notify(), loop)
+
+        SegmentedFetch(self.url, self.headers, upstream_headers).run(write)
+        if not self.spool.complete():
+            raise IOError('上游连接提前关闭')
+
+    async def _notify(self):
+        async with self.cond:
+            self.cond.notify_all()
+
+
+class AsyncFlightReader:
+    """AsyncFlight 的一个读者（异步迭代器），aclose() 释放读者"""
+
+    def __init__(self, flight, fh):
+        self.flight = flight
+        self.fh = fh
+        self.pos = 0
+        self.closed = False
+        self.sizer = ChunkSizer()
+        self.reserved = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # 进入下一次迭代说明上一块已经发送完毕
+        self._release()
+        size = self.sizer.next_size()
+        flight = self.flight
+        async with flight.cond:
+            await flight.cond.wait_for(lambda: flight.spool.size > self.pos or flight.done)
+        available = flight.spool.size - self.pos
+        if available > 0:
+            # 预算不足时 reserve() 会阻塞，放在线程池中执行
+            self.reserved, chunk = await asyncio.to_thread(self._read, min(size, available))
+            self.pos += len(chunk)
+            self.sizer.sent(len(chunk))
+            return chunk
+        await self.aclose()
+        if flight.error is not None:
+            raise flight.error
+        raise StopAsyncIteration
+
+    def _read(self, size):
+        size = buffers.reserve(size)
+        return size, self.fh.read(size)
+
+    def _release(self):
+        if self.reserved:
+            buffers.release(self.reserved)
+            self.reserved = 0
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            self._release()
+            self.fh.close()
+            await self.flight.release()
+
+
+class AsyncFlightRegistry:
+    """ASGI 模式下进行中的上游传输表：缓存键（默认为 URL）-> AsyncFlight（只在事件循环线程中访问）"""
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, url, headers, entry, **options):
+        key = options.get('key') or url
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.joined += 1
+            return flight, flight.open_reader()
+        flight = AsyncFlight(url, headers, entry, **options)
+        self._flights[key] = flight
+        self.started += 1
+        reader = flight.open_reader()
+        flight.task = asyncio.ensure_future(flight.run())
+        return flight, reader
+
+    def finish(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stats(self):
+        return {
+            'active': len(self._flights),
+            'started': self.started,
+            'joined': self.joined
+        }
+
+
+class AsyncFileBody:
+    """
+    把 CachedBody（或加入预热传输时的 FlightReader）包装成异步迭代器，每次读取在线程池中执行
+
+    uvicorn 不支持 sendfile，ASGI 模式下零拷贝发送需要配合 Nginx 的 X-Accel-Redirect
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.chunks = iter(body)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await asyncio.to_thread(next, self.chunks, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    async def aclose(self):
+        self.body.close()
+
+
+class AsyncUpstreamBody:
+    """上游 httpx 流式响应体，中断时由 resumer 从已发送的位置续传"""
+
+    def __init__(self, response, resumer):
+        self.response = response
+        self.resumer = resumer
+        self.sent = 0
+        self.chunks = response.aiter_bytes()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            try:
+                chunk = await self.chunks.__anext__()
+            except httpx.TransportError as e:
+                self.response.route.record_failure(e)
+                await self.response.aclose()
+                self.response = await self.resumer.areopen(self.sent, e)
+                self.chunks = self.response.aiter_bytes()
+                continue
+            except StopAsyncIteration:
+                self.response.route.record_transfer(self.sent, 0)
+                raise
+            self.sent += len(chunk)
+            return chunk
+
+    async def aclose(self):
+        await self.response.aclose()
+
+
+def asgi_json(payload, status_code=200):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return status_code, {'Content-Type': 'application/json'}, body
+
+
+async def asgi_respond(receive, send, status_code, headers, body, client=None, record=None):
+    """
+    发送 ASGI 响应
+
+    body 为 bytes 时一次发出；为异步迭代器时流式发送：await send() 会等待传输层排空
+    （背压），同时监听 http.disconnect，客户端断开后立即停止并释放读者。
+    启用带宽整形时流式下载按 client（客户端标识）的速率发送；发送结束后写访问日志（record）
+    """
+    raw_headers = [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+    if isinstance(body, bytes):
+        raw_headers.append((b'content-length', str(len(body)).encode()))
+        await send({'type': 'http.response.start', 'status': status_code, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': body})
+        if record is not None:
+            access_log.finish(record, len(body), True)
+        return
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    source = metered_source(headers)
+    meter = StreamMeter(source) if source else None
+    stream = shaper.open(client) if source and client else None
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': status_code, 'headers': raw_headers})
+        async for chunk in body:
+            if disconnected.is_set():
+                return
+            if stream:
+                wait = stream.reserve(len(chunk))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if meter:
+                meter.add(len(chunk))
+        await send({'type': 'http.response.body', 'body': b''})
+        if meter:
+            meter.complete = True
+    finally:
+        watcher.cancel()
+        await body.aclose()
+        if meter:
+            meter.close()
+        if stream:
+            stream.close()
+        if record is not None:
+            access_log.finish(record, meter.sent if meter else None, meter.complete if meter else True)
+
+
+async def asgi_download(url, request_headers):
+    """
+    ASGI 模式的下载逻辑，与 download_url() 一一对应
+
+    返回:
+        (状态码, 响应头, 消息体)
+    """
+    access_log.note(url=url)
+    error = check_download_url(url)
+    if error:
+        return asgi_json(*error)
+
+    filename = download_filename(url)
+    range_header = request_headers.get('range')
+    if_range = request_headers.get('if-range')
+    # 来自集群中其他节点（密钥一致）的请求不再转发给同级节点，只向上一级节点请求
+    hops = cluster.request_hops(request_headers.get(PEER_HEADER.lower()), request_headers.get(HOPS_HEADER.lower()))
+    from_peer = hops > 0
+
+    def serve_memory(obj, cache_status):
+        status_code, headers, body = memory_response(
+            obj, filename, cache_status, request_headers.get('accept-encoding'),
+            request_headers.get('if-none-match'), request_headers.get('if-modified-since')
+        )
+        if from_peer:
+            peer_response_headers(headers, obj.meta)
+        return status_code, headers, body
+
+    async def serve_cached_async(entry, cache_status):
+        if memory_cache.eligible(entry) and not range_header:
+            # 读文件和预压缩放到线程池中执行
+            obj = await asyncio.to_thread(memory_cache.load, entry)
+            if obj is not None:
+                return serve_memory(obj, cache_status)
+        status_code, headers, body = cached_response(
+            entry, filename, cache_status, range_header, if_range,
+            request_headers.get('if-none-match'), request_headers.get('if-modified-since'),
+            accel=not from_peer
+        )
+        if from_peer:
+            peer_response_headers(headers, entry)
+        return status_code, headers, AsyncFileBody(body)
+
+    obj = memory_cache.get(url)
+    if obj and not range_header:
+        cache.record(hit=True)
+        return serve_memory(obj, 'HIT')
+
+    entry = cache.lookup(url)
+    if entry and cache.is_fresh(entry):
+        cache.record(hit=True)
+        return await serve_cached_async(entry, 'HIT')
+
+    try:
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+
+        if range_header:
+            cache.record(hit=False)
+            headers = range_request_headers(headers, range_header, if_range)
+            r = await cluster.arequest(url, headers, hops=hops)
+            if r is None:
+                r = await async_upstream.request('GET', url, headers)
+            access_log.note(upstream=r.route.name)
+            if r.status_code not in (200, 206, 416):
+                await r.aclose()
+                r.raise_for_status()
+                raise httpx.HTTPError(f'上游返回 HTTP {r.status_code}')
+            resumer = UpstreamResumer(url, headers, r.status_code, r.headers)
+            return r.status_code, range_response_headers(r.headers, filename), AsyncUpstreamBody(r, resumer)
+
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # 后台预热（线程中的 Flight）正在下载同一文件时直接加入，不另外回源；有读者后预热不再限速
+        prefetching = flights.attach(url)
+        if prefetching is not None:
+            flight, reader = prefetching
+            await asyncio.to_thread(flight.ready.wait)
+            r = flight.response
+            if flight.error is None and r is not None and r.status_code == 200:
+                access_log.note(upstream=r.route.name)
+                cache.record(hit=False)
+                response_headers = download_response_headers(filename, flight.spool.expected)
+                if from_peer:
+                    peer_response_headers(response_headers, flight.spool.meta)
+                return 200, response_headers, AsyncFileBody(reader)
+            # 预热失败或上游返回 304 时按正常流程处理
+            reader.close()
+            entry = cache.lookup(url)
+            if entry and cache.is_fresh(entry):
+                cache.record(hit=True)
+                return await serve_cached_async(entry, 'REVALIDATED')
+
+        flight, reader = async_flights.join(url, headers, entry, peers=True, hops=hops)
+        await flight.ready.wait()
+        r = flight.response
+        if r is not None:
+            access_log.note(upstream=r.route.name)
+
+        if r is None:
+            await reader.aclose()
+            if not entry:
+                raise flight.error
+            logger.warning(f'重新验证失败，使用旧缓存: {url}, 错误: {str(flight.error)}')
+            cache.record(hit=True)
+            return await serve_cached_async(entry, 'STALE')
+
+        if r.status_code == 304:
+            await reader.aclose()
+            entry = cache.lookup(url)
+            if entry:
+                cache.record(hit=True)
+                return await serve_cached_async(entry, 'REVALIDATED')
+            raise httpx.HTTPError('缓存条目已失效，请重试')
+
+        if r.status_code != 200:
+            await reader.aclose()
+            r.raise_for_status()
+            raise httpx.HTTPError(f'上游返回 HTTP {r.status_code}')
+
+        cache.record(hit=False)
+        response_headers = download_response_headers(filename, flight.spool.expected)
+        if from_peer:
+            peer_response_headers(response_headers, flight.spool.meta)
+        return 200, response_headers, reader
+
+    except httpx.TimeoutException:
+        logger.error(f'下载超时: {url}')
+        return asgi_json({'error': '下载超时', 'url': url}, 504)
+
+    except httpx.HTTPError as e:
+        logger.error(f'下载失败: {url}, 错误: {str(e)}')
+        status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+        return asgi_json({
+            'error': '下载失败',
+            'details': str(e),
+            'url': url
+        }, upstream_error_status(status_code))
+
+    except Exception as e:
+        logger.error(f'未知错误: {str(e)}')
+        return asgi_json({'error': '服务器内部错误', 'details': str(e)}, 500)
+
+
+async def asgi_read_body(receive, limit):
+    """读取请求体，超过 limit 字节时返回 None"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('客户端已断开')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def asgi_git(scope, receive, request_headers, repo_url, service):
+    """ASGI 模式的 git smart-HTTP 请求，与 git_proxy() 一一对应"""
+    method = scope['method']
+    query = scope['query_string'].decode('latin-1')
+    length = request_headers.get('content-length', '')
+    error = check_git_request(service, method, query, int(length) if length.isdigit() else None)
+    if error:
+        return asgi_json(*error)
+
+    body = None
+    if method == 'POST':
+        body = await asgi_read_body(receive, GIT_MAX_REQUEST_BYTES)
+        if body is None:
+            return asgi_json({'error': '请求体过大'}, 413)
+    headers = {name: request_headers[name.lower()] for name in GIT_FORWARD_HEADERS if name.lower() in request_headers}
+    git_request = GitRequest(repo_url, service, method, headers, query, body)
+    access_log.note(url=git_request.url)
+
+    def serve_cached_async(entry, cache_status):
+        status_code, headers, cached_body = git_cached_response(entry, cache_status)
+        return status_code, headers, AsyncFileBody(cached_body)
+
+    entry = git_lookup(git_request)
+    if entry:
+        cache.record(hit=True)
+        return serve_cached_async(entry, 'HIT')
+
+    try:
+        if git_request.key is None:
+            r = await async_upstream.request(git_request.method, git_request.url, git_request.headers, body)
+            access_log.note(upstream=r.route.name)
+            if r.status_code != 200:
+                await r.aclose()
+                return git_error_response(r.status_code, r.headers)
+            resumer = UpstreamResumer(git_request.url, git_request.headers, r.status_code, r.headers)
+            content_type = r.headers.get('Content-Type', 'application/octet-stream')
+            return 200, git_response_headers(content_type, 'MISS'), AsyncUpstreamBody(r, resumer)
+
+        cache.record(hit=False)
+        flight, reader = async_flights.join(
+            git_request.url, git_request.headers, None,
+            method=git_request.method, data=body, key=git_request.key, meta=git_request.meta
+        )
+        await flight.ready.wait()
+        r = flight.response
+        if r is not None:
+            access_log.note(upstream=r.route.name)
+
+        if r is None:
+            await reader.aclose()
+            entry = git_stale_entry(git_request)
+            if not entry:
+                raise flight.error
+            logger.warning(f'上游不可用，使用旧的引用通告: {git_request.url}, 错误: {str(flight.error)}')
+            return serve_cached_async(entry, 'STALE')
+
+        if r.status_code != 200:
+            await reader.aclose()
+            return git_error_response(r.status_code, r.headers)
+
+        return 200, git_response_headers(r.headers.get('Content-Type', 'application/octet-stream'), 'MISS'), reader
+
+    except httpx.TimeoutException:
+        logger.error(f'git 请求超时: {git_request.url}')
+        return asgi_json({'error': '上游超时', 'url': git_request.url}, 504)
+
+    except httpx.HTTPError as e:
+        logger.error(f'git 请求失败: {git_request.url}, 错误: {str(e)}')
+        return asgi_json({'error': '上游请求失败', 'details': str(e), 'url': git_request.url}, 502)
+
+
+async def asgi_admin_prefetch(scope, receive, request_headers):
+    """Release 预热管理接口，与线程模式的 admin_prefetch() 对应"""
+    payload = None
+    if scope['method'] == 'POST':
+        body = await asgi_read_body(receive, ADMIN_MAX_REQUEST_BYTES)
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = None
+    elif scope['method'] not in ('GET', 'HEAD'):
+        return asgi_json({'error': '请求方法不正确'}, 405)
+    return asgi_json(*prefetch_admin(scope['method'], request_headers.get('authorization'), payload))
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI 入口：路由与线程模式的 Flask 应用保持一致"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_upstream.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    metrics.start_flusher(cache)
+    prefetcher.start()
+    import urllib.parse
+    path = scope['path']
+    record = access_log.begin(scope['method'], path)
+    request_headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+
+    # 下载路由只接受 GET / HEAD（与 Flask 应用一致；git 路由自行检查请求方法）
+    download_route = path == '/download' or (
+        path.startswith('/github/') and len(path) > len('/github/') and not git_path(path[len('/github/'):]))
+
+    if download_route and scope['method'] not in ('GET', 'HEAD'):
+        status_code, headers, body = asgi_json({'error': '请求方法不正确'}, 405)
+        headers['Allow'] = 'GET, HEAD'
+        response = status_code, headers, body
+    elif path == '/':
+        response = 200, {'Content-Type': 'text/html; charset=utf-8'}, index().encode('utf-8')
+    elif path == '/status':
+        response = asgi_json(status_info(async_flights, async_upstream))
+    elif path == '/health':
+        response = asgi_json({'status': 'healthy'})
+    elif path == '/metrics':
+        response = 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, metrics.render(cache).encode('utf-8')
+    elif path == '/download':
+        query = urllib.parse.parse_qs(scope['query_string'].decode('latin-1'))
+        response = await asgi_download(query.get('url', [None])[0], request_headers)
+    elif path == '/admin/prefetch':
+        response = await asgi_admin_prefetch(scope, receive, request_headers)
+    elif path.startswith('/github/') and git_path(path[len('/github/'):]):
+        response = await asgi_git(scope, receive, request_headers, *git_path(path[len('/github/'):]))
+    elif path.startswith('/github/') and len(path) > len('/github/'):
+        url = f'https://github.com/{path[len("/github/"):]}'
+        if scope['query_string']:
+            url += '?' + scope['query_string'].decode('latin-1')
+        response = await asgi_download(url, request_headers)
+    else:
+        response = asgi_json({'error': 'Not Found'}, 404)
+
+    status_code, headers, body = response
+    client = client_key(
+        shaper.trusted_key(request_headers.get(shaper.key_header.lower())) if shaper.key_header else None,
+        request_headers.get('x-real-ip'), (scope.get('client') or ('',))[0]
+    )
+    # 集群内其他节点（带共享密钥）的请求不参与带宽整形
+    shaped = not cluster.trusted(request_headers.get(PEER_HEADER.lower()))
+    if shaped:
+        shaper.limit_accel(headers, client)
+    if record is not None:
+        access_log.respond(record, status_code, headers, client)
+    if scope['method'] == 'HEAD':
+        if not isinstance(body, bytes):
+            await body.aclose()
+            body = b''
+        await send({
+            'type': 'http.response.start',
+            'status': status_code,
+            'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        if record is not None:
+            access_log.finish(record, 0, True)
+        return
+    await asgi_respond(receive, send, status_code, headers, body, client if shaped else None, record)
+
+
+async_flights = AsyncFlightRegistry()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+流式传输的块大小与进程内缓冲区内存预算
+"""
+
+import time
+import threading
+
+from .config import settings
+
+# 流式传输块大小：在 CHUNK_MIN ~ CHUNK_SIZE 之间按文件大小和客户端接收速度自适应
+CHUNK_SIZE = 1024 * 1024
+CHUNK_MIN = 64 * 1024
+# 每块数据的目标发送时长（秒）：块大小约为 客户端速度 × CHUNK_INTERVAL
+CHUNK_INTERVAL = 0.25
+
+
+class BufferBudget:
+    """
+    进程内在途缓冲区的内存预算
+
+    - 上游读取使用 acquire() 取得的 bytearray，readinto 反复填充，用完 give_back() 放回空闲列表复用
+    - 发给客户端的块（WSGI/ASGI 要求 bytes，无法复用）读取前 reserve()，发送完成后 release()
+    - 在途总量接近预算时缩小块大小，仍不足 CHUNK_MIN 时等待其他传输归还
+    """
+
+    # 每种尺寸最多保留的空闲缓冲区个数
+    FREE_PER_SIZE = 8
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+        self.allocated = 0
+        self.reused = 0
+        self._free = {}  # 缓冲区大小 -> [bytearray]
+        self._cond = threading.Condition()
+
+    def reserve(self, size):
+        """登记 size 字节，返回实际批准的字节数（预算紧张时缩小，但不小于 CHUNK_MIN）"""
+        floor = min(size, CHUNK_MIN)
+        with self._cond:
+            if self.in_use and self.max_bytes - self.in_use < floor:
+                self.waits += 1
+                self._cond.wait_for(lambda: not self.in_use or self.max_bytes - self.in_use >= floor)
+            size = max(min(size, self.max_bytes - self.in_use), floor)
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+            return size
+
+    def release(self, size):
+        with self._cond:
+            self.in_use -= size
+            self._cond.notify_all()
+
+    def acquire(self, size):
+        """取得可复用的缓冲区，大小按 2 的幂取整（不超过批准的字节数，至少 CHUNK_MIN），计入预算"""
+        granted = self.reserve(max(size, CHUNK_MIN))
+        size = CHUNK_MIN
+        while size * 2 <= granted:
+            size *= 2
+        if granted > size:
+            self.release(granted - size)
+        with self._cond:
+            free = self._free.get(size)
+            if free:
+                self.reused += 1
+                return free.pop()
+            self.allocated += 1
+        return bytearray(size)
+
+    def hold(self, size, ready=None):
+        """
+        整块登记 size 字节（分段下载的重排缓冲），超出预算时等待其他传输归还
+
+        ready() 为真时不再等待直接登记：按顺序写出的下一段必须能取得内存，否则各个分段下载
+        都在等待被后面的段占住的预算；超出预算的部分以每个分段下载一段为限
+        """
+        with self._cond:
+            if self.in_use and self.in_use + size > self.max_bytes and not (ready and ready()):
+                self.waits += 1
+                self._cond.wait_for(
+                    lambda: not self.in_use or self.in_use + size <= self.max_bytes or (ready and ready()))
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+
+    def wake(self):
+        """hold() 的 ready 条件可能已变化，唤醒等待者重新检查"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def give_back(self, buf):
+        with self._cond:
+            free = self._free.setdefault(len(buf), [])
+            if len(free) < self.FREE_PER_SIZE:
+                free.append(buf)
+        self.release(len(buf))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_bytes': self.max_bytes,
+                'in_use': self.in_use,
+                'peak': self.peak,
+                'waits': self.waits,
+                'allocated': self.allocated,
+                'reused': self.reused
+            }
+
+
+class ChunkSizer:
+    """
+    发给客户端的块大小
+
+    从 CHUNK_MIN 开始（小文件首字节更快）；两次取块之间的间隔就是上一块写入 socket 的耗时，
+    据此估算客户端接收速度，块大小取约 CHUNK_INTERVAL 秒的数据量，每次最多翻倍，
+    限制在 [CHUNK_MIN, CHUNK_SIZE]。慢速客户端因此只占用小块内存
+    """
+
+    def __init__(self):
+        self.size = CHUNK_MIN
+        self._sent = 0
+        self._sent_at = None
+
+    def next_size(self, remaining=None):
+        if self._sent_at is not None:
+            elapsed = time.monotonic() - self._sent_at
+            target = self._sent / elapsed * CHUNK_INTERVAL if elapsed > 0 else CHUNK_SIZE
+            self.size = int(max(CHUNK_MIN, min(CHUNK_SIZE, self.size * 2, target)))
+        if remaining is not None:
+            return min(self.size, remaining)
+        return self.size
+
+    def sent(self, n):
+        self._sent = n
+        self._sent_at = time.monotonic()
+
+
+buffers = BufferBudget(settings.buffer_budget)
@@ -0,0 +1,667 @@
+# -*- coding: utf-8 -*-
+
+"""
+磁盘缓存与请求合并
+
+- DiskCache: 以 URL 为键的磁盘 LRU 缓存，多个 worker 进程共用
+- SpoolFile: 传输中的临时文件，完整且可缓存时提交到缓存
+- Flight / FlightRegistry: 同一 URL 的并发请求共享一次上游传输（线程模式）
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .config import settings
+from .buffers import CHUNK_MIN, CHUNK_SIZE, ChunkSizer, buffers
+from .metrics import cache_requests_total
+from .peers import cluster
+from .upstream import RESUMABLE_ERRORS, SegmentedFetch, UpstreamResumer, segmentable, upstream
+
+logger = logging.getLogger(__name__)
+
+# 多 worker 部署时重新扫描缓存目录、统计其他进程写入量的间隔（秒）
+CACHE_RESCAN_INTERVAL = 60
+
+
+# 完整的提交 SHA（路径中出现时内容由提交确定）
+COMMIT_SHA = re.compile(r'^[0-9a-f]{40}$')
+# 源码归档的扩展名
+ARCHIVE_SUFFIX = re.compile(r'\.(tar\.gz|tgz|zip)$')
+
+
+def is_immutable_url(url):
+    """
+    判断 URL 是否指向不可变资源
+
+    - GitHub Release 资源（/releases/download/<tag>/<file>）发布后内容不会变化；
+      /releases/latest/download/ 会随新版本变化，不在此列
+    - 按提交 SHA 访问的文件与源码归档（raw.githubusercontent.com/<owner>/<repo>/<sha>/...、
+      codeload.github.com/<owner>/<repo>/tar.gz/<sha>、github.com/<owner>/<repo>/archive/<sha>.zip 等）
+    """
+    import urllib.parse
+    path = urllib.parse.urlparse(url).path
+    if '/releases/download/' in path:
+        return True
+    # 前两段是 owner / repo
+    return any(COMMIT_SHA.match(ARCHIVE_SUFFIX.sub('', part)) for part in path.split('/')[3:])
+
+
+def revalidate_interval(url):
+    """
+    可变资源的重新验证间隔（秒）
+
+    raw 文件和源码归档按分支访问时变化频繁，使用较短的 GHPROXY_RAW_TTL，其余使用 GHPROXY_CACHE_REVALIDATE
+    """
+    import urllib.parse
+    parsed = urllib.parse.urlparse(url)
+    host = parsed.netloc.lower()
+    if host in ('raw.githubusercontent.com', 'codeload.github.com'):
+        return settings.raw_ttl
+    if host == 'github.com' and re.match(r'^/[^/]+/[^/]+/(raw|archive)/', parsed.path):
+        return settings.raw_ttl
+    return settings.cache_revalidate
+
+
+def pid_alive(pid):
+    """进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DiskCache:
+    """
+    磁盘内容缓存
+
+    - 以上游 URL 的 SHA-256 作为键，内容存于 <key>.data，元数据存于 <key>.json
+    - 按最近访问时间做 LRU 淘汰，总大小不超过 max_bytes
+    - 元数据记录 ETag / Last-Modified，用于向上游发起条件请求重新验证
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> 文件大小，按访问时间排序
+        self._total = 0
+        self._scanned_at = 0
+
+        if self.enabled:
+            try:
+                os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+                self._clean_tmp()
+                with self._lock:
+                    self._scan_locked(prune=True)
+                logger.info(f'磁盘缓存已加载: {len(self._index)} 个文件, {self._total} bytes')
+            except OSError as e:
+                logger.warning(f'缓存目录不可用，已关闭磁盘缓存: {root}, 错误: {str(e)}')
+                self.enabled = False
+
+    @staticmethod
+    def key_for(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key[:2], key)
+        return base + '.data', base + '.json'
+
+    def _clean_tmp(self):
+        """
+        清理已退出进程留下的临时文件
+
+        多个 worker 进程共用缓存目录，各自的传输中文件放在 tmp/<pid>/ 下，
+        只删除进程已不存在的目录，不影响正在传输的其他 worker
+        """
+        tmp_dir = os.path.join(self.root, 'tmp')
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            if name.isdigit() and pid_alive(int(name)):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _scan_locked(self, prune=False):
+        """
+        扫描缓存目录重建索引，按数据文件 mtime（最近访问时间）排序
+
+        启动时 prune=True 删除不完整的条目；运行中定期重扫只是为了把其他 worker
+        写入的文件计入容量，不删除（可能正在被其他 worker 写入）
+        """
+        entries = []
+        for sub in os.listdir(self.root):
+            sub_dir = os.path.join(self.root, sub)
+            if sub == 'tmp' or not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if not name.endswith('.json'):
+                    continue
+                key = name[:-5]
+                data_path, meta_path = self._paths(key)
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    st = os.stat(data_path)
+                except (OSError, ValueError):
+                    if prune:
+                        self._unlink(key)
+                    continue
+                if st.st_size != meta.get('size'):
+                    if prune:
+                        self._unlink(key)
+                    continue
+                entries.append((st.st_mtime, key, st.st_size))
+
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total = sum(self._index.values())
+        self._scanned_at = time.time()
+        self._evict_locked()
+
+    def _unlink(self, key):
+        for path in self._paths(key):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _evict_locked(self):
+        while self._total > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            self._unlink(key)
+            logger.info(f'缓存淘汰: {key} ({size} bytes)')
+
+    def lookup(self, url):
+        """
+        查找缓存条目
+
+        返回:
+            元数据 dict（附带 path 字段），未命中返回 None
+        """
+        if not self.enabled:
+            return None
+        key = self.key_for(url)
+        with self._lock:
+            known = key in self._index
+            if known:
+                self._index.move_to_end(key)
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            # 数据文件 mtime 即最近访问时间，重启后用于恢复 LRU 顺序
+            os.utime(data_path)
+        except (OSError, ValueError):
+            if known:
+                self.remove(url)
+            return None
+        if not known:
+            # 其他 worker 进程写入的条目
+            with self._lock:
+                if key not in self._index:
+                    self._index[key] = meta.get('size', 0)
+                    self._total += meta.get('size', 0)
+        meta['path'] = data_path
+        return meta
+
+    def is_fresh(self, meta):
+        """不可变资源永远新鲜，其余资源在重新验证间隔（条目自带 ttl 时按 ttl）内视为新鲜"""
+        if meta.get('immutable'):
+            return True
+        ttl = meta.get('ttl')
+        if ttl is None:
+            url = meta.get('url', '')
+            # 早于按提交 SHA 判断不可变的规则写入的条目
+            if is_immutable_url(url):
+                return True
+            ttl = revalidate_interval(url)
+        return time.time() - meta.get('validated_at', 0) < ttl
+
+    def mark_validated(self, url, meta):
+        """上游返回 304 后刷新验证时间"""
+        meta = {k: v for k, v in meta.items() if k != 'path'}
+        meta['validated_at'] = time.time()
+        self._write_meta(self.key_for(url), meta)
+
+    def remove(self, url):
+        key = self.key_for(url)
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._total -= size
+            self._unlink(key)
+
+    def cacheable(self, upstream_headers):
+        """上游声明 no-store、或内容超过缓存容量时不缓存"""
+        if not self.enabled:
+            return False
+        if 'no-store' in upstream_headers.get('Cache-Control', '').lower():
+            return False
+        length = upstream_headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            return False
+        return True
+
+    @property
+    def spool_dir(self):
+        """传输中文件的存放目录：与缓存同盘以便完成后以硬链接加入缓存，每个进程一个子目录"""
+        if self.enabled:
+            path = os.path.join(self.root, 'tmp', str(os.getpid()))
+            os.makedirs(path, exist_ok=True)
+            return path
+        return tempfile.gettempdir()
+
+    def worker_spool_dirs(self):
+        """其他仍在运行的 worker 的 spool 目录（汇总 /metrics 用）"""
+        tmp_dir = os.path.join(self.root, 'tmp')
+        return [
+            os.path.join(tmp_dir, name) for name in os.listdir(tmp_dir)
+            if name.isdigit() and int(name) != os.getpid() and pid_alive(int(name))
+        ]
+
+    def _write_meta(self, key, meta):
+        _, meta_path = self._paths(key)
+        tmp_path = os.path.join(self.spool_dir, uuid.uuid4().hex + '.json')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def _commit(self, url, tmp_path, meta):
+        key = self.key_for(url)
+        data_path, _ = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        with self._lock:
+            # 多进程部署时其他 worker 也在写入缓存，定期重扫目录使容量统计接近实际占用
+            if time.time() - self._scanned_at > CACHE_RESCAN_INTERVAL:
+                self._scan_locked()
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._total -= old_size
+            os.replace(tmp_path, data_path)
+            self._write_meta(key, meta)
+            self._index[key] = meta['size']
+            self._total += meta['size']
+            self._evict_locked()
+        logger.info(f'已缓存: {url} ({meta["size"]} bytes)')
+        return data_path
+
+    def record(self, hit):
+        cache_requests_total.inc('hit' if hit else 'miss')
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._index),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class SpoolFile:
+    """
+    上游数据的落盘文件
+
+    传输过程中写入临时文件（每块 flush，供并发读者读取），
+    完整接收且可缓存时以硬链接原子地加入缓存；临时文件名在传输结束后删除。
+    写入时顺带计算 SHA-256（数据按顺序追加，续传和分段拉取也一样），提交时记入元数据，
+    命中时作为 ETag / Repr-Digest 返回，不需要再读一遍文件
+    """
+
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.url = url
+        self.size = 0
+        self.expected = None
+        self.meta = None
+        self.digest = hashlib.sha256()
+        self.path = os.path.join(cache.spool_dir, uuid.uuid4().hex + '.data')
+        self.file = open(self.path, 'wb')
+
+    def set_headers(self, upstream_headers):
+        self.meta = {
+            'url': self.url,
+            'etag': upstream_headers.get('ETag'),
+            'last_modified': upstream_headers.get('Last-Modified'),
+            'content_type': upstream_headers.get('Content-Type', 'application/octet-stream'),
+            'immutable': is_immutable_url(self.url)
+        }
+        # 上游压缩传输时 Content-Length 与解压后的字节数不一致，不能用于校验
+        length = upstream_headers.get('Content-Length')
+        if length and length.isdigit() and not upstream_headers.get('Content-Encoding'):
+            self.expected = int(length)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.file.flush()
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def complete(self):
+        """全部数据已写入：校验长度，返回是否完整"""
+        self.file.close()
+        if self.expected is not None and self.size != self.expected:
+            logger.warning(f'上游数据不完整: {self.url} ({self.size}/{self.expected} bytes)')
+            return False
+        return True
+
+    def commit(self):
+        """
+        加入磁盘缓存
+
+        以硬链接加入而不是重命名：path 在 discard() 之前一直有效，提交（可能要等缓存锁和淘汰）
+        期间新加入的读者照常打开它，调用方不必持有 Flight 的锁
+        """
+        if self.size > self.cache.max_bytes:
+            return False
+        self.meta['size'] = self.size
+        self.meta['sha256'] = self.digest.hexdigest()
+        self.meta['validated_at'] = time.time()
+        link_path = self.path + '.commit'
+        try:
+            os.link(self.path, link_path)
+            self.cache._commit(self.url, link_path, self.meta)
+        except OSError as e:
+            logger.warning(f'缓存写入失败: {self.url}, 错误: {str(e)}')
+            try:
+                os.unlink(link_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+cache = DiskCache(settings.cache_dir, settings.cache_max_bytes)
+
+
+class Flight:
+    """
+    一次上游传输（single-flight）
+
+    同一 URL 的并发请求共享同一个 Flight：后台线程把上游数据写入 SpoolFile，
+    每个客户端持有自己的文件句柄，按各自的速度读取已写入的部分。
+
+    默认以 URL 为缓存键发起 GET；git 请求等带请求体的传输另行指定 method / data、
+    缓存键 key 和写入条目的附加元数据 meta；后台预热的传输带 limiter（RateLimiter），
+    没有客户端读者时按其限速；peers 为 True 时先向集群中负责该文件的节点请求（见 peers.py），
+    hops 为请求已经过的节点数（其他节点转发来的请求只再向上一级节点请求）
+    """
+
+    def __init__(self, url, headers, entry, method='GET', data=None, key=None, meta=None, limiter=None,
+                 peers=False, hops=0):
+        self.url = url
+        self.headers = headers
+        self.entry = entry
+        self.method = method
+        self.data = data
+        self.key = key or url
+        self.meta = meta
+        self.limiter = limiter
+        self.peers = peers
+        self.hops = hops
+        self.response = None
+        self.error = None
+        self.done = False
+        self.readers = 0
+        self.ready = threading.Event()
+        self.cond = threading.Condition()
+        self.spool = SpoolFile(cache, self.key)
+
+    def open_reader(self):
+        """注册一个读者并打开 spool 文件（调用方持有 flights 锁）"""
+        with self.cond:
+            self.readers += 1
+            return FlightReader(self, open(self.spool.path, 'rb'))
+
+    def release(self):
+        with self.cond:
+            self.readers -= 1
+            self.cond.notify_all()
+
+    def run(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                readers = self.readers
+            if readers:
+                logger.error(f'上游传输失败: {self.url}, 错误: {str(e)}')
+            else:
+                logger.info(f'上游传输已终止: {self.url}, 原因: {str(e)}')
+        finally:
+            self.ready.set()
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+            if self.error is None and self.response is not None and self.response.status_code == 200:
+                if cache.cacheable(self.response.headers):
+                    self.spool.commit()
+            flights.finish(self)
+            self.spool.discard()
+
+    def _fetch(self):
+        r = cluster.request(self.url, self.headers, settings.timeout, key=self.key, hops=self.hops) if self.peers else None
+        if r is None:
+            r = upstream.request(self.method, self.url, self.headers, timeout=settings.timeout, data=self.data)
+        self.response = r
+        with r:
+            if r.status_code == 304 and self.entry:
+                cache.mark_validated(self.key, self.entry)
+            if r.status_code != 200:
+                self.ready.set()
+                return
+
+            self.spool.set_headers(r.headers)
+            if self.meta:
+                self.spool.meta.update(self.meta)
+            cacheable = cache.cacheable(r.headers)
+            self.ready.set()
+
+            # 其他节点在局域网内，且已经在对方完成分段下载
+            if segmentable(r.headers) and not r.route.peer:
+                SegmentedFetch(self.url, self.headers, r.headers, first=r).run(
+                    lambda chunk: self._write(chunk, cacheable))
+            else:
+                self._ingest(r, cacheable)
+
+        if not self.spool.complete():
+            raise IOError('上游连接提前关闭')
+
+    def _ingest(self, r, cacheable):
+        # 读入复用的缓冲区：小文件按 Content-Length 分配，
+        # 读取量从 CHUNK_MIN 起逐次翻倍，首批数据尽快交给读者
+        resumer = UpstreamResumer(self.url, self.headers, r.status_code, r.headers)
+        r.raw.decode_content = True
+        buf = buffers.acquire(min(self.spool.expected or CHUNK_SIZE, CHUNK_SIZE))
+        view = memoryview(buf)
+        size = min(CHUNK_MIN, len(buf))
+        started = time.monotonic()
+        try:
+            while True:
+                try:
+                    n = r.raw.readinto(view[:size])
+                    if not n and self.spool.expected is not None and self.spool.size < self.spool.expected:
+                        raise IOError('上游连接提前关闭')
+                except RESUMABLE_ERRORS as e:
+                    r.route.record_failure(e)
+                    if r is not self.response:
+                        r.close()
+                    r = resumer.reopen(self.spool.size, e)
+                    r.raw.decode_content = True
+                    continue
+                if not n:
+                    r.route.record_transfer(self.spool.size, time.monotonic() - started)
+                    break
+                self._write(view[:n], cacheable)
+                size = min(size * 2, len(buf))
+        finally:
+            view.release()
+            buffers.give_back(buf)
+            if r is not self.response:
+                r.close()
+
+    def _write(self, chunk, cacheable):
+        with self.cond:
+            # 不可缓存且所有客户端都已断开时，没有必要继续拉取
+            if not cacheable and self.readers == 0:
+                raise IOError('所有客户端已断开')
+            self.spool.write(chunk)
+            self.cond.notify_all()
+            throttled = self.limiter is not None and self.readers == 0
+        # 有用户加入后不再限速
+        if throttled:
+            self.limiter.consume(len(chunk))
+
+
+class FlightReader:
+    """
+    Flight 的一个读者（WSGI 响应体）
+
+    从 spool 文件读取已写入的数据，追上写入位置后等待；
+    实现 close() 以便客户端断开时由 WSGI 服务器释放读者
+    """
+
+    def __init__(self, flight, fh):
+        self.flight = flight
+        self.fh = fh
+        self.pos = 0
+        self.closed = False
+        self.sizer = ChunkSizer()
+        self.reserved = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # 进入下一次迭代说明上一块已经发送完毕
+        self._release()
+        size = self.sizer.next_size()
+        flight = self.flight
+        with flight.cond:
+            while flight.spool.size <= self.pos and not flight.done:
+                flight.cond.wait()
+            available = flight.spool.size - self.pos
+            error = flight.error
+        if available > 0:
+            self.reserved = buffers.reserve(min(size, available))
+            chunk = self.fh.read(self.reserved)
+            self.pos += len(chunk)
+            self.sizer.sent(len(chunk))
+            return chunk
+        self.close()
+        if error is not None:
+            # 响应头已发出，只能中断连接让客户端感知下载不完整
+            raise error
+        raise StopIteration
+
+    def _release(self):
+        if self.reserved:
+            buffers.release(self.reserved)
+            self.reserved = 0
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._release()
+            self.fh.close()
+            self.flight.release()
+
+
+class FlightRegistry:
+    """进行中的上游传输表：缓存键（默认为 URL）-> Flight"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, url, headers, entry, **options):
+        """
+        加入 URL（或 options 中的 key）对应的传输，不存在时发起新的传输
+
+        options 原样传给 Flight（method、data、key、meta、limiter）
+
+        返回:
+            (flight, FlightReader)
+        """
+        key = options.get('key') or url
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.joined += 1
+                return flight, flight.open_reader()
+            flight = Flight(url, headers, entry, **options)
+            self._flights[key] = flight
+            self.started += 1
+            reader = flight.open_reader()
+        threading.Thread(target=flight.run, name='flight', daemon=True).start()
+        return flight, reader
+
+    def attach(self, key):
+        """
+        只加入已在进行的传输，不发起新的传输
+
+        ASGI 模式的请求用它加入后台预热（线程中的 Flight）的传输
+
+        返回:
+            (flight, FlightReader)，没有进行中的传输时返回 None
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                return None
+            self.joined += 1
+            return flight, flight.open_reader()
+
+    def finish(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._flights),
+                'started': self.started,
+                'joined': self.joined
+            }
+
+
+flights = FlightRegistry()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+配置定义与加载
+
+所有配置项集中在 SETTINGS 中定义（名称、类型、默认值、说明），取值优先级:
+    运行时配置文件（GHPROXY_ENV_FILE，默认 /etc/github-proxy/proxy.env）> 环境变量 > 默认值
+
+配置文件与 gunicorn.conf.py 使用同一格式（KEY=VALUE，每行一个，# 开头为注释），
+gunicorn 重载时新 worker 会重新加载配置。查看生效的配置:
+    python3 -m ghproxy --check-config
+"""
+
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 ** 3
+
+
+class ConfigError(ValueError):
+    """配置值无法解析"""
+
+
+class Setting:
+    """一个配置项：环境变量名、类型（str / int / float）、默认值和说明"""
+
+    def __init__(self, name, type, default, help_text):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.help_text = help_text
+
+    @property
+    def attr(self):
+        """Settings 上的属性名：去掉 GHPROXY_ 前缀后转小写"""
+        return self.name[len('GHPROXY_'):].lower() if self.name.startswith('GHPROXY_') else self.name.lower()
+
+    def parse(self, value):
+        if self.type is str:
+            return value
+        try:
+            return self.type(value)
+        except ValueError:
+            raise ConfigError(f'{self.name} 应为 {self.type.__name__}，实际为 {value!r}') from None
+
+
+SETTINGS = (
+    # 服务
+    Setting('GHPROXY_SERVER', str, 'threaded', '服务模式: threaded（Flask 多线程）或 asgi（uvicorn + httpx）'),
+    Setting('GHPROXY_BIND', str, '0.0.0.0:18080', '监听地址（直接运行和 gunicorn 共用）'),
+    Setting('GHPROXY_ACCESS_LOG', str, '-', '结构化访问日志（每个请求一行 JSON）：- 为标准错误（journald），文件路径为追加写入，为空关闭'),
+    Setting('GHPROXY_ACCESS_LOG_SAMPLE', float, 1.0, '成功请求的访问日志采样比例（0~1），出错和中断的请求总是记录'),
+    Setting('GHPROXY_ACCESS_LOG_QUEUE', int, 10000, '访问日志队列长度，写出跟不上时丢弃新记录'),
+
+    # 上游出口
+    Setting('HTTP_PROXY', str, 'http://127.0.0.1:8118', '上游 HTTP 代理，为空表示直连'),
+    Setting('HTTPS_PROXY', str, None, 'HTTPS 代理（默认同 HTTP_PROXY）'),
+    Setting('GHPROXY_UPSTREAMS', str, '', '逗号分隔的多个上游出口，direct 表示直连（默认只使用 HTTP_PROXY / HTTPS_PROXY）'),
+    Setting('GHPROXY_UPSTREAM_PROBE_URL', str, 'https://github.com/robots.txt', '上游出口健康探测地址'),
+    Setting('GHPROXY_UPSTREAM_PROBE_INTERVAL', int, 30, '健康探测间隔（秒，0 关闭；只有一个出口时不探测）'),
+    Setting('GHPROXY_UPSTREAM_FAILURES', int, 3, '连续失败多少次后熔断'),
+    Setting('GHPROXY_UPSTREAM_COOLDOWN', int, 30, '熔断后多久放行一次试探（秒，试探失败则翻倍，最长 300）'),
+    Setting('GHPROXY_CONNECT_TIMEOUT', float, 10, '上游建连超时（秒）'),
+    Setting('GHPROXY_READ_TIMEOUT', float, 60, '上游读取超时（秒），超时后续传'),
+
+    # 连接池与重定向
+    Setting('GHPROXY_POOL_SIZE', int, 32, '每个上游主机保留的最大连接数'),
+    Setting('GHPROXY_POOL_KEEPALIVE', int, 60, 'TCP keepalive 探测前的空闲秒数'),
+    Setting('GHPROXY_POOL_IDLE_TIMEOUT', int, 300, '主机连接池空闲多久后关闭（秒）'),
+    Setting('GHPROXY_REDIRECT_TTL', int, 240, '重定向目标最长缓存时间（秒，0 关闭）'),
+    Setting('GHPROXY_REDIRECT_MARGIN', int, 60, '距签名过期至少保留的秒数'),
+
+    # 传输
+    Setting('GHPROXY_BUFFER_BUDGET', int, 256 * MB, '每个进程在途缓冲区的内存上限（字节）'),
+    Setting('GHPROXY_SEGMENTS', int, 1, '大文件分段并行下载的最大连接数（1 为不分段）'),
+    Setting('GHPROXY_SEGMENT_MIN', int, 64 * MB, '启用分段的最小文件大小（字节）'),
+    Setting('GHPROXY_SEGMENT_SIZE', int, 8 * MB, '每段大小（字节）'),
+    Setting('GHPROXY_RESUME_RETRIES', int, 5, '上游传输中断后最多续传次数（0 关闭）'),
+
+    # 带宽整形（修改配置文件后无需重启）
+    Setting('GHPROXY_BANDWIDTH_TOTAL', int, 0, '发送给客户端的总带宽（字节/秒，0 不限；多 worker 时按 worker 数平分），按权重在活跃客户端之间分配'),
+    Setting('GHPROXY_BANDWIDTH_PER_CLIENT', int, 0, '单个客户端（所有并行下载合计）的带宽上限（字节/秒，0 不限）'),
+    Setting('GHPROXY_BANDWIDTH_WEIGHTS', str, '', '客户端权重（逗号分隔的 API key 或 IP=权重，默认 1）'),
+    Setting('GHPROXY_CLIENT_KEY_HEADER', str, 'X-Api-Key', '标识客户端的请求头，只认 GHPROXY_BANDWIDTH_WEIGHTS 中配置过的 API key（其余按 X-Real-IP / 来源 IP 区分）'),
+
+    # 磁盘缓存
+    Setting('GHPROXY_CACHE_DIR', str, '/var/cache/github-proxy', '缓存目录'),
+    Setting('GHPROXY_CACHE_MAX_BYTES', int, 20 * GB, '缓存容量上限（字节，0 关闭缓存）'),
+    Setting('GHPROXY_CACHE_REVALIDATE', int, 300, '非 Release 资源的重新验证间隔（秒）'),
+    Setting('GHPROXY_RAW_TTL', int, 60, 'raw / codeload 按分支或标签访问的文件的重新验证间隔（秒；按提交 SHA 访问的不过期）'),
+    Setting('GHPROXY_MEMCACHE_MAX_BYTES', int, 64 * MB, '小文件内存缓存容量（字节，含预压缩版本，0 关闭）'),
+    Setting('GHPROXY_MEMCACHE_MAX_OBJECT', int, 1 * MB, '载入内存缓存的单个文件大小上限（字节）'),
+    Setting('GHPROXY_MEMCACHE_COMPRESS', str, 'gzip,br', '内存缓存中文本文件的预压缩格式（逗号分隔，gzip / br，为空不压缩；br 需要 brotli）'),
+    Setting('GHPROXY_GIT_REFS_TTL', int, 60, 'git 引用通告（info/refs、协议 v2 ls-refs）的缓存时间（秒，0 不缓存）'),
+    Setting('GHPROXY_ACCEL_REDIRECT', str, '', 'Nginx internal location 前缀，设置后缓存命中通过 X-Accel-Redirect 由 Nginx 发送'),
+
+    # 多节点分层缓存
+    Setting('GHPROXY_PEERS', str, '', '同一集群所有节点的地址（逗号分隔，如 http://10.0.0.1:18080），未命中时先向负责该文件的节点请求'),
+    Setting('GHPROXY_PEER_SELF', str, '', '本节点在 GHPROXY_PEERS 中的地址'),
+    Setting('GHPROXY_PEER_PARENT', str, '', '上一级节点地址（如香港节点），本节点负责的文件回源前先向它请求'),
+    Setting('GHPROXY_PEER_TOKEN', str, '', '节点间请求的共享密钥（X-Ghproxy-Peer 头），启用集群时必填；匹配的请求不参与带宽整形'),
+
+    # Release 预热
+    Setting('GHPROXY_PREFETCH_REPOS', str, '', '跟踪的仓库（逗号分隔，owner/repo 或 owner/repo:模式1|模式2），新 Release 的资源预先下载进缓存'),
+    Setting('GHPROXY_PREFETCH_INTERVAL', int, 600, '查询最新 Release 的间隔（秒，0 只通过管理接口触发）'),
+    Setting('GHPROXY_PREFETCH_CONCURRENCY', int, 2, '同时进行的预热下载数'),
+    Setting('GHPROXY_PREFETCH_BANDWIDTH', int, 10 * MB, '预热下载的总带宽上限（字节/秒，0 不限；有用户在下载同一文件时不限速）'),
+    Setting('GHPROXY_PREFETCH_MAX_ASSET', int, 2 * GB, '预热的单个资源大小上限（字节）'),
+    Setting('GHPROXY_GITHUB_API', str, 'https://api.github.com', 'GitHub API 地址（查询 Release）'),
+    Setting('GHPROXY_GITHUB_TOKEN', str, '', 'GitHub API token（可选，提高查询限额）'),
+    Setting('GHPROXY_ADMIN_TOKEN', str, '', '管理接口（/admin/...）的 Bearer token，为空关闭管理接口'),
+)
+
+# 只由 gunicorn.conf.py 读取的配置项，同样可以写在配置文件中
+GUNICORN_SETTINGS = ('GHPROXY_APP', 'GHPROXY_WORKERS', 'GHPROXY_THREADS', 'GHPROXY_GRACEFUL_TIMEOUT')
+
+
+def read_env_file(path):
+    """读取 KEY=VALUE 格式的配置文件，忽略空行和 # 注释；文件不存在时返回空 dict"""
+    env = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                env[key.strip()] = value.strip().strip('\'"')
+    except FileNotFoundError:
+        pass
+    return env
+
+
+class Settings:
+    """
+    已加载的配置，按属性访问（GHPROXY_CACHE_DIR -> settings.cache_dir，HTTP_PROXY -> settings.http_proxy）
+
+    sources 记录每项的来源（file / env / default），供 --check-config 输出
+    """
+
+    def __init__(self, values, sources, env_file):
+        self.__dict__.update(values)
+        self.sources = sources
+        self.env_file = env_file
+
+    @classmethod
+    def load(cls, environ=None, env_file=None):
+        environ = os.environ if environ is None else environ
+        env_file = env_file or environ.get('GHPROXY_ENV_FILE', '/etc/github-proxy/proxy.env')
+        file_values = read_env_file(env_file)
+        known = {setting.name for setting in SETTINGS} | set(GUNICORN_SETTINGS)
+        for name in file_values:
+            if name.startswith('GHPROXY_') and name not in known:
+                logger.warning(f'配置文件中有未知的配置项: {name} ({env_file})')
+        values, sources = {}, {}
+        for setting in SETTINGS:
+            if setting.name in file_values:
+                value, source = setting.parse(file_values[setting.name]), 'file'
+            elif setting.name in environ:
+                value, source = setting.parse(environ[setting.name]), 'env'
+            else:
+                value, source = setting.default, 'default'
+            values[setting.attr] = value
+            sources[setting.name] = source
+        return cls(values, sources, env_file)
+
+    @property
+    def port(self):
+        return int(self.bind.rsplit(':', 1)[1])
+
+    @property
+    def timeout(self):
+        """requests 的 (建连超时, 读取超时)"""
+        return self.connect_timeout, self.read_timeout
+
+    def describe(self):
+        """每项配置的 (名称, 生效值, 来源, 说明)"""
+        return [
+            (setting.name, getattr(self, setting.attr), self.sources[setting.name], setting.help_text)
+            for setting in SETTINGS
+        ]
+
+
+settings = Settings.load()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+git smart-HTTP（clone / fetch）转发与缓存（线程模式和 ASGI 模式共用）
+
+    git clone http://<服务地址>/github/<owner>/<repo>.git
+
+- GET  <repo>/info/refs?service=git-upload-pack   引用通告，短时缓存（GHPROXY_GIT_REFS_TTL）
+- POST <repo>/git-upload-pack                      协商与 packfile
+    - 协议 v2 的 command=ls-refs 返回引用列表，与引用通告一样短时缓存
+    - fetch 请求（v0/v1 的 want 列表，v2 的 command=fetch）只通过对象 ID 指定内容，响应只取决于
+      请求本身。以 done 结束的请求（返回 packfile）和不带 have 的请求（全新克隆，包括浅克隆
+      先行的 deepen 轮次）按 仓库 + Git-Protocol + 请求体 缓存为不可变条目，
+      同一提交的重复克隆（CI）直接从本地返回，并发的相同请求合并为一次上游传输
+    - 带 have 的中间协商轮次（增量 fetch）各不相同，原样流式转发
+- 不转发推送（git-receive-pack）；带 Authorization 的请求（私有仓库）原样转发，不缓存也不合并
+"""
+
+import re
+import gzip
+import hashlib
+import logging
+
+from .cache import cache
+from .config import settings
+from .responses import CachedBody
+
+logger = logging.getLogger(__name__)
+
+# 协商请求体（want/have 列表）的大小上限
+GIT_MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+GIT_PATH = re.compile(r'^([\w.-]+)/([\w.-]+?)(?:\.git)?/(info/refs|git-upload-pack|git-receive-pack)$')
+
+# 转发给上游的客户端请求头
+GIT_FORWARD_HEADERS = ('User-Agent', 'Git-Protocol', 'Content-Type', 'Content-Encoding', 'Accept', 'Authorization')
+
+
+def git_path(path):
+    """
+    /github/ 之后的路径是否为 git smart-HTTP 请求
+
+    返回:
+        (仓库 URL, 请求类型)，如 ('https://github.com/owner/repo.git', 'info/refs')；否则返回 None
+    """
+    match = GIT_PATH.match(path)
+    if not match:
+        return None
+    owner, repo, service = match.groups()
+    return f'https://github.com/{owner}/{repo}.git', service
+
+
+def pkt_lines(data):
+    """
+    解析 pkt-line 格式，返回各行内容（去掉结尾换行）
+
+    0000（flush）、0001（delim）、0002（response-end）返回为 None；格式错误时抛出 ValueError
+    """
+    lines = []
+    pos = 0
+    while pos < len(data):
+        length = int(data[pos:pos + 4], 16)
+        if length < 4:
+            lines.append(None)
+            pos += 4
+            continue
+        if pos + length > len(data):
+            raise ValueError('pkt-line 长度超出请求体')
+        lines.append(data[pos + 4:pos + length].rstrip(b'\n'))
+        pos += length
+    return lines
+
+
+def classify_upload_pack(body):
+    """
+    判断 git-upload-pack 请求的响应能否缓存
+
+    返回:
+        'refs'（引用列表，短时缓存）、'pack'（只取决于请求内容，长期缓存）或 None（不缓存）
+    """
+    try:
+        lines = [line for line in pkt_lines(body) if line is not None]
+    except ValueError:
+        return None
+    if b'command=ls-refs' in lines:
+        return 'refs'
+    # want-ref 按引用名请求，结果随引用变化
+    if any(line.startswith(b'want-ref ') for line in lines):
+        return None
+    if b'done' not in lines and any(line.startswith(b'have ') for line in lines):
+        return None
+    if b'command=fetch' in lines or (lines and lines[0].startswith(b'want ')):
+        return 'pack'
+    return None
+
+
+class GitRequest:
+    """
+    一次转发给上游的 git 请求
+
+    key 为缓存键（同时用于合并并发请求），不可缓存时为 None；meta 写入缓存条目的元数据
+    """
+
+    def __init__(self, repo_url, service, method, request_headers, query='', body=None):
+        self.url = f'{repo_url}/{service}'
+        if query:
+            self.url += '?' + query
+        self.method = method
+        self.data = body
+        self.headers = {name: request_headers[name] for name in GIT_FORWARD_HEADERS if request_headers.get(name)}
+        self.headers.setdefault('User-Agent', 'git/2.0')
+        self.key = None
+        self.meta = None
+
+        kind = None
+        if method == 'GET':
+            kind = 'refs'
+        elif body is not None:
+            try:
+                if request_headers.get('Content-Encoding', '').lower() == 'gzip':
+                    body = gzip.decompress(body)
+                kind = classify_upload_pack(body)
+            except (OSError, EOFError):
+                kind = None
+        if not cache.enabled or 'Authorization' in self.headers or kind is None:
+            return
+        if kind == 'refs':
+            if settings.git_refs_ttl <= 0:
+                return
+            self.meta = {'ttl': settings.git_refs_ttl}
+        else:
+            self.meta = {'immutable': True}
+        digest = hashlib.sha256(body or b'').hexdigest()
+        self.key = f'git:{kind}:{self.url}:{self.headers.get("Git-Protocol", "")}:{digest}'
+
+
+def check_git_request(service, method, query, content_length):
+    """
+    校验 git 请求
+
+    返回:
+        不支持时返回 (错误信息 dict, 状态码)，否则返回 None
+    """
+    if service == 'git-receive-pack' or 'service=git-receive-pack' in query:
+        return {'error': '只支持 clone / fetch，不支持推送'}, 403
+    if service == 'info/refs':
+        if method not in ('GET', 'HEAD') or 'service=git-upload-pack' not in query:
+            return {'error': '只支持 smart HTTP 协议', 'usage': 'git clone <服务地址>/github/owner/repo.git'}, 400
+        return None
+    if method != 'POST':
+        return {'error': '请求方法不正确'}, 405
+    if content_length and content_length > GIT_MAX_REQUEST_BYTES:
+        return {'error': '请求体过大'}, 413
+    return None
+
+
+def git_response_headers(content_type, cache_status):
+    """git 响应头：客户端和中间代理都不应缓存（缓存由本服务负责）"""
+    return {
+        'Content-Type': content_type,
+        'Cache-Control': 'no-cache',
+        'X-Proxy-By': 'VioletTeam GitHub Proxy',
+        'X-Cache': cache_status
+    }
+
+
+def git_lookup(request):
+    """查找请求对应的新鲜缓存条目，没有则返回 None"""
+    if request.key is None:
+        return None
+    entry = cache.lookup(request.key)
+    if entry and cache.is_fresh(entry):
+        return entry
+    return None
+
+
+def git_cached_response(entry, cache_status):
+    """
+    缓存命中时的响应
+
+    返回:
+        (状态码, 响应头, CachedBody)
+    """
+    headers = git_response_headers(entry['content_type'], cache_status)
+    headers['Content-Length'] = str(entry['size'])
+    f = open(entry['path'], 'rb')
+    return 200, headers, CachedBody(f, [(0, entry['size'] - 1)] if entry['size'] else [])
+
+
+def git_error_response(upstream_status, upstream_headers):
+    """
+    上游非 200 响应：状态码原样返回，401 时带上 WWW-Authenticate，让 git 提示输入凭据
+
+    返回:
+        (状态码, 响应头, 消息体)
+    """
+    headers = {'Content-Type': 'text/plain; charset=utf-8', 'X-Proxy-By': 'VioletTeam GitHub Proxy'}
+    if upstream_headers.get('WWW-Authenticate'):
+        headers['WWW-Authenticate'] = upstream_headers['WWW-Authenticate']
+    status_code = upstream_status if upstream_status < 500 else 502
+    return status_code, headers, f'上游返回 HTTP {upstream_status}\n'.encode('utf-8')
+
+
+def git_stale_entry(request):
+    """上游不可用时可以退回使用的旧引用通告（packfile 条目不会过期，无需此退路）"""
+    if request.key is None or request.meta.get('immutable'):
+        return None
+    return cache.lookup(request.key)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+小文件内存缓存
+
+raw.githubusercontent.com 的安装脚本、配置文件等小文件反复被请求，每次都从磁盘缓存打开文件、
+逐块发送的开销远大于文件本身。磁盘缓存命中的小文件（不超过 GHPROXY_MEMCACHE_MAX_OBJECT）
+会载入进程内存，之后的请求直接用内存中的 bytes 响应；文本文件载入时预先压缩（gzip / brotli），
+按客户端的 Accept-Encoding 返回压缩版本。
+
+新鲜度与磁盘缓存条目一致（元数据随对象一起保存），过期后回到磁盘缓存的重新验证流程，
+验证通过或重新下载后再次载入。每个 worker 进程各自一份。
+"""
+
+import gzip
+import logging
+import threading
+from collections import OrderedDict
+
+from .cache import cache
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 按文本处理（预压缩）的 Content-Type
+TEXT_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'application/x-sh')
+# 压缩后至少节省的比例，否则不保存压缩版本
+COMPRESS_MIN_SAVING = 0.1
+
+
+def is_text(content_type):
+    content_type = (content_type or '').lower()
+    return any(content_type.startswith(prefix) for prefix in TEXT_TYPES) or content_type.endswith('+json')
+
+
+class MemoryObject:
+    """内存中的一个文件：原始内容、预压缩版本（编码 -> bytes）与磁盘缓存条目的元数据"""
+
+    def __init__(self, data, meta, encodings):
+        self.data = data
+        self.meta = meta
+        self.encodings = encodings
+
+    @property
+    def size(self):
+        return len(self.data) + sum(len(body) for body in self.encodings.values())
+
+
+class MemoryCache:
+    """以 URL 为键、按总字节数限制的 LRU"""
+
+    def __init__(self, max_bytes, max_object, compress):
+        self.max_bytes = max_bytes
+        self.max_object = max_object
+        self.enabled = max_bytes > 0 and max_object > 0
+        self.compress = [name.strip() for name in compress.split(',') if name.strip()]
+        if 'br' in self.compress and brotli is None:
+            logger.info('未安装 brotli，内存缓存只做 gzip 预压缩: pip3 install brotli')
+            self.compress.remove('br')
+        self.hits = 0
+        self.loads = 0
+        self._lock = threading.Lock()
+        self._objects = OrderedDict()
+        self._total = 0
+
+    def eligible(self, entry):
+        return self.enabled and entry['size'] <= self.max_object
+
+    def get(self, url):
+        """URL 对应的新鲜对象，没有或已过期时返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            obj = self._objects.get(url)
+            if obj is None or not cache.is_fresh(obj.meta):
+                return None
+            self._objects.move_to_end(url)
+            self.hits += 1
+            return obj
+
+    def load(self, entry):
+        """
+        把磁盘缓存条目载入内存，返回 MemoryObject
+
+        文件已被淘汰删除或读取失败时返回 None
+        """
+        try:
+            with open(entry['path'], 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != entry['size']:
+            return None
+        meta = {k: v for k, v in entry.items() if k != 'path'}
+        obj = MemoryObject(data, meta, self._precompress(data, meta.get('content_type')))
+        self._put(meta['url'], obj)
+        return obj
+
+    def _precompress(self, data, content_type):
+        encodings = {}
+        if not self.compress or not is_text(content_type) or not data:
+            return encodings
+        for name in self.compress:
+            if name == 'gzip':
+                body = gzip.compress(data, compresslevel=6)
+            elif name == 'br':
+                body = brotli.compress(data, quality=5)
+            else:
+                continue
+            if len(body) <= len(data) * (1 - COMPRESS_MIN_SAVING):
+                encodings[name] = body
+        return encodings
+
+    def _put(self, url, obj):
+        with self._lock:
+            old = self._objects.pop(url, None)
+            if old is not None:
+                self._total -= old.size
+            self._objects[url] = obj
+            self._total += obj.size
+            self.loads += 1
+            while self._total > self.max_bytes and self._objects:
+                _, evicted = self._objects.popitem(last=False)
+                self._total -= evicted.size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._objects),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'loads': self.loads,
+                'compress': self.compress
+            }
+
+
+memory_cache = MemoryCache(settings.memcache_max_bytes, settings.memcache_max_object, settings.memcache_compress)
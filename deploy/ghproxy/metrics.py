@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prometheus 指标（/metrics）与客户端响应的计量
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    """
+    一个 Prometheus 指标（counter / gauge / histogram），按标签值元组分别计数
+
+    直方图的值为 [各桶计数..., +Inf 桶计数, 总和]，桶按上界分配，输出时再累加
+    """
+
+    def __init__(self, kind, name, help_text, labels=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values):
+        self.inc(*label_values, amount=-1)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(value) if self.kind == 'histogram' else value]
+                    for key, value in self.values.items()]
+
+
+class MetricsRegistry:
+    """
+    /metrics 的指标集合
+
+    更新只在进程内存中累加。多 worker 部署时每个进程每隔 FLUSH_INTERVAL 秒把快照写入
+    自己的 spool 目录（tmp/<pid>/metrics.json，进程退出后随 spool 目录一起清理），
+    输出时汇总所有存活 worker 的快照，因此无论请求落到哪个 worker 看到的都是整个服务的数据
+    """
+
+    FLUSH_INTERVAL = 5
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Metric('counter', name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Metric('gauge', name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        return self._add(Metric('histogram', name, help_text, labels, tuple(buckets)))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def start_flusher(self, cache):
+        """在本进程启动快照写入线程（cache 为共用的 DiskCache，未启用时不写快照）"""
+        if not cache.enabled or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, args=(cache,), name='metrics-flusher', daemon=True).start()
+
+    def _flush_loop(self, cache):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                path = os.path.join(cache.spool_dir, 'metrics.json')
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                logger.warning(f'写入指标快照失败: {str(e)}')
+
+    def collect(self, cache):
+        """本进程的实时数据加上其他存活 worker 最近一次写入的快照"""
+        merged = self.snapshot()
+        if not cache.enabled:
+            return merged
+        for spool_dir in cache.worker_spool_dirs():
+            try:
+                with open(os.path.join(spool_dir, 'metrics.json'), 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric_name, values in snapshot.items():
+                target = {tuple(key): value for key, value in merged.get(metric_name, [])}
+                for key, value in values:
+                    key = tuple(key)
+                    if key not in target:
+                        target[key] = value
+                    elif isinstance(value, list):
+                        target[key] = [a + b for a, b in zip(target[key], value)]
+                    else:
+                        target[key] += value
+                merged[metric_name] = [[list(key), value] for key, value in target.items()]
+        return merged
+
+    def render(self, cache):
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        data = self.collect(cache)
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key, value in sorted(data.get(metric.name, []), key=lambda item: item[0]):
+                labels = list(zip(metric.labels, key))
+                if metric.kind != 'histogram':
+                    lines.append(f'{metric.name}{format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value):
+                    cumulative += count
+                    lines.append(f'{metric.name}_bucket{format_labels(labels + [("le", bound)])} {cumulative}')
+                lines.append(f'{metric.name}_sum{format_labels(labels)} {value[-1]}')
+                lines.append(f'{metric.name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """{name="value",...}，值中的反斜杠、双引号和换行按文本格式转义"""
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+# 时间类直方图的桶（秒）与速率类直方图的桶（字节/秒，64KB/s ~ 256MB/s）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(7))
+
+metrics = MetricsRegistry()
+upstream_ttfb_seconds = metrics.histogram(
+    'ghproxy_upstream_ttfb_seconds', '发出上游请求到收到最终响应头的时间（含重定向）', LATENCY_BUCKETS, ('route',))
+upstream_connect_seconds = metrics.histogram(
+    'ghproxy_upstream_connect_seconds', '新建上游连接的时间（TCP、代理隧道与 TLS 握手）', LATENCY_BUCKETS)
+redirect_resolve_seconds = metrics.histogram(
+    'ghproxy_redirect_resolve_seconds', '跟随重定向解析出最终下载地址的时间（未命中重定向缓存时）', LATENCY_BUCKETS)
+upstream_bytes_per_second = metrics.histogram(
+    'ghproxy_upstream_bytes_per_second', '单次上游传输的速率（256KB 以上）', THROUGHPUT_BUCKETS, ('route',))
+client_bytes_per_second = metrics.histogram(
+    'ghproxy_client_bytes_per_second', '单个客户端响应的发送速率（256KB 以上）', THROUGHPUT_BUCKETS, ('source',))
+cache_requests_total = metrics.counter('ghproxy_cache_requests_total', '下载请求的缓存命中情况', ('result',))
+streams_in_flight = metrics.gauge('ghproxy_streams_in_flight', '正在发送的客户端响应数', ('source',))
+upstream_errors_total = metrics.counter('ghproxy_upstream_errors_total', '上游错误次数（按错误类型）', ('class',))
+bytes_served_total = metrics.counter('ghproxy_bytes_served_total', '发送给客户端的字节数', ('source',))
+upstream_bytes_total = metrics.counter('ghproxy_upstream_bytes_total', '从上游接收的字节数', ('route',))
+prefetch_total = metrics.counter('ghproxy_prefetch_total', 'Release 预热下载次数（done / failed / skipped）', ('result',))
+peer_requests_total = metrics.counter('ghproxy_peer_requests_total', '缓存未命中时向其他节点的请求（ok / fallback：失败后回源）', ('result',))
+access_log_dropped_total = metrics.counter('ghproxy_access_log_dropped_total', '写出跟不上或写入失败而丢弃的访问日志记录数')
+
+
+class StreamMeter:
+    """
+    一个客户端响应的计量
+
+    流式循环中 add() 只做一次整数累加，每满 FLUSH_BYTES 才更新共享计数器，不给热路径加锁
+    """
+
+    FLUSH_BYTES = 16 * 1024 * 1024
+    MIN_RATE_BYTES = 256 * 1024
+
+    def __init__(self, source):
+        self.source = source
+        self.sent = 0
+        self.pending = 0
+        # 消息体是否完整发送（迭代正常结束），访问日志据此区分中断的请求
+        self.complete = False
+        self.started = time.monotonic()
+        self.closed = False
+        streams_in_flight.inc(source)
+
+    def add(self, nbytes):
+        self.pending += nbytes
+        if self.pending >= self.FLUSH_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            bytes_served_total.inc(self.source, amount=self.pending)
+            self.sent += self.pending
+            self.pending = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._flush()
+        streams_in_flight.dec(self.source)
+        elapsed = time.monotonic() - self.started
+        if self.sent >= self.MIN_RATE_BYTES and elapsed > 0:
+            client_bytes_per_second.observe(self.sent / elapsed, self.source)
+
+
+class MeteredBody:
+    """给 WSGI 响应体计量的包装，迭代与 close() 原样转发"""
+
+    def __init__(self, body, meter):
+        self.body = body
+        self.meter = meter
+
+    def __iter__(self):
+        add = self.meter.add
+        for chunk in self.body:
+            add(len(chunk))
+            yield chunk
+        self.meter.complete = True
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.meter.close()
+
+
+def metered_source(headers):
+    """按 X-Cache 区分数据来源：MISS 为上游，其余为本地缓存；没有 X-Cache 的响应（状态页、错误）不计量"""
+    cache_status = headers.get('X-Cache')
+    if cache_status is None or headers.get('X-Accel-Redirect'):
+        return None
+    return 'upstream' if cache_status == 'MISS' else 'cache'
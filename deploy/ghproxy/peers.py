@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+多节点分层缓存
+
+GHPROXY_PEERS 列出同一集群的所有节点（含本节点，本节点的地址为 GHPROXY_PEER_SELF），
+下载地址按一致性哈希（每个节点 VNODES 个虚拟节点）归属其中一个节点（owner）:
+
+- 缓存未命中时，本节点不是 owner 就向 owner 的 /download 请求（带 X-Ghproxy-Peer 头），
+  owner 从自己的缓存返回，或者作为集群中唯一回源的节点边下载边转发；本节点同时写入自己的缓存
+- owner 不可用（连接失败或 5xx，连续失败后按上游出口的规则熔断）时顺延到哈希环上的下一个节点，
+  轮到本节点时由本节点回源；节点增减时只有相邻区间的文件换 owner
+- 本节点是 owner 时（包括收到其他节点转发的请求），配置了上一级节点 GHPROXY_PEER_PARENT（如香港节点）
+  就先向它请求，失败时直接回源
+- 节点间请求带 X-Ghproxy-Peer 头，值为共享密钥 GHPROXY_PEER_TOKEN（未设置密钥时不启用集群），
+  只有密钥一致的请求才按节点请求处理：不再转发给同级节点（避免环路），不参与带宽整形；
+  X-Ghproxy-Peer-Hops 记录经过的节点数，达到 MAX_HOPS 时直接回源，上一级节点配置成环时也不会无限转发
+
+这样每个文件在集群内只经过一次跨境链路。所有节点的 GHPROXY_PEERS 必须一致，
+节点地址应直接指向本服务（不经过设置了 X-Accel-Redirect 的 Nginx）。
+"""
+
+import hmac
+import time
+import bisect
+import hashlib
+import logging
+import urllib.parse
+
+import requests
+
+from .config import settings
+from .metrics import peer_requests_total
+from .upstream import ProxyRoute, async_upstream, httpx, upstream
+
+logger = logging.getLogger(__name__)
+
+PEER_HEADER = 'X-Ghproxy-Peer'
+HOPS_HEADER = 'X-Ghproxy-Peer-Hops'
+# 一个请求最多经过的节点数（同级 owner 一跳，加上各级上一级节点）
+MAX_HOPS = 4
+# 每个节点在哈希环上的虚拟节点数，越多各节点分到的文件越均匀
+VNODES = 64
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest()[:8], 'big')
+
+
+def parse_nodes(value):
+    """'http://a:18080/, http://b:18080' -> ['http://a:18080', 'http://b:18080']"""
+    return [item.strip().rstrip('/') for item in value.split(',') if item.strip()]
+
+
+class HashRing:
+    """一致性哈希环"""
+
+    def __init__(self, nodes, vnodes=VNODES):
+        points = sorted((ring_hash(f'{node}#{i}'), node) for node in set(nodes) for i in range(vnodes))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+        self.size = len(set(nodes))
+
+    def owners(self, key):
+        """key 的候选节点：第一个为 owner，其余为顺时针依次顺延的节点，每个节点出现一次"""
+        owners = []
+        if not self._nodes:
+            return owners
+        start = bisect.bisect(self._hashes, ring_hash(key))
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == self.size:
+                    break
+        return owners
+
+
+class PeerNode:
+    """集群中的另一个节点，连接状态与熔断沿用上游出口（ProxyRoute，直连）"""
+
+    def __init__(self, url):
+        self.url = url
+        self.host = urllib.parse.urlsplit(url).netloc.lower()
+        self.route = ProxyRoute('peer:' + url, {'http': None, 'https': None}, peer=True)
+
+    def download_url(self, url):
+        return f'{self.url}/download?url={urllib.parse.quote(url, safe="")}'
+
+
+class Cluster:
+    """本节点所在的集群：文件归属、节点间请求与统计"""
+
+    def __init__(self, config):
+        urls = parse_nodes(config.peers)
+        self.self_url = config.peer_self.strip().rstrip('/')
+        if urls and self.self_url not in urls:
+            logger.warning(f'GHPROXY_PEER_SELF 不在 GHPROXY_PEERS 中，本节点只从其他节点获取文件: {self.self_url!r}')
+        self.ring = HashRing(urls)
+        self.nodes = {url: PeerNode(url) for url in urls if url != self.self_url}
+        parent = config.peer_parent.strip().rstrip('/')
+        self.parent = PeerNode(parent) if parent else None
+        self.token = config.peer_token
+        if (self.nodes or self.parent) and not self.token:
+            logger.warning('未设置 GHPROXY_PEER_TOKEN，多节点分层缓存未启用')
+            self.nodes = {}
+            self.parent = None
+
+    @property
+    def enabled(self):
+        return bool(self.nodes) or self.parent is not None
+
+    def owner(self, key):
+        """负责 key 的节点（本节点时返回 None）"""
+        for url in self.ring.owners(key):
+            if url == self.self_url:
+                return None
+            if self.nodes[url].route.available(time.monotonic()):
+                return self.nodes[url]
+        return None
+
+    def route_for(self, key, parent_only=False):
+        """
+        缓存未命中时先请求的节点：owner 不是本节点时为 owner，否则为上一级节点；直接回源时返回 None
+
+        parent_only 为 True 时（请求来自其他节点，本节点就是 owner）只考虑上一级节点
+        """
+        node = None if parent_only else self.owner(key)
+        if node is None and self.parent is not None and self.parent.route.available(time.monotonic()):
+            node = self.parent
+        return node
+
+    def trusted(self, value):
+        """X-Ghproxy-Peer 头的值与共享密钥一致（未设置密钥时不信任任何请求）"""
+        return bool(self.token) and value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def request_hops(self, peer_value, hops_value):
+        """
+        收到的请求已经过的节点数：客户端的请求（包括密钥不一致的 X-Ghproxy-Peer 头）为 0，
+        其他节点转发的请求按 X-Ghproxy-Peer-Hops（至少为 1）
+        """
+        if not self.trusted(peer_value):
+            return 0
+        return max(int(hops_value), 1) if hops_value and hops_value.isdigit() else 1
+
+    def forward_headers(self, headers, hops):
+        headers = dict(headers)
+        headers[PEER_HEADER] = self.token
+        headers[HOPS_HEADER] = str(hops + 1)
+        # 节点间传输原始内容，对方按 Content-Length 校验完整性
+        headers['Accept-Encoding'] = 'identity'
+        return headers
+
+    def _fallback(self, node, error):
+        node.route.record_failure(error)
+        peer_requests_total.inc('fallback')
+        logger.warning(f'节点 {node.url} 请求失败，改为回源: {str(error)}')
+
+    def _route(self, key, hops):
+        if hops >= MAX_HOPS:
+            return None
+        return self.route_for(key, parent_only=hops > 0)
+
+    def request(self, url, headers, timeout, key=None, hops=0):
+        """
+        向负责 url 的节点发起 GET（线程模式）
+
+        hops 为本请求已经过的节点数（客户端直接请求时为 0，见 request_hops）
+
+        返回:
+            requests.Response（route 为该节点），不经过其他节点或节点请求失败时返回 None（由调用方回源）
+        """
+        node = self._route(key or url, hops)
+        if node is None:
+            return None
+        node.route.claim()
+        started = time.monotonic()
+        try:
+            r = upstream.session_for(node.host).get(
+                node.download_url(url), headers=self.forward_headers(headers, hops), proxies=node.route.proxies,
+                stream=True, timeout=timeout, allow_redirects=False
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._fallback(node, e)
+            return None
+        if r.status_code >= 500:
+            r.close()
+            self._fallback(node, f'HTTP {r.status_code}')
+            return None
+        node.route.record_success(time.monotonic() - started)
+        peer_requests_total.inc('ok')
+        r.route = node.route
+        return r
+
+    async def arequest(self, url, headers, key=None, hops=0):
+        """request() 的 ASGI 版本，返回流式 httpx.Response 或 None"""
+        node = self._route(key or url, hops)
+        if node is None:
+            return None
+        node.route.claim()
+        started = time.monotonic()
+        client = async_upstream.client(node.route)
+        try:
+            request = client.build_request('GET', node.download_url(url), headers=self.forward_headers(headers, hops))
+            r = await client.send(request, stream=True)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            self._fallback(node, e)
+            return None
+        if r.status_code >= 500:
+            await r.aclose()
+            self._fallback(node, f'HTTP {r.status_code}')
+            return None
+        node.route.record_success(time.monotonic() - started)
+        peer_requests_total.inc('ok')
+        r.route = node.route
+        return r
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'enabled': self.enabled,
+            'self': self.self_url or None,
+            'nodes': [node.route.stats(now) for node in self.nodes.values()],
+            'parent': self.parent.route.stats(now) if self.parent else None
+        }
+
+
+def peer_response_headers(headers, meta):
+    """
+    返回给其他节点的响应带上游的原始 Content-Type、ETag 与 Last-Modified，
+    对方按此写入自己的缓存条目，之后的重新验证和中断续传仍使用上游的校验值
+    """
+    if not headers.get('Content-Type', '').startswith('multipart/'):
+        headers['Content-Type'] = meta.get('content_type') or 'application/octet-stream'
+    for name, field in (('ETag', 'etag'), ('Last-Modified', 'last_modified')):
+        if meta.get(field):
+            headers[name] = meta[field]
+        else:
+            headers.pop(name, None)
+
+
+cluster = Cluster(settings)
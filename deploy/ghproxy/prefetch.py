@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+"""
+Release 预热
+
+新版本发布后，第一批用户都要经跨境链路冷启动下载。跟踪的仓库每隔 GHPROXY_PREFETCH_INTERVAL 秒
+查询一次最新 Release，按名称模式筛选出的新资源在后台下载进磁盘缓存，用户请求时直接读本地磁盘。
+
+- 仓库写法: owner/repo 或 owner/repo:模式（fnmatch，多个模式用 | 分隔），
+  如 ollama/ollama:ollama-linux-*.tgz|*.sha256
+- 跟踪列表来自 GHPROXY_PREFETCH_REPOS（逗号分隔）和管理接口添加的仓库（保存在 <缓存目录>/prefetch.json，各 worker 共用）
+- 查询 GitHub API /repos/<owner>/<repo>/releases/latest，带 If-None-Match，未变化时不计入 API 限额；
+  可设置 GHPROXY_GITHUB_TOKEN 提高限额
+- 下载复用请求合并（Flight）：用户请求同一文件时直接加入预热传输。没有用户读者时所有预热下载共用
+  GHPROXY_PREFETCH_BANDWIDTH 的总速率，同时进行的预热下载不超过 GHPROXY_PREFETCH_CONCURRENCY 个
+- 多 worker 部署时通过缓存目录下的文件锁只由一个进程定时轮询
+
+管理接口（需要 GHPROXY_ADMIN_TOKEN，请求头 Authorization: Bearer <token>）:
+    GET  /admin/prefetch   跟踪列表与预热状态
+    POST /admin/prefetch   {"repos": [...], "remove": [...], "urls": [...]}
+                           添加 / 移除跟踪的仓库（添加后立即查询一次），或直接预热指定的下载地址
+"""
+
+import os
+import json
+import time
+import uuid
+import hmac
+import fcntl
+import fnmatch
+import logging
+import threading
+from collections import deque
+
+from .cache import cache, flights
+from .config import settings
+from .metrics import prefetch_total
+from .responses import check_download_url
+from .shaping import shaper
+from .upstream import upstream
+
+logger = logging.getLogger(__name__)
+
+# 管理接口请求体的大小上限
+ADMIN_MAX_REQUEST_BYTES = 1024 * 1024
+
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+
+def parse_tracked(spec):
+    """'owner/repo:模式1|模式2' -> ('owner/repo', ['模式1', '模式2'])；格式错误时返回 None"""
+    repo, _, patterns = spec.strip().partition(':')
+    parts = repo.split('/')
+    if len(parts) != 2 or not all(parts):
+        return None
+    return repo, [pattern for pattern in patterns.split('|') if pattern] or ['*']
+
+
+class Prefetcher:
+    """预热调度：轮询线程查询 Release，固定数量的下载线程从队列取任务"""
+
+    def __init__(self):
+        # 预热限速器由 shaper 统一管理，修改配置文件后无需重启即生效
+        self.limiter = shaper.prefetch
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._pending = set()  # 排队中和下载中的 URL
+        self._active = set()
+        self._started_pid = None
+        self._lock_file = None
+        self.etags = {}  # repo -> (ETag, 最新 tag)
+        self.assets = {}  # repo -> 最新 Release 的资源 [(名称, 大小, 下载地址)]
+        self.polls = {}  # repo -> 最近一次查询的结果
+        self.recent = deque(maxlen=50)
+        self.counts = {'done': 0, 'failed': 0, 'skipped': 0}
+
+    @property
+    def state_path(self):
+        return os.path.join(cache.root, 'prefetch.json')
+
+    def tracked(self):
+        """配置与管理接口添加的所有跟踪项，按仓库去重（管理接口的优先）"""
+        specs = [spec for spec in settings.prefetch_repos.split(',') if spec.strip()]
+        specs += self._load_state().get('repos', [])
+        tracked = {}
+        for spec in specs:
+            parsed = parse_tracked(spec)
+            if parsed is None:
+                logger.warning(f'预热仓库格式错误，已忽略: {spec}')
+                continue
+            tracked[parsed[0]] = parsed[1]
+        return tracked
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def update_tracked(self, add, remove):
+        """修改管理接口维护的跟踪列表（多个 worker 共用的文件，原子替换）"""
+        state = self._load_state()
+        specs = {parse_tracked(spec)[0]: spec.strip() for spec in state.get('repos', []) if parse_tracked(spec)}
+        for spec in add:
+            specs[parse_tracked(spec)[0]] = spec.strip()
+        for repo in remove:
+            specs.pop(repo.partition(':')[0].strip(), None)
+        tmp_path = os.path.join(cache.spool_dir, uuid.uuid4().hex + '.json')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'repos': sorted(specs.values())}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def start(self):
+        """
+        在本进程启动下载线程和轮询线程（每个进程一次）
+
+        磁盘缓存未启用，或既没有配置跟踪仓库也没有开启管理接口时不启动
+        """
+        if not cache.enabled or self._started_pid == os.getpid():
+            return
+        if not settings.prefetch_repos and not settings.admin_token:
+            return
+        with self._cond:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        for i in range(max(settings.prefetch_concurrency, 1)):
+            threading.Thread(target=self._download_loop, name=f'prefetch-{i}', daemon=True).start()
+        if settings.prefetch_interval > 0:
+            threading.Thread(target=self._poll_loop, name='prefetch-poll', daemon=True).start()
+
+    def _is_scheduler(self):
+        """多 worker 时只有持有文件锁的进程定时轮询；持有者退出后由其他进程接替"""
+        if self._lock_file is not None:
+            return True
+        f = open(os.path.join(cache.root, 'prefetch.lock'), 'w')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        return True
+
+    def _poll_loop(self):
+        while True:
+            if self._is_scheduler():
+                for repo, patterns in self.tracked().items():
+                    self.poll(repo, patterns)
+            # 管理接口新添加的仓库由 prefetch_admin 立即查询一次，这里只负责定时轮询
+            time.sleep(settings.prefetch_interval)
+
+    def poll(self, repo, patterns):
+        """
+        查询仓库的最新 Release，把匹配且未缓存的资源加入队列，返回新加入的个数
+
+        Release 未变化（304）时仍检查上次查到的资源，之前预热失败、尚未缓存的文件在下一轮重试
+        """
+        url = f'{settings.github_api.rstrip("/")}/repos/{repo}/releases/latest'
+        headers = {'Accept': 'application/vnd.github+json', 'User-Agent': 'ghproxy-prefetch'}
+        if settings.github_token:
+            headers['Authorization'] = f'Bearer {settings.github_token}'
+        etag, tag = self.etags.get(repo, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        try:
+            r = upstream.request('GET', url, headers, timeout=settings.timeout, stream=False)
+            if r.status_code == 304:
+                queued = self._enqueue_assets(repo, patterns, announce=False)
+                result = f'not modified, {queued} requeued' if queued else 'not modified'
+                self.polls[repo] = {'tag': tag, 'checked_at': time.time(), 'result': result}
+                return queued
+            if r.status_code != 200:
+                raise IOError(f'HTTP {r.status_code}')
+            release = r.json()
+        except Exception as e:
+            logger.warning(f'查询最新 Release 失败: {repo}, 错误: {str(e)}')
+            self.polls[repo] = {'tag': tag, 'checked_at': time.time(), 'result': f'error: {str(e)}'}
+            return 0
+
+        tag = release.get('tag_name')
+        self.etags[repo] = (r.headers.get('ETag'), tag)
+        self.assets[repo] = [
+            (asset.get('name', ''), asset.get('size', 0), asset['browser_download_url'])
+            for asset in release.get('assets', []) if asset.get('browser_download_url')
+        ]
+        queued = self._enqueue_assets(repo, patterns)
+        self.polls[repo] = {'tag': tag, 'checked_at': time.time(), 'result': f'{queued} queued'}
+        if queued:
+            logger.info(f'发现新版本 {repo} {tag}，加入预热队列: {queued} 个文件')
+        return queued
+
+    def _enqueue_assets(self, repo, patterns, announce=True):
+        """把仓库最新 Release 中匹配模式的资源加入队列（已缓存的跳过），返回新加入的个数；announce 为 False 时不重复记录跳过的资源"""
+        queued = 0
+        for name, size, url in self.assets.get(repo, []):
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                continue
+            if size > min(settings.prefetch_max_asset, cache.max_bytes):
+                if announce:
+                    logger.info(f'预热跳过过大的资源: {name} ({size} bytes)')
+                continue
+            if self.enqueue(url):
+                queued += 1
+        return queued
+
+    def enqueue(self, url):
+        """加入下载队列；已缓存、已在队列中时返回 False"""
+        entry = cache.lookup(url)
+        if entry and cache.is_fresh(entry):
+            return False
+        with self._cond:
+            if url in self._pending:
+                return False
+            self._pending.add(url)
+            self._queue.append(url)
+            self._cond.notify()
+        return True
+
+    def _download_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue)
+                url = self._queue.popleft()
+                self._active.add(url)
+            try:
+                self._download(url)
+            finally:
+                with self._cond:
+                    self._active.discard(url)
+                    self._pending.discard(url)
+
+    def _download(self, url):
+        shaper.refresh()
+        started = time.monotonic()
+        entry = cache.lookup(url)
+        if entry and cache.is_fresh(entry):
+            self._record(url, 'skipped', started)
+            return
+        logger.info(f'开始预热: {url}')
+        # 只借用请求合并：立即放开读者，传输在后台继续并写入缓存；用户加入后不再限速
+        flight, reader = flights.join(url, dict(DOWNLOAD_HEADERS), entry, limiter=self.limiter, peers=True)
+        reader.close()
+        with flight.cond:
+            flight.cond.wait_for(lambda: flight.done)
+        r = flight.response
+        if flight.error is not None or r is None or r.status_code not in (200, 304):
+            error = flight.error or f'HTTP {r.status_code if r is not None else "-"}'
+            logger.warning(f'预热失败: {url}, 错误: {str(error)}')
+            self._record(url, 'failed', started, str(error))
+            return
+        self._record(url, 'done', started)
+
+    def _record(self, url, result, started, error=None):
+        prefetch_total.inc(result)
+        with self._cond:
+            self.counts[result] += 1
+        item = {'url': url, 'result': result, 'seconds': round(time.monotonic() - started, 2)}
+        if error:
+            item['error'] = error
+        self.recent.append(item)
+        if result == 'done':
+            logger.info(f'预热完成: {url} ({item["seconds"]} s)')
+
+    def stats(self):
+        # tracked() 要读状态文件，不在锁内进行
+        tracked = {repo: '|'.join(patterns) for repo, patterns in self.tracked().items()}
+        with self._cond:
+            return {
+                'tracked': tracked,
+                'scheduler': self._lock_file is not None,
+                'polls': dict(self.polls),
+                'queued': list(self._queue),
+                'active': sorted(self._active),
+                'counts': dict(self.counts),
+                'recent': list(self.recent),
+                'bandwidth': self.limiter.rate,
+                'concurrency': settings.prefetch_concurrency
+            }
+
+
+prefetcher = Prefetcher()
+
+
+def admin_authorized(authorization):
+    """管理接口鉴权：未设置 GHPROXY_ADMIN_TOKEN 时一律拒绝"""
+    token = settings.admin_token
+    return bool(token) and hmac.compare_digest(authorization or '', f'Bearer {token}')
+
+
+def prefetch_admin(method, authorization, payload):
+    """
+    /admin/prefetch（线程模式和 ASGI 模式共用）
+
+    返回:
+        (响应 dict, 状态码)
+    """
+    if not admin_authorized(authorization):
+        return {'error': '未授权'}, 401
+    if not cache.enabled:
+        return {'error': '磁盘缓存未启用，无法预热'}, 503
+    prefetcher.start()
+    if method in ('GET', 'HEAD'):
+        return prefetcher.stats(), 200
+
+    if not isinstance(payload, dict):
+        return {'error': '请求体应为 JSON 对象', 'usage': {'repos': ['owner/repo:*.tgz'], 'remove': [], 'urls': []}}, 400
+    add = payload.get('repos') or []
+    remove = payload.get('remove') or []
+    urls = payload.get('urls') or []
+    invalid = [spec for spec in add if not isinstance(spec, str) or parse_tracked(spec) is None]
+    invalid += [url for url in urls if not isinstance(url, str) or check_download_url(url)]
+    if invalid or not all(isinstance(repo, str) for repo in remove):
+        return {'error': '仓库或下载地址格式错误', 'invalid': invalid}, 400
+
+    if add or remove:
+        prefetcher.update_tracked(add, remove)
+    queued = [url for url in urls if prefetcher.enqueue(url)]
+    # 新添加的仓库立即查询一次，不等下一个轮询周期
+    for spec in add:
+        threading.Thread(target=prefetcher.poll, args=parse_tracked(spec), name='prefetch-poll-once', daemon=True).start()
+    logger.info(f'预热配置已更新: 添加 {add}, 移除 {remove}, 预热 {len(queued)} 个地址')
+    return {'tracked': prefetcher.stats()['tracked'], 'queued': queued}, 200
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+
+"""
+与服务框架无关的响应构造（线程模式的 Flask 应用和 ASGI 应用共用）
+
+首页、状态数据、下载 URL 校验、缓存命中响应（含 Range / If-Range）与各类响应头
+"""
+
+import os
+import uuid
+import base64
+import logging
+
+from .config import settings
+from .buffers import ChunkSizer, buffers
+from .cache import cache
+from .memory import memory_cache
+from .peers import cluster
+from .shaping import shaper
+from .upstream import get_proxies, proxy_pool, redirects
+
+logger = logging.getLogger(__name__)
+
+# 合并后仍超过这么多个区间的 Range 请求按整个文件返回（RFC 9110 §14.2，防止大量小区间放大开销）
+MAX_RANGES = 16
+
+
+def index():
+    """服务首页，显示使用说明"""
+    return '''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>GitHub 下载中转服务</title>
+        <style>
+            body { font-family: Arial, sans-serif; max-width: 800px; margin: 50px auto; padding: 20px; }
+            h1 { color: #333; }
+            pre { background: #f4f4f4; padding: 15px; border-radius: 5px; overflow-x: auto; }
+            .info { background: #e7f3ff; padding: 10px; border-left: 4px solid #2196F3; margin: 10px 0; }
+        </style>
+    </head>
+    <body>
+        <h1>🚀 GitHub 下载中转服务</h1>
+        <div class="info">
+            <p><b>端口:</b> ''' + str(settings.port) + '''</p>
+            <p><b>状态:</b> ✅ 运行中</p>
+            <p><b>代理:</b> ''' + get_proxies()['http'] + '''</p>
+        </div>
+        
+        <h2>📖 使用方法</h2>
+        <pre>GET /download?url=GITHUB_URL</pre>
+        
+        <h2>💡 示例</h2>
+        <h3>1. 下载 Ollama</h3>
+        <pre>curl -L "http://violetteam.cloud/ghproxy/download?url=https://github.com/ollama/ollama/releases/download/v0.13.3/ollama-linux-amd64.tgz" -o ollama.tgz</pre>
+        
+        <h3>2. 下载任意 GitHub Release 文件</h3>
+        <pre>curl -L "http://violetteam.cloud/ghproxy/download?url=https://github.com/user/repo/releases/download/v1.0.0/file.tar.gz" -o file.tar.gz</pre>
+        
+        <h2>🔍 API 端点</h2>
+        <ul>
+            <li><code>GET /</code> - 服务首页</li>
+            <li><code>GET /status</code> - 服务状态</li>
+            <li><code>GET /metrics</code> - Prometheus 指标</li>
+            <li><code>GET /download?url=URL</code> - 下载文件</li>
+            <li><code>GET /github/owner/repo/path</code> - 直接下载 https://github.com/owner/repo/path</li>
+            <li><code>git clone http://host/github/owner/repo.git</code> - Git Clone 加速</li>
+        </ul>
+        
+        <h2>⚙️ 健康检查</h2>
+        <p>访问 <a href="/status">/status</a> 查看服务状态</p>
+    </body>
+    </html>
+    '''
+
+
+def status_info(flight_registry, pool):
+    """服务状态数据（线程模式和 ASGI 模式共用）"""
+    proxies = get_proxies()
+    return {
+        'status': 'running',
+        'port': settings.port,
+        'proxy': proxies['http'],
+        'version': '1.0.0',
+        # 多 worker 部署时各进程的统计相互独立，pid 标明数据来自哪个 worker
+        'pid': os.getpid(),
+        'cache': cache.stats(),
+        'memory': memory_cache.stats(),
+        'flights': flight_registry.stats(),
+        'pool': pool.stats(),
+        'redirects': redirects.stats(),
+        'buffers': buffers.stats(),
+        'upstreams': proxy_pool.stats(),
+        'shaping': shaper.stats(),
+        'peers': cluster.stats()
+    }
+
+
+def parse_range_header(value, size):
+    """
+    解析 Range 请求头
+
+    参数:
+        value: Range 头，例如 "bytes=0-1023,4096-"
+        size: 文件总大小
+
+    返回:
+        [(start, end), ...]（闭区间，按起点排序，重叠或相邻的区间已合并）；
+        语法无效或合并后区间数超过 MAX_RANGES 时返回 None（按 RFC 9110 忽略 Range），
+        所有区间都无法满足时返回空列表（416）
+    """
+    if not value or not value.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in value[len('bytes='):].split(','):
+        spec = spec.strip()
+        if '-' not in spec:
+            return None
+        first, last = spec.split('-', 1)
+        try:
+            if first == '':
+                # 后缀区间：最后 N 个字节
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and start > end:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def entry_etag(entry):
+    """
+    返回给客户端的 ETag：已知内容的 SHA-256 时为 "sha256:<hex>"，否则沿用上游的 ETag
+
+    内容摘要在写入缓存时顺带算出，同一内容在不同 URL、上游 ETag 变化后仍然一致
+    """
+    if entry.get('sha256'):
+        return f'"sha256:{entry["sha256"]}"'
+    return entry.get('etag')
+
+
+def entry_validators(entry):
+    """条件请求可以匹配的 ETag：摘要 ETag，以及未命中时客户端拿到的上游 ETag"""
+    return [etag for etag in (entry_etag(entry), entry.get('etag')) if etag]
+
+
+def digest_headers(headers, entry):
+    """已知 SHA-256 时加上完整内容的摘要（RFC 9530 Repr-Digest，以及旧式的 RFC 3230 Digest）"""
+    if entry.get('sha256'):
+        value = base64.b64encode(bytes.fromhex(entry['sha256'])).decode()
+        headers['Repr-Digest'] = f'sha-256=:{value}:'
+        headers['Digest'] = f'SHA-256={value}'
+
+
+def if_range_matches(value, entry):
+    """If-Range 校验：ETag 需强匹配，日期需与 Last-Modified 完全一致"""
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value in entry_validators(entry)
+    if value.startswith('W/'):
+        return False
+    return value == entry.get('last_modified')
+
+
+class CachedBody:
+    """
+    缓存命中时的消息体：已打开的缓存文件和要发送的区间
+
+    只有一个区间时可以交给 wsgi.file_wrapper，由 gunicorn 用 os.sendfile 零拷贝发送；
+    f 为 None 表示由 Nginx 通过 X-Accel-Redirect 发送文件，消息体为空
+    """
+
+    def __init__(self, f, ranges, boundary=None, part_headers=None):
+        self.f = f
+        self.ranges = ranges
+        self.boundary = boundary
+        self.part_headers = part_headers
+        self.chunks = None
+
+    def sendfile_span(self):
+        """可以整段 sendfile 的区间 (start, end)，否则返回 None"""
+        if self.f is not None and len(self.ranges) == 1 and not self.boundary:
+            return self.ranges[0]
+        return None
+
+    def __iter__(self):
+        if self.f is None:
+            return iter(())
+        self.chunks = file_range_body(self.f, self.ranges, self.boundary, self.part_headers)
+        return self.chunks
+
+    def close(self):
+        # 关闭生成器以归还在途块的内存预算
+        if self.chunks is not None:
+            self.chunks.close()
+        if self.f is not None:
+            self.f.close()
+
+
+def file_range_body(f, ranges, boundary=None, part_headers=None):
+    """按区间从文件读取数据；多区间时生成 multipart/byteranges 消息体"""
+    sizer = ChunkSizer()
+    with f:
+        for start, end in ranges:
+            if boundary:
+                yield part_headers(start, end)
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                size = buffers.reserve(sizer.next_size(remaining))
+                try:
+                    chunk = f.read(size)
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    sizer.sent(len(chunk))
+                    yield chunk
+                finally:
+                    buffers.release(size)
+        if boundary:
+            yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def cached_response(entry, filename, cache_status, range_header, if_range,
+                    if_none_match=None, if_modified_since=None, accel=True):
+    """
+    计算缓存命中时的响应（线程模式和 ASGI 模式共用）
+
+    支持单区间和多区间 Range 请求（206 Partial Content）、If-Range，
+    以及条件请求（304，客户端已有相同内容时不必重新下载）；
+    accel 为 False 时（其他节点直接请求本服务）不使用 X-Accel-Redirect
+
+    返回:
+        (状态码, 响应头, CachedBody)
+    """
+    size = entry['size']
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Content-Type': 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'X-Proxy-By': 'VioletTeam GitHub Proxy',
+        'X-Cache': cache_status
+    }
+    if entry_etag(entry):
+        headers['ETag'] = entry_etag(entry)
+    if entry.get('last_modified'):
+        headers['Last-Modified'] = entry['last_modified']
+    # 区间响应同样带完整内容的摘要，分段下载的客户端据此校验拼接后的文件
+    digest_headers(headers, entry)
+
+    if not_modified(entry, if_none_match, if_modified_since):
+        del headers['Content-Disposition']
+        return 304, headers, CachedBody(None, [])
+
+    # Nginx 的 If-Range 比较的是它自己生成的 ETag / 文件 mtime，带 If-Range 的区间请求仍由本服务处理
+    if accel and settings.accel_redirect and not (range_header and if_range):
+        headers['X-Accel-Redirect'] = settings.accel_redirect + os.path.relpath(entry['path'], cache.root)
+        return 200, headers, CachedBody(None, [])
+
+    # 提前打开文件：即使条目随后被淘汰删除，已打开的句柄仍可读完
+    f = open(entry['path'], 'rb')
+
+    ranges = None
+    if if_range_matches(if_range, entry):
+        ranges = parse_range_header(range_header, size)
+
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return 200, headers, CachedBody(f, [(0, size - 1)] if size else [])
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        headers['Content-Length'] = '0'
+        return 416, headers, CachedBody(f, [])
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return 206, headers, CachedBody(f, ranges)
+
+    boundary = uuid.uuid4().hex
+
+    def part_headers(start, end):
+        return (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: application/octet-stream\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+
+    length = sum(len(part_headers(start, end)) + end - start + 1 for start, end in ranges)
+    length += len(f'\r\n--{boundary}--\r\n')
+    headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    headers['Content-Length'] = str(length)
+    return 206, headers, CachedBody(f, ranges, boundary, part_headers)
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 弱比较：忽略 W/ 前缀和压缩版本的后缀"""
+    if not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    base = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        for suffix in ('-gzip"', '-br"'):
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)] + '"'
+        if candidate == base:
+            return True
+    return False
+
+
+def not_modified(meta, if_none_match, if_modified_since):
+    """条件请求是否可以返回 304（有 If-None-Match 时忽略 If-Modified-Since）"""
+    from email.utils import parsedate_to_datetime
+    if if_none_match:
+        return any(etag_matches(if_none_match, etag) for etag in entry_validators(meta))
+    if if_modified_since and meta.get('last_modified'):
+        try:
+            return parsedate_to_datetime(meta['last_modified']) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def accepted_encoding(accept_encoding, encodings):
+    """按客户端的 Accept-Encoding 选择预压缩版本（优先 br），都不接受时返回 None"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for name in ('br', 'gzip'):
+        if name in encodings and name in accepted:
+            return name
+    return None
+
+
+def memory_response(obj, filename, cache_status, accept_encoding, if_none_match, if_modified_since):
+    """
+    内存缓存命中时的响应（线程模式和 ASGI 模式共用）
+
+    支持条件请求（304）和预压缩版本；Range 请求不走内存缓存
+
+    返回:
+        (状态码, 响应头, bytes)
+    """
+    meta = obj.meta
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Content-Type': 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'X-Proxy-By': 'VioletTeam GitHub Proxy',
+        'X-Cache': cache_status
+    }
+    if obj.encodings:
+        headers['Vary'] = 'Accept-Encoding'
+    encoding = accepted_encoding(accept_encoding, obj.encodings)
+    etag = entry_etag(meta)
+    if etag and encoding:
+        # 不同编码的内容不同，强 ETag 不能共用
+        etag = etag[:-1] + f'-{encoding}"'
+    if etag:
+        headers['ETag'] = etag
+    if meta.get('last_modified'):
+        headers['Last-Modified'] = meta['last_modified']
+
+    if not_modified(meta, if_none_match, if_modified_since):
+        del headers['Content-Disposition']
+        return 304, headers, b''
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        return 200, headers, obj.encodings[encoding]
+    # 摘要针对未压缩的内容，压缩版本不带
+    digest_headers(headers, meta)
+    return 200, headers, obj.data
+
+
+def range_request_headers(headers, range_header, if_range):
+    """转发给上游的 Range / If-Range 请求头"""
+    headers = dict(headers)
+    headers['Range'] = range_header
+    # 区间针对未压缩的原始内容
+    headers['Accept-Encoding'] = 'identity'
+    if if_range:
+        headers['If-Range'] = if_range
+    return headers
+
+
+def range_response_headers(upstream_headers, filename):
+    """区间透传时返回给客户端的响应头"""
+    content_type = upstream_headers.get('Content-Type', '')
+    response_headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Content-Type': content_type if content_type.startswith('multipart/') else 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'X-Proxy-By': 'VioletTeam GitHub Proxy',
+        'X-Cache': 'MISS'
+    }
+    for name in ('Content-Range', 'Content-Length', 'ETag', 'Last-Modified'):
+        if upstream_headers.get(name):
+            response_headers[name] = upstream_headers[name]
+    return response_headers
+
+
+def download_response_headers(filename, content_length):
+    """经上游传输（未命中缓存）时返回给客户端的响应头"""
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Content-Type': 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'X-Proxy-By': 'VioletTeam GitHub Proxy',
+        'X-Cache': 'MISS'
+    }
+    if content_length is not None:
+        headers['Content-Length'] = str(content_length)
+    return headers
+
+
+def upstream_error_status(status_code):
+    """上游 4xx（如 404 文件不存在）原样返回，其余视为网关错误"""
+    if status_code is not None and 400 <= status_code < 500:
+        return status_code
+    return 502
+
+
+def check_download_url(url):
+    """
+    校验下载 URL
+
+    返回:
+        不合法时返回 (错误信息 dict, 状态码)，合法返回 None
+    """
+    if not url:
+        logger.warning('下载请求缺少 url 参数')
+        return {
+            'error': '缺少 url 参数',
+            'usage': '/download?url=GITHUB_URL'
+        }, 400
+
+    # 验证 URL 是否为 GitHub 域名
+    if not any(domain in url.lower() for domain in ['github.com', 'githubusercontent.com']):
+        logger.warning(f'非 GitHub URL: {url}')
+        return {
+            'error': '只支持 GitHub 相关域名的 URL',
+            'received_url': url
+        }, 400
+    return None
+
+
+def download_filename(url):
+    """从 URL 中提取文件名"""
+    import urllib.parse
+    from pathlib import Path
+    return Path(urllib.parse.urlparse(url).path).name or 'download.bin'
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+命令行入口：python3 -m ghproxy，或 deploy/guangzhou-github-proxy.py / scripts/github_proxy_gz.py 直接运行
+
+生产环境请使用 gunicorn（见 deploy/gunicorn.conf.py），这里用于调试和单进程部署
+"""
+
+import argparse
+
+from .config import settings
+from .upstream import get_proxies, httpx
+
+
+def print_config():
+    """输出每项配置的生效值和来源"""
+    print(f'配置文件: {settings.env_file}')
+    for name, value, source, help_text in settings.describe():
+        print(f'{name:<34} {value!s:<32} [{source}] {help_text}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='GitHub 下载中转服务')
+    parser.add_argument('--check-config', action='store_true', help='输出生效的配置后退出')
+    args = parser.parse_args(argv)
+    if args.check_config:
+        print_config()
+        return 0
+
+    host, port = settings.bind.rsplit(':', 1)
+    print("=" * 50)
+    print("GitHub 中转服务启动")
+    print("=" * 50)
+    print(f"端口: {port}")
+    print(f"代理: {get_proxies()['http'] or '直连'}")
+    print(f"模式: {settings.server}")
+    print(f"访问: http://{settings.bind}")
+    print("=" * 50)
+
+    # 服务模式: threaded（Flask 多线程，默认）或 asgi（uvicorn + httpx 事件循环）
+    if settings.server == 'asgi':
+        try:
+            import uvicorn
+        except ImportError:
+            uvicorn = None
+        if uvicorn is None or httpx is None:
+            raise SystemExit('ASGI 模式需要安装 uvicorn 和 httpx: pip3 install uvicorn httpx')
+        from .asgi import asgi_app
+        uvicorn.run(
+            asgi_app,
+            host=host,
+            port=int(port),
+            lifespan='on',
+            backlog=4096,
+            timeout_keep_alive=30
+        )
+    else:
+        from .wsgi import app
+        app.run(
+            host=host,
+            port=int(port),
+            threaded=True,
+            debug=False
+        )
+    return 0
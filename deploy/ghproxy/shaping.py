@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+"""
+带宽整形
+
+下载循环原本按上游（或磁盘）能提供的速度发送，一个客户端并行拉取多个大文件时会占满出口带宽。
+整形按客户端分配发送速率：
+
+- 客户端按 GHPROXY_CLIENT_KEY_HEADER 请求头（API key）区分，没有时按 IP（Nginx 设置的 X-Real-IP）；
+  请求头由客户端随意填写，只有 GHPROXY_BANDWIDTH_WEIGHTS 中配置过的 key 才按 key 区分，
+  否则换一个 key 就能多分一份带宽
+- GHPROXY_BANDWIDTH_TOTAL 为服务的总发送带宽，在活跃客户端之间按权重（GHPROXY_BANDWIDTH_WEIGHTS）
+  加权平分（water-filling）：达不到份额的客户端（受自身上限或网络限制）只分到实际需要的速率，
+  剩余部分分给其他客户端；每秒按各客户端的实际发送速率重新分配
+- GHPROXY_BANDWIDTH_PER_CLIENT 为单个客户端（乘以权重）的上限，同一客户端的多个下载共用
+- 每个客户端一个令牌桶（允许 1 秒的突发），同一客户端的各个下载按请求顺序排队取令牌
+
+总带宽在多 worker 部署时按存活的 worker 数平分；整形相关的配置每隔 RELOAD_INTERVAL 秒检查一次
+配置文件（GHPROXY_ENV_FILE），修改后无需重启即生效（预热带宽 GHPROXY_PREFETCH_BANDWIDTH 同样生效）。
+
+启用整形后缓存命中不再交给 sendfile 发送；交给 Nginx 发送（X-Accel-Redirect）的响应带
+X-Accel-Limit-Rate，由 Nginx 按客户端当前的速率限速。
+"""
+
+import os
+import time
+import logging
+import ipaddress
+import threading
+
+from .cache import cache
+from .config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+# 整形配置的重新加载检查间隔（秒）
+RELOAD_INTERVAL = 5
+# 按实际发送速率重新分配带宽的间隔（秒）
+REBALANCE_INTERVAL = 1.0
+# 分配时在实测速率之上预留的增长空间，受限的客户端每次重新分配可以多拿到这个比例
+DEMAND_HEADROOM = 1.5
+# 每个客户端至少分到的速率（字节/秒），避免刚开始的慢速客户端被压到几乎为零
+MIN_CLIENT_RATE = 64 * 1024
+
+
+def parse_weights(value):
+    """'key1=2,10.0.0.8=0.5' -> {'key1': 2.0, '10.0.0.8': 0.5}；格式错误的项忽略"""
+    weights = {}
+    for item in value.split(','):
+        key, _, weight = item.strip().rpartition('=')
+        try:
+            if key and float(weight) > 0:
+                weights[key] = float(weight)
+        except ValueError:
+            logger.warning(f'带宽权重格式错误，已忽略: {item}')
+    return weights
+
+
+def is_ip(value):
+    """权重配置中的一项是否为 IP（其余按 API key 处理）"""
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return True
+
+
+def client_key(api_key, real_ip, remote_addr):
+    """整形使用的客户端标识：可信的 API key（见 Shaper.trusted_key）优先，其次是 Nginx 传来的真实 IP"""
+    if api_key:
+        return 'key:' + api_key
+    return real_ip or remote_addr or '-'
+
+
+class RateLimiter:
+    """令牌桶：多个线程共用的总速率上限（字节/秒，允许 1 秒的突发），rate 为 0 时不限速"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 令牌不足时记为欠账，等待时间按欠账计算，后来的线程排在后面
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ClientShare:
+    """一个活跃客户端：分到的速率、令牌桶与最近的实际发送量"""
+
+    def __init__(self, key, weight):
+        self.key = key
+        self.weight = weight
+        self.streams = 0
+        self.rate = 0
+        # 首次发送前令牌桶是满的（None）
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.window_bytes = 0
+        self.window_started = self.updated
+        # 实测发送速率，尚无数据时为 None（按不受限处理）
+        self.demand = None
+
+
+class ShapedStream:
+    """一个下载响应的整形句柄：reserve() 返回发送 nbytes 前需要等待的秒数"""
+
+    def __init__(self, shaper, share):
+        self.shaper = shaper
+        self.share = share
+        self.closed = False
+
+    def reserve(self, nbytes):
+        return self.shaper.reserve(self.share, nbytes)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.shaper.release(self.share)
+
+
+class Shaper:
+    """所有客户端的带宽分配（每个进程一个）"""
+
+    def __init__(self, config):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self.prefetch = RateLimiter(0)
+        self.workers = 1
+        self._env_mtime = self._stat_env_file(config)
+        self._checked = time.monotonic()
+        self._rebalanced = time.monotonic()
+        self.configure(config)
+
+    @property
+    def enabled(self):
+        return self.total > 0 or self.per_client > 0
+
+    def configure(self, config):
+        """应用整形配置（启动时和配置文件修改后）"""
+        with self._lock:
+            self.total = config.bandwidth_total
+            self.per_client = config.bandwidth_per_client
+            self.weights = parse_weights(config.bandwidth_weights)
+            self.api_keys = {key for key in self.weights if not is_ip(key)}
+            self.key_header = config.client_key_header
+            for share in self._clients.values():
+                share.weight = self._weight(share.key)
+            self.prefetch.rate = config.prefetch_bandwidth
+            self._rebalance()
+
+    def trusted_key(self, value):
+        """请求头中的 API key 是 GHPROXY_BANDWIDTH_WEIGHTS 配置过的 key 时返回它，否则返回 None（按 IP 区分）"""
+        if value and value in self.api_keys:
+            return value
+        return None
+
+    def _weight(self, key):
+        """权重按 API key 或 IP 配置，未配置的为 1"""
+        return self.weights.get(key[len('key:'):] if key.startswith('key:') else key, 1.0)
+
+    def _stat_env_file(self, config):
+        try:
+            return os.stat(config.env_file).st_mtime
+        except OSError:
+            return None
+
+    def refresh(self):
+        """配置文件修改后重新加载；同时更新存活的 worker 数（总带宽按此平分）"""
+        now = time.monotonic()
+        if now - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = now
+        if cache.enabled and self.total > 0:
+            try:
+                self.workers = len(cache.worker_spool_dirs()) + 1
+            except OSError:
+                self.workers = 1
+        mtime = self._stat_env_file(settings)
+        if mtime == self._env_mtime:
+            return
+        self._env_mtime = mtime
+        try:
+            config = Settings.load(env_file=settings.env_file)
+        except ValueError as e:
+            logger.error(f'重新加载整形配置失败: {str(e)}')
+            return
+        self.configure(config)
+        logger.info(f'整形配置已更新: 总带宽 {self.total}, 单客户端 {self.per_client}, '
+                    f'权重 {self.weights}, 预热带宽 {self.prefetch.rate}')
+
+    def open(self, key):
+        """开始一个下载响应，未启用整形时返回 None"""
+        self.refresh()
+        if not self.enabled:
+            return None
+        with self._lock:
+            share = self._clients.get(key)
+            if share is None:
+                share = self._clients[key] = ClientShare(key, self._weight(key))
+            share.streams += 1
+            self._rebalance()
+            return ShapedStream(self, share)
+
+    def release(self, share):
+        with self._lock:
+            share.streams -= 1
+            if share.streams <= 0 and self._clients.get(share.key) is share:
+                del self._clients[share.key]
+                self._rebalance()
+
+    def reserve(self, share, nbytes):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._rebalanced >= REBALANCE_INTERVAL:
+                self._measure(now)
+                self._rebalance()
+            share.window_bytes += nbytes
+            if share.rate <= 0:
+                return 0
+            if share.tokens is None:
+                share.tokens = share.rate
+            share.tokens = min(share.rate, share.tokens + (now - share.updated) * share.rate)
+            share.updated = now
+            share.tokens -= nbytes
+            return max(-share.tokens / share.rate, 0)
+
+    def _measure(self, now):
+        self._rebalanced = now
+        for share in self._clients.values():
+            # 刚开始下载的客户端数据不足，下一轮再测
+            elapsed = now - share.window_started
+            if elapsed < REBALANCE_INTERVAL / 2:
+                continue
+            share.demand = share.window_bytes / elapsed
+            share.window_bytes = 0
+            share.window_started = now
+
+    def _rebalance(self):
+        """
+        按权重加权的 water-filling（调用方持有锁）
+
+        每个客户端的上限为 min(单客户端上限 × 权重, 实测速率 × DEMAND_HEADROOM)，
+        总带宽按权重分给尚未达到上限的客户端，达到上限的客户端多出的份额继续分给其他客户端
+        """
+        shares = list(self._clients.values())
+        caps = {}
+        for share in shares:
+            cap = self.per_client * share.weight if self.per_client > 0 else float('inf')
+            if share.demand is not None and self.total > 0:
+                cap = min(cap, max(share.demand * DEMAND_HEADROOM, MIN_CLIENT_RATE))
+            caps[share.key] = cap
+        if self.total <= 0:
+            for share in shares:
+                share.rate = int(caps[share.key]) if caps[share.key] != float('inf') else 0
+            return
+
+        remaining = self.total / self.workers
+        pending = shares
+        while pending:
+            total_weight = sum(share.weight for share in pending)
+            capped = [share for share in pending if caps[share.key] < remaining * share.weight / total_weight]
+            if not capped:
+                for share in pending:
+                    share.rate = max(int(remaining * share.weight / total_weight), 1)
+                return
+            for share in capped:
+                share.rate = int(caps[share.key])
+                remaining -= share.rate
+            pending = [share for share in pending if share not in capped]
+
+    def client_rate(self, key):
+        """客户端当前分到的速率（字节/秒），不限速时为 0"""
+        with self._lock:
+            share = self._clients.get(key)
+            if share is not None:
+                return share.rate
+            return int(self.per_client * self._weight(key)) if self.per_client > 0 else 0
+
+    def limit_accel(self, headers, key):
+        """交给 Nginx 发送的响应（X-Accel-Redirect）由 Nginx 按单客户端上限限速"""
+        if headers.get('X-Accel-Redirect') and self.enabled:
+            rate = self.client_rate(key)
+            if rate:
+                headers['X-Accel-Limit-Rate'] = str(rate)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'total': self.total,
+                'per_client': self.per_client,
+                'workers': self.workers,
+                'prefetch': self.prefetch.rate,
+                'clients': len(self._clients),
+                'streams': sum(share.streams for share in self._clients.values()),
+                # 只列出分到速率最高的几个客户端，API key 只显示前 4 位
+                'top': [
+                    {
+                        'client': share.key[:8] + '…' if share.key.startswith('key:') else share.key,
+                        'streams': share.streams,
+                        'rate': share.rate,
+                        'demand': int(share.demand) if share.demand is not None else None
+                    }
+                    for share in sorted(self._clients.values(), key=lambda share: share.rate, reverse=True)[:10]
+                ]
+            }
+
+
+class ShapedBody:
+    """按整形速率发送的 WSGI 响应体，迭代与 close() 原样转发"""
+
+    def __init__(self, body, stream):
+        self.body = body
+        self.stream = stream
+
+    def __iter__(self):
+        reserve = self.stream.reserve
+        for chunk in self.body:
+            wait = reserve(len(chunk))
+            if wait > 0:
+                time.sleep(wait)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.stream.close()
+
+
+shaper = Shaper(settings)
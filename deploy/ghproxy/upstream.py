@@ -0,0 +1,1042 @@
+# -*- coding: utf-8 -*-
+
+"""
+上游访问
+
+- UpstreamPool: 按主机复用连接的 requests 会话、重定向跟随与重定向缓存
+- ProxyPool / ProxyRoute: 多个上游出口的择优、健康探测与熔断
+- SegmentedFetch: 大文件按 Range 分段并行下载
+- UpstreamResumer: 传输中断后带 Range + If-Range 续传
+- AsyncUpstreamPool: ASGI 模式使用的 httpx 异步客户端
+"""
+
+import os
+import json
+import time
+import base64
+import socket
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+try:
+    import httpx
+except ImportError:  # 仅 ASGI 模式需要
+    httpx = None
+
+from .config import settings
+from .buffers import CHUNK_MIN, buffers
+from .metrics import (
+    redirect_resolve_seconds, upstream_bytes_per_second, upstream_bytes_total, upstream_connect_seconds,
+    upstream_errors_total, upstream_ttfb_seconds
+)
+
+logger = logging.getLogger(__name__)
+
+# 每段失败后续传重试的次数
+SEGMENT_RETRIES = 3
+# 续传前的等待时间从 RESUME_DELAY 秒起逐次翻倍，最长 RESUME_MAX_DELAY 秒
+RESUME_DELAY = 0.5
+RESUME_MAX_DELAY = 8
+MAX_REDIRECTS = 5
+# 熔断时间的上限（秒）
+UPSTREAM_MAX_COOLDOWN = 300
+
+
+def segmentable(headers):
+    """上游 200 响应是否适合分段并行下载：足够大、支持 Range 且未压缩"""
+    if settings.segments < 2 or headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return False
+    if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return False
+    length = headers.get('Content-Length', '')
+    return length.isdigit() and int(length) >= settings.segment_min
+
+
+class SegmentedFetch:
+    """
+    大文件分段并行下载
+
+    文件按 settings.segment_size 切段，多个线程各自用 Range 请求拉取（每段可经不同的上游出口），
+    run() 所在线程按顺序交出数据，调用方看到的仍是从头开始的顺序数据流：
+    - 重排缓冲：已下载但前面的段尚未完成的段暂存在内存，领先写出位置最多 2 × settings.segments 段；
+      每段开始下载前向进程内存预算整段登记，预算不足时等待（按顺序写出的下一段除外）
+    - 每段失败后从已收到的位置续传，If-Range 保证仍是同一文件，最多重试 SEGMENT_RETRIES 次
+    - 并发数从 2 开始，每完成一轮按总吞吐量调整：明显提升则加一条连接，明显下降则减一条
+    """
+
+    def __init__(self, url, headers, upstream_headers, first=None):
+        self.url = url
+        self.size = int(upstream_headers['Content-Length'])
+        # first: 已打开的上游响应，直接用作第 0 段，省去一次请求
+        self.first = first
+        self.headers = {k: v for k, v in headers.items() if k not in ('If-None-Match', 'If-Modified-Since')}
+        self.headers['Accept-Encoding'] = 'identity'
+        # If-Range 只能使用强 ETag 或 Last-Modified
+        etag = upstream_headers.get('ETag', '')
+        validator = etag if etag.startswith('"') else upstream_headers.get('Last-Modified', '')
+        if validator:
+            self.headers['If-Range'] = validator
+        self.count = (self.size + settings.segment_size - 1) // settings.segment_size
+        self.window = 2 * settings.segments
+        self.limit = min(2, settings.segments)
+        self.active = 0
+        self.next_index = 0   # 下一个待领取的段
+        self.written = 0      # 已按顺序交出的段数
+        self.pieces = {}      # 段序号 -> [bytes]
+        self.error = None
+        self.stopped = False
+        self.retries = 0
+        self._cond = threading.Condition()
+        self._epoch_started = time.monotonic()
+        self._epoch_bytes = 0
+        self._epoch_pieces = 0
+        self._last_rate = None
+
+    def run(self, write):
+        """按顺序对每块数据调用 write(chunk)；任一段重试耗尽或 write 抛出异常时停止所有连接"""
+        for i in range(settings.segments):
+            threading.Thread(target=self._worker, name=f'segment-{i}', daemon=True).start()
+        try:
+            for index in range(self.count):
+                with self._cond:
+                    self._cond.wait_for(lambda: index in self.pieces or self.error is not None)
+                    if index not in self.pieces:
+                        raise self.error
+                    chunks = self.pieces.pop(index)
+                try:
+                    while chunks:
+                        chunk = chunks.pop(0)
+                        buffers.release(len(chunk))
+                        write(chunk)
+                finally:
+                    buffers.release(sum(len(chunk) for chunk in chunks))
+                with self._cond:
+                    self.written = index + 1
+                    self._cond.notify_all()
+                # 等待预算的段可能刚成为下一个写出的段
+                buffers.wake()
+        finally:
+            with self._cond:
+                self.stopped = True
+                leftover = sum(len(chunk) for chunks in self.pieces.values() for chunk in chunks)
+                self.pieces.clear()
+                self._cond.notify_all()
+            buffers.release(leftover)
+        logger.info(f'分段下载完成: {self.url}, {self.count} 段, 并发 {self.limit}, 重试 {self.retries} 次')
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.stopped or self.next_index >= self.count or (
+                    self.active < self.limit and self.next_index < self.written + self.window))
+                if self.stopped or self.next_index >= self.count:
+                    return
+                index = self.next_index
+                self.next_index += 1
+                self.active += 1
+            length = self._length(index)
+            buffers.hold(length, ready=lambda: index <= self.written or self.stopped)
+            try:
+                chunks = self._fetch_piece(index)
+            except Exception as e:
+                buffers.release(length)
+                with self._cond:
+                    self.active -= 1
+                    if self.error is None:
+                        self.error = e
+                    self.stopped = True
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self.active -= 1
+                if self.stopped:
+                    buffers.release(length)
+                    return
+                self.pieces[index] = chunks
+                self._adapt(length)
+                self._cond.notify_all()
+
+    def _adapt(self, nbytes):
+        """每完成 limit 段计算一次总吞吐量，据此增减并发数（调用方持有锁）"""
+        self._epoch_bytes += nbytes
+        self._epoch_pieces += 1
+        if self._epoch_pieces < self.limit:
+            return
+        now = time.monotonic()
+        rate = self._epoch_bytes / max(now - self._epoch_started, 0.001)
+        if self._last_rate is None or rate > self._last_rate * 1.1:
+            self.limit = min(self.limit + 1, settings.segments)
+        elif rate < self._last_rate * 0.8:
+            self.limit = max(self.limit - 1, 2)
+        self._last_rate = rate
+        self._epoch_started = now
+        self._epoch_bytes = 0
+        self._epoch_pieces = 0
+
+    def _length(self, index):
+        return min(settings.segment_size, self.size - index * settings.segment_size)
+
+    def _fetch_piece(self, index):
+        """下载第 index 段，返回数据块列表（所占内存已由调用方登记）"""
+        start = index * settings.segment_size
+        length = self._length(index)
+        chunks = []
+        received = 0
+        attempt = 0
+        while True:
+            try:
+                if self.stopped:
+                    raise IOError('分段下载已停止')
+                r = self._open(start + received, start + length - 1)
+                with r:
+                    started = time.monotonic()
+                    offset = received
+                    while received < length:
+                        if self.stopped:
+                            raise IOError('分段下载已停止')
+                        try:
+                            chunk = r.raw.read(min(CHUNK_MIN, length - received))
+                        except Exception as e:
+                            r.route.record_failure(e)
+                            raise
+                        if not chunk:
+                            raise IOError('上游连接提前关闭')
+                        chunks.append(chunk)
+                        received += len(chunk)
+                    r.route.record_transfer(received - offset, time.monotonic() - started)
+                return chunks
+            except Exception as e:
+                if self.stopped or attempt >= SEGMENT_RETRIES:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self.retries += 1
+                logger.warning(f'分段 {index} 下载失败，{attempt} 秒后从 {start + received} 续传: {self.url}, 错误: {str(e)}')
+                time.sleep(attempt)
+
+    def _open(self, start, end):
+        if start == 0 and self.first is not None:
+            r, self.first = self.first, None
+            return r
+        headers = dict(self.headers)
+        headers['Range'] = f'bytes={start}-{end}'
+        r = upstream.request('GET', self.url, headers, timeout=settings.timeout)
+        if r.status_code != 206 or r.headers.get('Content-Range') != f'bytes {start}-{end}/{self.size}':
+            r.close()
+            # If-Range 不匹配时上游返回 200 整个文件，说明文件已经变化
+            raise IOError(f'分段请求未返回预期区间 (HTTP {r.status_code}, {r.headers.get("Content-Range")})')
+        return r
+
+
+# 可以通过续传恢复的上游读取错误（连接重置、读取超时、响应体不完整）
+RESUMABLE_ERRORS = (Urllib3Error, requests.exceptions.RequestException, OSError)
+
+
+class UpstreamResumer:
+    """
+    上游响应体读取中断后的续传
+
+    带 Range: bytes=<已收到位置>- 和 If-Range（强 ETag 或 Last-Modified）重新请求，
+    上游返回从该位置开始的 206 才继续，否则说明文件已变化，放弃续传。
+    只用于未压缩的响应：压缩时已解码的字节数与上游偏移量对不上
+    """
+
+    def __init__(self, url, headers, status_code, upstream_headers):
+        self.url = url
+        self.attempts = 0
+        self.start = 0
+        self.end = ''
+        etag = upstream_headers.get('ETag', '')
+        self.validator = etag if etag.startswith('"') else upstream_headers.get('Last-Modified', '')
+        self.headers = {k: v for k, v in headers.items() if k not in ('If-None-Match', 'If-Modified-Since', 'Range')}
+        self.headers['Accept-Encoding'] = 'identity'
+        self.headers['If-Range'] = self.validator
+        self.enabled = (
+            settings.resume_retries > 0 and bool(self.validator)
+            and upstream_headers.get('Content-Encoding', 'identity').lower() == 'identity'
+        )
+        if status_code == 206:
+            # 只续传单区间响应，多区间（multipart）无法按偏移量拼接
+            content_range = parse_content_range(upstream_headers.get('Content-Range'))
+            if content_range is None:
+                self.enabled = False
+            else:
+                self.start, end, _ = content_range
+                self.end = str(end)
+        elif upstream_headers.get('Accept-Ranges', '').lower() != 'bytes':
+            self.enabled = False
+
+    def next_attempt(self, received, error):
+        """登记一次续传并返回 (请求头, 等待秒数)；不能续传或次数用尽时抛出原始错误"""
+        if not self.enabled or self.attempts >= settings.resume_retries:
+            raise error
+        self.attempts += 1
+        delay = min(RESUME_DELAY * 2 ** (self.attempts - 1), RESUME_MAX_DELAY)
+        offset = self.start + received
+        logger.warning(
+            f'上游传输中断，{delay} 秒后从 {offset} 续传（第 {self.attempts} 次）: {self.url}, 错误: {str(error)}'
+        )
+        headers = dict(self.headers)
+        headers['Range'] = f'bytes={offset}-{self.end}'
+        return headers, delay
+
+    def check(self, status_code, upstream_headers, received):
+        """续传响应必须是从请求位置开始的 206"""
+        content_range = parse_content_range(upstream_headers.get('Content-Range'))
+        if status_code != 206 or content_range is None or content_range[0] != self.start + received:
+            raise IOError(f'上游文件已变化，无法续传 (HTTP {status_code})')
+
+    def reopen(self, received, error):
+        """同步续传，返回新的流式 requests.Response"""
+        while True:
+            headers, delay = self.next_attempt(received, error)
+            time.sleep(delay)
+            try:
+                r = upstream.request('GET', self.url, headers, timeout=settings.timeout)
+            except requests.exceptions.RequestException as e:
+                error = e
+                continue
+            if r.status_code >= 500:
+                # 上游临时故障，不代表文件已变化，继续按退避时间重试
+                r.close()
+                error = IOError(f'续传请求失败 (HTTP {r.status_code})')
+                continue
+            try:
+                self.check(r.status_code, r.headers, received)
+            except IOError:
+                r.close()
+                raise
+            return r
+
+    async def areopen(self, received, error):
+        """异步续传，返回新的流式 httpx.Response"""
+        while True:
+            headers, delay = self.next_attempt(received, error)
+            await asyncio.sleep(delay)
+            try:
+                r = await async_upstream.request('GET', self.url, headers)
+            except httpx.TransportError as e:
+                error = e
+                continue
+            if r.status_code >= 500:
+                await r.aclose()
+                error = IOError(f'续传请求失败 (HTTP {r.status_code})')
+                continue
+            try:
+                self.check(r.status_code, r.headers, received)
+            except IOError:
+                await r.aclose()
+                raise
+            return r
+
+
+def parse_content_range(value):
+    """解析 'bytes start-end/total'，返回 (start, end, total 或 None)；无法解析时返回 None"""
+    if not value or not value.startswith('bytes '):
+        return None
+    try:
+        span, total = value[6:].split('/', 1)
+        start, end = span.split('-', 1)
+        return int(start), int(end), None if total == '*' else int(total)
+    except ValueError:
+        return None
+
+
+def keepalive_socket_options():
+    """在 urllib3 默认选项（TCP_NODELAY）基础上开启 TCP keepalive"""
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, settings.pool_keepalive))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(settings.pool_keepalive // 4, 1)))
+    return options
+
+
+class TimedConnectMixin:
+    """记录新建连接耗时：connect() 包含 TCP 握手、经代理时的 CONNECT 隧道以及 TLS 握手"""
+
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        upstream_connect_seconds.observe(time.monotonic() - started)
+
+
+class TimedHTTPConnection(TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+TIMED_POOL_CLASSES = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """直连和经代理的连接都使用 keepalive socket 选项，并记录建连耗时"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = keepalive_socket_options()
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **kwargs):
+        kwargs['socket_options'] = keepalive_socket_options()
+        manager = super().proxy_manager_for(proxy, **kwargs)
+        manager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+        return manager
+
+
+def redirect_headers(headers, origin, url):
+    """
+    跟随重定向（或直接请求缓存的重定向目标）时发给 url 的请求头
+
+    凭据只发给原始主机：目标主机与 origin 不同时去掉 Authorization（与 requests 的 rebuild_auth 一致），
+    以免私有仓库的令牌随 302 发给 CDN 或第三方主机
+    """
+    import urllib.parse
+    if not headers or urllib.parse.urlsplit(url).netloc.lower() == urllib.parse.urlsplit(origin).netloc.lower():
+        return headers
+    return {name: value for name, value in headers.items() if name.lower() != 'authorization'}
+
+
+def signed_url_expiry(url):
+    """
+    从签名 URL 推算过期时间（epoch 秒）
+
+    识别 S3 风格的 X-Amz-Date + X-Amz-Expires、Azure SAS 的 se 参数以及 jwt 参数中的 exp，
+    取其中最早的一个；都没有时返回 None
+    """
+    import urllib.parse
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    expiries = []
+    try:
+        if 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+            signed_at = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+            expiries.append(signed_at.replace(tzinfo=timezone.utc).timestamp() + int(query['X-Amz-Expires'][0]))
+        if 'se' in query:
+            expiries.append(datetime.fromisoformat(query['se'][0].replace('Z', '+00:00')).timestamp())
+        if 'jwt' in query:
+            payload = query['jwt'][0].split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            if 'exp' in claims:
+                expiries.append(float(claims['exp']))
+    except (ValueError, IndexError, TypeError):
+        pass
+    return min(expiries) if expiries else None
+
+
+class RedirectCache:
+    """
+    重定向目标缓存：原始 URL -> 已解析的最终 URL
+
+    github.com 的 Release 地址会 302 到带签名的 objects.githubusercontent.com 地址，
+    缓存解析结果可以省掉一到两次跨境往返。条目的有效期不超过签名过期时间减去安全余量。
+    """
+
+    def __init__(self, ttl, margin, max_entries=4096):
+        self.ttl = ttl
+        self.margin = margin
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # url -> (resolved_url, expires_at)
+
+    def get(self, url):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            item = self._entries.get(url)
+            if item is None or item[1] <= time.time():
+                self._entries.pop(url, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return item[0]
+
+    def put(self, url, resolved):
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        signed_expiry = signed_url_expiry(resolved)
+        if signed_expiry is not None:
+            expires_at = min(expires_at, signed_expiry - self.margin)
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[url] = (resolved, expires_at)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
+
+
+def ewma(current, sample, alpha=0.3):
+    """指数加权移动平均，首个样本直接作为初值"""
+    if current is None:
+        return sample
+    return current + alpha * (sample - current)
+
+
+class ProxyRoute:
+    """
+    一个上游出口（某个代理或直连）及其健康状态
+
+    - 首字节时间（latency）与吞吐量（throughput）按 EWMA 平滑
+    - 熔断：连续失败 settings.upstream_failures 次后断开（open），冷却期过后放行一次请求试探（half-open），
+      试探成功恢复，失败则冷却时间翻倍（最长 UPSTREAM_MAX_COOLDOWN 秒）
+
+    peer 为 True 时是集群中的另一个节点（见 peers.py），其响应已经在对方节点完成分段下载与续传
+    """
+
+    # 只用足够大的传输估算吞吐量，小文件主要反映的是延迟
+    MIN_TRANSFER_BYTES = 256 * 1024
+
+    def __init__(self, name, proxies, peer=False):
+        self.name = name
+        self.proxies = proxies
+        self.peer = peer
+        self.latency = None
+        self.throughput = None
+        self.requests = 0
+        self.probes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.bytes = 0
+        self.last_error = None
+        self.cooldown = settings.upstream_cooldown
+        self.open_until = 0
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def state(self, now):
+        if self.consecutive_failures < settings.upstream_failures:
+            return 'closed'
+        return 'open' if now < self.open_until else 'half-open'
+
+    def available(self, now):
+        return now >= self.open_until
+
+    def score(self):
+        """预计下载 ProxyPool.SCORE_BYTES 所需的秒数；尚未测量的项按 0 计，新出口会被优先尝试"""
+        transfer = ProxyPool.SCORE_BYTES / self.throughput if self.throughput else 0
+        return (self.latency or 0) + transfer
+
+    def claim(self, probe=False):
+        """出口被选中；熔断状态下这次请求就是试探，试探结束前不再放行其他请求"""
+        with self._lock:
+            if probe:
+                self.probes += 1
+            else:
+                self.requests += 1
+            if self.consecutive_failures >= settings.upstream_failures:
+                self.trial = True
+                self.open_until = time.monotonic() + self.cooldown
+
+    def record_success(self, latency):
+        upstream_ttfb_seconds.observe(latency, self.name)
+        with self._lock:
+            self.latency = ewma(self.latency, latency)
+            recovered = self.consecutive_failures >= settings.upstream_failures
+            self.consecutive_failures = 0
+            self.cooldown = settings.upstream_cooldown
+            self.open_until = 0
+            self.trial = False
+        if recovered:
+            logger.info(f'上游出口已恢复: {self.name}')
+
+    def record_transfer(self, nbytes, seconds):
+        upstream_bytes_total.inc(self.name, amount=nbytes)
+        with self._lock:
+            self.bytes += nbytes
+            if nbytes >= self.MIN_TRANSFER_BYTES and seconds > 0:
+                self.throughput = ewma(self.throughput, nbytes / seconds)
+                upstream_bytes_per_second.observe(nbytes / seconds, self.name)
+
+    def record_failure(self, error):
+        # 上游 5xx 以字符串传入，其余为异常对象
+        upstream_errors_total.inc('HTTP5xx' if isinstance(error, str) else type(error).__name__)
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            if self.trial:
+                self.trial = False
+                self.cooldown = min(self.cooldown * 2, UPSTREAM_MAX_COOLDOWN)
+            elif self.consecutive_failures != settings.upstream_failures:
+                return
+            self.open_until = time.monotonic() + self.cooldown
+        logger.warning(f'上游出口熔断 {self.cooldown} 秒: {self.name}, 错误: {str(error)}')
+
+    def stats(self, now):
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state(now),
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                'throughput': round(self.throughput) if self.throughput is not None else None,
+                'score': round(self.score(), 3),
+                'requests': self.requests,
+                'probes': self.probes,
+                'failures': self.failures,
+                'consecutive_failures': self.consecutive_failures,
+                'bytes': self.bytes,
+                'open_seconds': round(max(self.open_until - now, 0), 1),
+                'last_error': self.last_error
+            }
+
+
+class ProxyPool:
+    """
+    上游出口池：每个请求使用评分最低（预计最快）的可用出口
+
+    评分 = 首字节时间 + SCORE_BYTES / 吞吐量；全部熔断时选最早结束冷却的出口，而不是直接拒绝请求。
+    有多个出口时后台线程定期通过每个出口请求探测地址，保持评分和熔断状态为最新
+    """
+
+    SCORE_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, routes, probe_url, probe_interval):
+        self.routes = routes
+        self.probe_url = probe_url
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._prober_pid = None
+
+    def choose(self, exclude=()):
+        self._start_prober()
+        now = time.monotonic()
+        candidates = [route for route in self.routes if route not in exclude] or self.routes
+        available = [route for route in candidates if route.available(now)]
+        if not available:
+            return min(candidates, key=lambda route: route.open_until)
+        return min(available, key=ProxyRoute.score)
+
+    def _start_prober(self):
+        # 按进程启动：gunicorn fork 出的 worker 各自探测
+        if len(self.routes) < 2 or self.probe_interval <= 0 or self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober_pid == os.getpid():
+                return
+            self._prober_pid = os.getpid()
+        threading.Thread(target=self._probe_loop, name='upstream-prober', daemon=True).start()
+
+    def _probe_loop(self):
+        while True:
+            now = time.monotonic()
+            for route in self.routes:
+                # 熔断冷却中的出口不探测，冷却结束后由探测充当试探请求
+                if route.available(now):
+                    self.probe(route)
+            time.sleep(self.probe_interval)
+
+    def probe(self, route):
+        try:
+            r = upstream.request(
+                'GET', self.probe_url, {'User-Agent': 'VioletTeam GitHub Proxy health check'},
+                timeout=10, route=route, probe=True
+            )
+            with r:
+                r.content
+        except Exception:
+            # 失败已由 UpstreamPool.request 记录
+            pass
+
+    def stats(self):
+        now = time.monotonic()
+        return [route.stats(now) for route in self.routes]
+
+
+class UpstreamPool:
+    """
+    按上游主机划分的 keep-alive 连接池
+
+    github.com、objects.githubusercontent.com、codeload.github.com 等每个主机各有一个
+    requests.Session，重定向由本类逐跳跟随，每一跳都复用目标主机自己的连接池，
+    避免每次下载都重新经过代理做 TCP + TLS 握手。空闲超时的主机连接池会被关闭。
+    """
+
+    def __init__(self, pool_size, idle_timeout):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}  # host -> [session, last_used]
+        self._retired = {}   # host -> {'requests': n, 'connections': n}，已关闭连接池的累计值
+
+    def _new_session(self):
+        session = requests.Session()
+        # 连接池在所有客户端之间共享，不保存上游下发的 Cookie
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = KeepAliveAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session_for(self, host):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle_locked(now)
+            item = self._sessions.get(host)
+            if item is None:
+                item = self._sessions[host] = [self._new_session(), now]
+            item[1] = now
+            return item[0]
+
+    def _evict_idle_locked(self, now):
+        for host, (session, last_used) in list(self._sessions.items()):
+            if now - last_used > self.idle_timeout:
+                counters = self._retired.setdefault(host, {'requests': 0, 'connections': 0})
+                for key, value in self._session_counters(session).items():
+                    counters[key] += value
+                session.close()
+                del self._sessions[host]
+                logger.info(f'关闭空闲连接池: {host}')
+
+    @staticmethod
+    def _session_counters(session):
+        """汇总 session 下所有 urllib3 连接池的请求数与新建连接数"""
+        counters = {'requests': 0, 'connections': 0}
+        for adapter in set(session.adapters.values()):
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in manager.pools.keys():
+                    pool = manager.pools.get(key)
+                    if pool is not None:
+                        counters['requests'] += pool.num_requests
+                        counters['connections'] += pool.num_connections
+        return counters
+
+    def request(self, method, url, headers, timeout, stream=True, route=None, probe=False, data=None):
+        """
+        通过上游出口发送请求并逐跳跟随重定向
+
+        未指定 route 时由出口池选择最快的可用出口；连接失败时换一个出口重试一次。
+        data 为请求体（bytes，如 git 协商请求），带请求体的请求不使用重定向缓存。
+        首字节时间和失败记入出口的健康状态，返回的响应带有 route 属性，供调用方记录吞吐量
+
+        返回:
+            最终（非重定向）的 requests.Response
+        """
+        routes = [route] if route else []
+        if route is None:
+            routes.append(proxy_pool.choose())
+        tried = []
+        while True:
+            route = routes.pop(0)
+            tried.append(route)
+            route.claim(probe)
+            started = time.monotonic()
+            try:
+                r = self._resolve(method, url, headers, route.proxies, timeout, stream, data)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                route.record_failure(e)
+                if probe or len(tried) > 1 or len(proxy_pool.routes) < 2:
+                    raise
+                routes.append(proxy_pool.choose(exclude=tried))
+                logger.warning(f'上游出口 {route.name} 请求失败，改用 {routes[0].name}: {str(e)}')
+                continue
+            # 代理隧道故障时 Privoxy 等通常返回 5xx
+            if r.status_code >= 500:
+                route.record_failure(f'HTTP {r.status_code}')
+            else:
+                route.record_success(time.monotonic() - started)
+            r.route = route
+            return r
+
+    def _resolve(self, method, url, headers, proxies, timeout, stream, data=None):
+        """
+        命中重定向缓存时直接请求已解析的 CDN 地址；该地址返回 4xx（通常是签名过期）时
+        作废缓存并从原始 URL 重新解析
+        """
+        if data is not None:
+            return self._follow(method, url, headers, proxies, timeout, stream, data)[0]
+        resolved = redirects.get(url)
+        if resolved:
+            r, _ = self._follow(method, resolved, headers, proxies, timeout, stream, origin=url)
+            if not (400 <= r.status_code < 500 and r.status_code != 416):
+                return r
+            logger.info(f'重定向目标已失效 (HTTP {r.status_code})，重新解析: {url}')
+            r.close()
+            redirects.invalidate(url)
+
+        r, final_url = self._follow(method, url, headers, proxies, timeout, stream)
+        if final_url != url and r.status_code < 400:
+            redirects.put(url, final_url)
+        return r
+
+    def _follow(self, method, url, headers, proxies, timeout, stream, data=None, origin=None):
+        """
+        逐跳跟随重定向，返回 (响应, 最终 URL)
+
+        origin 为请求头中凭据所属的原始 URL（默认为 url），跳到其他主机时不再发送 Authorization
+        """
+        import urllib.parse
+        origin = origin or url
+        # 从发出第一个请求到拿到最终地址（最后一个重定向响应读完）的时间
+        started = time.monotonic()
+        resolved = None
+        for _ in range(MAX_REDIRECTS + 1):
+            host = urllib.parse.urlsplit(url).netloc.lower()
+            r = self.session_for(host).request(
+                method,
+                url,
+                headers=redirect_headers(headers, origin, url),
+                data=data,
+                proxies=proxies,
+                stream=stream,
+                timeout=timeout,
+                allow_redirects=False
+            )
+            if not r.is_redirect:
+                if resolved is not None:
+                    redirect_resolve_seconds.observe(resolved)
+                return r, url
+            url = urllib.parse.urljoin(url, r.headers['Location'])
+            # 读完重定向响应体，连接才能归还连接池
+            r.content
+            r.close()
+            resolved = time.monotonic() - started
+        raise requests.exceptions.TooManyRedirects(f'重定向超过 {MAX_REDIRECTS} 次')
+
+    def stats(self):
+        with self._lock:
+            hosts = {host: dict(counters) for host, counters in self._retired.items()}
+            now = time.monotonic()
+            for host, (session, last_used) in self._sessions.items():
+                counters = hosts.setdefault(host, {'requests': 0, 'connections': 0})
+                for key, value in self._session_counters(session).items():
+                    counters[key] += value
+                counters['idle_seconds'] = round(now - last_used, 1)
+        for counters in hosts.values():
+            # 未新建连接的请求即连接池命中
+            counters['hits'] = counters['requests'] - counters['connections']
+            counters['misses'] = counters['connections']
+        return {
+            'pool_size': self.pool_size,
+            'idle_timeout': self.idle_timeout,
+            'hosts': hosts
+        }
+
+
+redirects = RedirectCache(settings.redirect_ttl, settings.redirect_margin)
+upstream = UpstreamPool(settings.pool_size, settings.pool_idle_timeout)
+
+
+def get_proxies():
+    """
+    获取代理配置（HTTP_PROXY / HTTPS_PROXY）
+    默认使用本地 Privoxy（端口 8118）或 Shadowsocks 本地代理
+    """
+    http_proxy = settings.http_proxy
+    https_proxy = settings.https_proxy if settings.https_proxy is not None else http_proxy
+    return {
+        'http': http_proxy,
+        'https': https_proxy
+    }
+
+
+def load_proxy_routes():
+    """
+    根据 GHPROXY_UPSTREAMS 构建出口列表；未配置时只有 get_proxies() 一个出口
+
+    直连出口显式把代理设为 None，避免 requests 回退到环境变量中的代理
+    """
+    if not settings.upstreams.strip():
+        proxies = get_proxies()
+        name = proxies['http'] or 'direct'
+        if not proxies['http'] and not proxies['https']:
+            proxies = {'http': None, 'https': None}
+        return [ProxyRoute(name, proxies)]
+    routes = []
+    for item in settings.upstreams.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item == 'direct':
+            routes.append(ProxyRoute('direct', {'http': None, 'https': None}))
+        else:
+            routes.append(ProxyRoute(item, {'http': item, 'https': item}))
+    return routes
+
+
+proxy_pool = ProxyPool(load_proxy_routes(), settings.upstream_probe_url, settings.upstream_probe_interval)
+
+
+class AsyncUpstreamPool:
+    """
+    httpx 异步上游客户端
+
+    httpx 按目标主机维护 keep-alive 连接池，每个上游出口一个客户端；
+    出口选择、熔断与故障切换和 UpstreamPool 共用 proxy_pool，重定向同样逐跳跟随并使用重定向缓存
+    """
+
+    def __init__(self, pool_size, idle_timeout):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.requests = {}  # host -> 请求数
+        self._clients = {}  # 出口名称 -> httpx.AsyncClient
+
+    def client(self, route):
+        client = self._clients.get(route.name)
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=self.pool_size,
+                keepalive_expiry=self.idle_timeout
+            )
+            mounts = {}
+            for scheme in ('http', 'https'):
+                proxy = route.proxies.get(scheme)
+                mounts[f'{scheme}://'] = httpx.AsyncHTTPTransport(
+                    limits=limits,
+                    proxy=httpx.Proxy(proxy) if proxy else None
+                )
+            client = httpx.AsyncClient(
+                mounts=mounts,
+                timeout=httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout),
+                follow_redirects=False,
+                trust_env=False
+            )
+            self._clients[route.name] = client
+        return client
+
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    async def request(self, method, url, headers, data=None):
+        """
+        通过上游出口发送请求并逐跳跟随重定向，返回最终的流式 httpx.Response
+
+        连接失败时换一个出口重试一次；返回的响应带有 route 属性；
+        data 为请求体（bytes），带请求体的请求不使用重定向缓存
+        """
+        tried = []
+        while True:
+            route = proxy_pool.choose(exclude=tried)
+            tried.append(route)
+            route.claim()
+            started = time.monotonic()
+            try:
+                r = await self._resolve(self.client(route), method, url, headers, data)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                route.record_failure(e)
+                if len(tried) > 1 or len(proxy_pool.routes) < 2:
+                    raise
+                logger.warning(f'上游出口 {route.name} 请求失败，换用其他出口: {str(e)}')
+                continue
+            if r.status_code >= 500:
+                route.record_failure(f'HTTP {r.status_code}')
+            else:
+                route.record_success(time.monotonic() - started)
+            r.route = route
+            return r
+
+    async def _resolve(self, client, method, url, headers, data=None):
+        if data is not None:
+            return (await self._follow(client, method, url, headers, data))[0]
+        resolved = redirects.get(url)
+        if resolved:
+            r, _ = await self._follow(client, method, resolved, headers, origin=url)
+            if not (400 <= r.status_code < 500 and r.status_code != 416):
+                return r
+            logger.info(f'重定向目标已失效 (HTTP {r.status_code})，重新解析: {url}')
+            await r.aclose()
+            redirects.invalidate(url)
+
+        r, final_url = await self._follow(client, method, url, headers)
+        if final_url != url and r.status_code < 400:
+            redirects.put(url, final_url)
+        return r
+
+    async def _follow(self, client, method, url, headers, data=None, origin=None):
+        import urllib.parse
+        origin = origin or url
+        started = time.monotonic()
+        resolved = None
+        for _ in range(MAX_REDIRECTS + 1):
+            host = urllib.parse.urlsplit(url).netloc.lower()
+            self.requests[host] = self.requests.get(host, 0) + 1
+            trace = ConnectTrace()
+            request = client.build_request(method, url, headers=redirect_headers(headers, origin, url), content=data,
+                                           extensions={'trace': trace})
+            r = await client.send(request, stream=True)
+            trace.finish()
+            if not r.is_redirect:
+                if resolved is not None:
+                    redirect_resolve_seconds.observe(resolved)
+                return r, url
+            url = urllib.parse.urljoin(url, r.headers['Location'])
+            await r.aread()
+            await r.aclose()
+            resolved = time.monotonic() - started
+        raise httpx.TooManyRedirects(f'重定向超过 {MAX_REDIRECTS} 次')
+
+    def stats(self):
+        return {
+            'pool_size': self.pool_size,
+            'idle_timeout': self.idle_timeout,
+            'hosts': {host: {'requests': count} for host, count in self.requests.items()}
+        }
+
+
+class ConnectTrace:
+    """
+    httpcore trace 回调：记录新建连接的耗时（TCP、代理隧道与 TLS 握手）
+
+    复用连接时没有建连事件；经代理访问 HTTPS 时最后一步是隧道内的 proxy.start_tls
+    """
+
+    def __init__(self):
+        self.started = None
+        self.elapsed = None
+
+    async def __call__(self, event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            self.started = time.monotonic()
+        elif self.started is not None and event_name.endswith(('.connect_tcp.complete', '.start_tls.complete')):
+            self.elapsed = time.monotonic() - self.started
+
+    def finish(self):
+        if self.elapsed is not None:
+            upstream_connect_seconds.observe(self.elapsed)
+
+
+async_upstream = AsyncUpstreamPool(settings.pool_size, settings.pool_idle_timeout) if httpx else None
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+
+"""
+线程模式的 Flask（WSGI）应用
+
+由 gunicorn（gthread worker）或 Flask 开发服务器运行；每个下载占用一个线程，
+未命中缓存的整文件下载通过 FlightRegistry 合并，Range 请求直接转发给上游
+"""
+
+import logging
+
+import requests
+from flask import Flask, request, Response, jsonify
+from werkzeug.wsgi import wrap_file
+
+from .accesslog import access_log
+from .buffers import CHUNK_SIZE, ChunkSizer, buffers
+from .cache import cache, flights
+from .config import settings
+from .git import (
+    GIT_MAX_REQUEST_BYTES, GitRequest, check_git_request, git_cached_response, git_error_response, git_lookup,
+    git_path, git_response_headers, git_stale_entry
+)
+from .memory import memory_cache
+from .metrics import MeteredBody, StreamMeter, metered_source, metrics
+from .peers import HOPS_HEADER, PEER_HEADER, cluster, peer_response_headers
+from .prefetch import prefetch_admin, prefetcher
+from .responses import (
+    cached_response, check_download_url, download_filename, download_response_headers, index, memory_response,
+    range_request_headers, range_response_headers, status_info, upstream_error_status
+)
+from .shaping import ShapedBody, client_key, shaper
+from .upstream import RESUMABLE_ERRORS, UpstreamResumer, upstream
+
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+
+@app.route('/')
+def home():
+    """服务首页，显示使用说明"""
+    return index()
+
+
+@app.route('/status')
+def status():
+    """健康检查端点"""
+    return jsonify(status_info(flights, upstream))
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 指标"""
+    return Response(metrics.render(cache), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/admin/prefetch', methods=['GET', 'POST'])
+def admin_prefetch():
+    """Release 预热管理接口"""
+    payload = request.get_json(silent=True) if request.method == 'POST' else None
+    result, status_code = prefetch_admin(request.method, request.headers.get('Authorization'), payload)
+    return jsonify(result), status_code
+
+
+@app.before_request
+def begin_access_log():
+    access_log.begin(request.method, request.path)
+
+
+@app.after_request
+def meter_response(response):
+    """
+    下载响应计入 /metrics：进行中的流、发送字节数与发送速率；启用带宽整形时按客户端限速
+
+    响应发送结束（或客户端断开）后写访问日志
+    """
+    metrics.start_flusher(cache)
+    prefetcher.start()
+    client = client_key(
+        shaper.trusted_key(request.headers.get(shaper.key_header)) if shaper.key_header else None,
+        request.headers.get('X-Real-IP'), request.remote_addr
+    )
+    # 集群内其他节点（带共享密钥）的请求不参与带宽整形
+    shaped = not cluster.trusted(request.headers.get(PEER_HEADER))
+    if shaped:
+        shaper.limit_accel(response.headers, client)
+    record = access_log.current()
+    if record is not None:
+        access_log.respond(record, response.status_code, response.headers, client)
+    source = metered_source(response.headers)
+    if source is None or request.method == 'HEAD':
+        if record is not None:
+            nbytes = 0 if request.method == 'HEAD' else None
+            response.call_on_close(lambda: access_log.finish(record, nbytes, True))
+        return response
+    meter = StreamMeter(source)
+    if response.direct_passthrough:
+        # wsgi.file_wrapper 由 gunicorn 用 sendfile 发送，按 Content-Length 计入。
+        # 直接透传的响应体不经过 Response.close()，call_on_close 不会被调用，改为接在文件包装的 close() 之后
+        length = int(response.headers.get('Content-Length', 0))
+        body = response.response
+        close_body = getattr(body, 'close', None)
+
+        def close_meter():
+            try:
+                if close_body is not None:
+                    close_body()
+            finally:
+                meter.add(length)
+                meter.close()
+                if record is not None:
+                    access_log.finish(record, None, True)
+
+        body.close = close_meter
+        return response
+    response.response = MeteredBody(response.response, meter)
+    if record is not None:
+        response.call_on_close(lambda: access_log.finish(record, meter.sent, meter.complete))
+    stream = shaper.open(client) if shaped else None
+    if stream is not None:
+        response.response = ShapedBody(response.response, stream)
+    return response
+
+
+def serve_cached(entry, filename, cache_status):
+    """
+    直接从本地磁盘返回缓存的文件，不经过上游
+
+    小文件载入内存缓存后从内存返回；
+    WSGI 服务器提供 wsgi.file_wrapper 时（gunicorn），整文件和单区间响应交给它发送：
+    gunicorn 从文件当前偏移处用 os.sendfile 发送 Content-Length 字节，数据不经过用户态
+    """
+    if memory_cache.eligible(entry) and not request.headers.get('Range'):
+        obj = memory_cache.load(entry)
+        if obj is not None:
+            return serve_memory(obj, filename, cache_status)
+    status_code, headers, body = cached_response(
+        entry, filename, cache_status,
+        request.headers.get('Range'), request.headers.get('If-Range'),
+        request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'),
+        accel=not from_peer()
+    )
+    if from_peer():
+        peer_response_headers(headers, entry)
+    return send_cached(status_code, headers, body)
+
+
+def serve_memory(obj, filename, cache_status):
+    status_code, headers, body = memory_response(
+        obj, filename, cache_status, request.headers.get('Accept-Encoding'),
+        request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')
+    )
+    if from_peer():
+        peer_response_headers(headers, obj.meta)
+    return Response(body, status=status_code, headers=headers)
+
+
+def peer_hops():
+    """请求已经过的节点数：客户端直接请求为 0，其他节点（密钥一致）转发的请求至少为 1"""
+    return cluster.request_hops(request.headers.get(PEER_HEADER), request.headers.get(HOPS_HEADER))
+
+
+def from_peer():
+    """请求来自集群中的其他节点：不再转发给同级节点，只向上一级节点请求"""
+    return peer_hops() > 0
+
+
+def send_cached(status_code, headers, body):
+    """发送 CachedBody，能整段 sendfile 时交给 wsgi.file_wrapper（启用带宽整形时不用 sendfile）"""
+    span = body.sendfile_span()
+    shaped = shaper.enabled and not cluster.trusted(request.headers.get(PEER_HEADER))
+    if span and 'wsgi.file_wrapper' in request.environ and not shaped:
+        body.f.seek(span[0])
+        return Response(
+            wrap_file(request.environ, body.f, CHUNK_SIZE),
+            status=status_code, headers=headers, direct_passthrough=True
+        )
+    return Response(body, status=status_code, headers=headers)
+
+
+def proxy_range(url, headers, filename):
+    """
+    Range 请求未命中缓存时直接转发给上游（不经过请求合并）
+
+    Range / If-Range 原样透传，上游的 206/416 状态码和 Content-Range 原样返回；
+    配置了集群时先转发给负责该文件的节点
+    """
+    headers = range_request_headers(headers, request.headers['Range'], request.headers.get('If-Range'))
+    r = cluster.request(url, headers, settings.timeout, hops=peer_hops())
+    if r is None:
+        r = upstream.request('GET', url, headers, timeout=settings.timeout)
+    access_log.note(upstream=r.route.name)
+    if r.status_code not in (200, 206, 416):
+        r.close()
+        r.raise_for_status()
+        raise requests.exceptions.RequestException(f'上游返回 HTTP {r.status_code}')
+
+    response = Response(
+        upstream_body(r, UpstreamResumer(url, headers, r.status_code, r.headers)),
+        status=r.status_code,
+        headers=range_response_headers(r.headers, filename)
+    )
+    response.call_on_close(r.close)
+    return response
+
+
+def upstream_body(r, resumer):
+    """
+    不落盘的上游响应体：块大小随客户端接收速度调整，并计入内存预算
+
+    上游中断时由 resumer 从已发送的位置续传，客户端收到的仍是同一个完整响应
+    """
+    sizer = ChunkSizer()
+    total = 0
+    first = r
+    length = r.headers.get('Content-Length')
+    expected = int(length) if length and length.isdigit() else None
+    try:
+        while True:
+            size = buffers.reserve(sizer.next_size())
+            try:
+                try:
+                    chunk = r.raw.read(size, decode_content=True)
+                    if not chunk and expected is not None and total < expected and resumer.enabled:
+                        raise IOError('上游连接提前关闭')
+                except RESUMABLE_ERRORS as e:
+                    r.route.record_failure(e)
+                    if r is not first:
+                        r.close()
+                    r = resumer.reopen(total, e)
+                    continue
+                if not chunk:
+                    # 转发速度受客户端限制，只计入字节数，不参与吞吐量估算
+                    r.route.record_transfer(total, 0)
+                    return
+                total += len(chunk)
+                sizer.sent(len(chunk))
+                yield chunk
+            finally:
+                buffers.release(size)
+    finally:
+        if r is not first:
+            r.close()
+
+
+@app.route('/download')
+def download():
+    """
+    文件下载端点
+    
+    参数:
+        url: GitHub 文件 URL（必需）
+    
+    返回:
+        文件流（application/octet-stream）
+    """
+    return download_url(request.args.get('url'))
+
+
+@app.route('/github/<path:url_suffix>', methods=['GET', 'POST'])
+def github_proxy(url_suffix):
+    """
+    GitHub 快捷路由
+
+    /github/owner/repo/releases/download/v1.0.0/file.tgz
+        -> https://github.com/owner/repo/releases/download/v1.0.0/file.tgz
+    /github/owner/repo.git 可直接作为 git clone 地址（smart HTTP，见 git.py）
+
+    查询字符串原样带到 GitHub 地址上（与 ASGI 模式一致）
+    """
+    git = git_path(url_suffix)
+    if git:
+        return git_proxy(*git)
+    if request.method not in ('GET', 'HEAD'):
+        return jsonify({'error': '请求方法不正确'}), 405, {'Allow': 'GET, HEAD'}
+    url = f'https://github.com/{url_suffix}'
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+    return download_url(url)
+
+
+def git_proxy(repo_url, service):
+    """
+    git smart-HTTP 请求
+
+    可缓存的请求（引用通告、以 done 结束的 fetch）先查缓存，未命中时合并为一次上游传输并落盘；
+    其余请求流式转发
+    """
+    query = request.query_string.decode('latin-1')
+    error = check_git_request(service, request.method, query, request.content_length)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    body = None
+    if request.method == 'POST':
+        body = request.stream.read(GIT_MAX_REQUEST_BYTES + 1)
+        if len(body) > GIT_MAX_REQUEST_BYTES:
+            return jsonify({'error': '请求体过大'}), 413
+    git_request = GitRequest(repo_url, service, request.method, request.headers, query, body)
+    access_log.note(url=git_request.url)
+
+    entry = git_lookup(git_request)
+    if entry:
+        cache.record(hit=True)
+        return send_cached(*git_cached_response(entry, 'HIT'))
+
+    try:
+        if git_request.key is None:
+            r = upstream.request(
+                git_request.method, git_request.url, git_request.headers, timeout=settings.timeout, data=body)
+            access_log.note(upstream=r.route.name)
+            if r.status_code != 200:
+                r.close()
+                status_code, headers, error_body = git_error_response(r.status_code, r.headers)
+                return Response(error_body, status=status_code, headers=headers)
+            response = Response(
+                upstream_body(r, UpstreamResumer(git_request.url, git_request.headers, r.status_code, r.headers)),
+                headers=git_response_headers(r.headers.get('Content-Type', 'application/octet-stream'), 'MISS')
+            )
+            response.call_on_close(r.close)
+            return response
+
+        cache.record(hit=False)
+        flight, reader = flights.join(
+            git_request.url, git_request.headers, None,
+            method=git_request.method, data=body, key=git_request.key, meta=git_request.meta
+        )
+        flight.ready.wait()
+        r = flight.response
+        if r is not None:
+            access_log.note(upstream=r.route.name)
+
+        if r is None:
+            reader.close()
+            entry = git_stale_entry(git_request)
+            if not entry:
+                raise flight.error
+            logger.warning(f'上游不可用，使用旧的引用通告: {git_request.url}, 错误: {str(flight.error)}')
+            return send_cached(*git_cached_response(entry, 'STALE'))
+
+        if r.status_code != 200:
+            reader.close()
+            status_code, headers, error_body = git_error_response(r.status_code, r.headers)
+            return Response(error_body, status=status_code, headers=headers)
+
+        return Response(reader, headers=git_response_headers(r.headers.get('Content-Type', 'application/octet-stream'), 'MISS'))
+
+    except requests.exceptions.Timeout:
+        logger.error(f'git 请求超时: {git_request.url}')
+        return jsonify({'error': '上游超时', 'url': git_request.url}), 504
+
+    except requests.exceptions.RequestException as e:
+        logger.error(f'git 请求失败: {git_request.url}, 错误: {str(e)}')
+        return jsonify({'error': '上游请求失败', 'details': str(e), 'url': git_request.url}), 502
+
+
+def download_url(url):
+    """下载 url 并流式返回（/download 与 /github/<path> 共用）"""
+    access_log.note(url=url)
+    error = check_download_url(url)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    filename = download_filename(url)
+
+    # 热点小文件直接从内存返回，不查磁盘
+    obj = memory_cache.get(url)
+    if obj and not request.headers.get('Range'):
+        cache.record(hit=True)
+        return serve_memory(obj, filename, 'HIT')
+
+    entry = cache.lookup(url)
+    if entry and cache.is_fresh(entry):
+        cache.record(hit=True)
+        return serve_cached(entry, filename, 'HIT')
+
+    try:
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+
+        # 断点续传 / 分段下载：未命中缓存时把 Range 直接交给上游
+        if request.headers.get('Range'):
+            cache.record(hit=False)
+            return proxy_range(url, headers, filename)
+
+        # 缓存已过期：带上 ETag / Last-Modified 向上游发起条件请求
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # 同一 URL 的并发请求共享一次上游传输
+        flight, reader = flights.join(url, headers, entry, peers=True, hops=peer_hops())
+        flight.ready.wait()
+        r = flight.response
+        if r is not None:
+            access_log.note(upstream=r.route.name)
+
+        if r is None:
+            reader.close()
+            if not entry:
+                raise flight.error
+            # 上游不可用时退回使用旧缓存
+            logger.warning(f'重新验证失败，使用旧缓存: {url}, 错误: {str(flight.error)}')
+            cache.record(hit=True)
+            return serve_cached(entry, filename, 'STALE')
+
+        if r.status_code == 304:
+            reader.close()
+            entry = cache.lookup(url)
+            if entry:
+                cache.record(hit=True)
+                return serve_cached(entry, filename, 'REVALIDATED')
+            raise requests.exceptions.RequestException('缓存条目已失效，请重试')
+
+        if r.status_code != 200:
+            reader.close()
+            r.raise_for_status()
+            raise requests.exceptions.RequestException(f'上游返回 HTTP {r.status_code}')
+
+        cache.record(hit=False)
+        response_headers = download_response_headers(filename, flight.spool.expected)
+        if from_peer():
+            peer_response_headers(response_headers, flight.spool.meta)
+        return Response(reader, headers=response_headers)
+
+    except requests.exceptions.Timeout:
+        logger.error(f'下载超时: {url}')
+        return jsonify({
+            'error': '下载超时',
+            'url': url
+        }), 504
+        
+    except requests.exceptions.RequestException as e:
+        logger.error(f'下载失败: {url}, 错误: {str(e)}')
+        response = getattr(e, 'response', None)
+        return jsonify({
+            'error': '下载失败',
+            'details': str(e),
+            'url': url
+        }), upstream_error_status(response.status_code if response is not None else None)
+        
+    except Exception as e:
+        logger.error(f'未知错误: {str(e)}')
+        return jsonify({
+            'error': '服务器内部错误',
+            'details': str(e)
+        }), 500
+
+
+@app.route('/health')
+def health():
+    """Kubernetes/Docker 健康检查端点"""
+    return jsonify({'status': 'healthy'}), 200
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+GitHub 下载中转服务的 gunicorn 配置（生产环境多进程模式）
+
+部署位置: /opt/github-proxy/gunicorn.conf.py
+
+启动方式:
+    gunicorn -c /opt/github-proxy/gunicorn.conf.py
+    或使用 systemd 服务（见 github-proxy.service）
+
+平滑重载（新 worker 立即接管请求，旧 worker 传完进行中的下载后退出）:
+    systemctl reload github-proxy      # 等价于 kill -HUP <master pid>
+
+环境变量（也可以写在 GHPROXY_ENV_FILE 中）:
+    GHPROXY_SERVER:           threaded（gthread worker，默认）或 asgi（uvicorn worker）
+    GHPROXY_APP:              应用模块（默认 app），按 GHPROXY_SERVER 加载其中的 app 或 asgi_app；
+                              也可以写完整的 模块:变量
+    GHPROXY_BIND:             监听地址（默认 0.0.0.0:18080）
+    GHPROXY_WORKERS:          worker 进程数（默认 CPU 核数）
+    GHPROXY_THREADS:          threaded 模式下每个 worker 的线程数，即单进程最大并发下载数（默认 64）
+    GHPROXY_GRACEFUL_TIMEOUT: 重载/停止时等待进行中下载完成的最长时间（秒，默认 600）
+    GHPROXY_ENV_FILE:         运行时配置文件（默认 /etc/github-proxy/proxy.env）
+"""
+
+import os
+import importlib.util
+import multiprocessing
+
+
+def load_config_module():
+    """
+    只加载同目录 ghproxy 包中的 config.py，复用其中的配置文件解析
+
+    不导入 ghproxy 包本身（会导入整个应用），也不登记到 sys.modules：
+    master 中缓存的模块会被 fork 出的 worker 继承，重载后就读不到新配置
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ghproxy', 'config.py')
+    spec = importlib.util.spec_from_file_location('_ghproxy_config', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# gunicorn 每次重载（HUP）都会重新执行本文件。配置文件中的变量通过 raw_env 写入环境，
+# 新 worker 以新配置启动（例如切换 HTTP_PROXY），旧 worker 保持原配置直到下载完成
+runtime_env = load_config_module().read_env_file(os.getenv('GHPROXY_ENV_FILE', '/etc/github-proxy/proxy.env'))
+raw_env = [f'{key}={value}' for key, value in runtime_env.items()]
+
+
+def setting(name, default):
+    return runtime_env.get(name, os.getenv(name, default))
+
+
+server_mode = setting('GHPROXY_SERVER', 'threaded')
+# 只给出模块名时按服务模式选择入口，切换 GHPROXY_SERVER 不必同时修改 GHPROXY_APP
+wsgi_app = setting('GHPROXY_APP', 'app')
+
+if server_mode == 'asgi':
+    # 事件循环 worker：单进程即可承载大量慢速下载连接
+    if ':' not in wsgi_app:
+        wsgi_app += ':asgi_app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    # 线程 worker：每个下载占用一个线程，流式响应不会阻塞同进程的其他请求
+    if ':' not in wsgi_app:
+        wsgi_app += ':app'
+    worker_class = 'gthread'
+    threads = int(setting('GHPROXY_THREADS', '64'))
+
+bind = setting('GHPROXY_BIND', '0.0.0.0:18080')
+workers = int(setting('GHPROXY_WORKERS', str(multiprocessing.cpu_count())))
+backlog = 4096
+keepalive = 30
+
+# SO_REUSEPORT：升级时新旧 master（kill -USR2）可同时监听同一端口
+reuse_port = True
+
+# 每个 worker 自己导入应用，重载后模块级配置（代理、缓存参数等）按新环境变量生效
+preload_app = False
+
+# 重载或停止时旧 worker 不再接受新连接，等待进行中的下载完成
+graceful_timeout = int(setting('GHPROXY_GRACEFUL_TIMEOUT', '600'))
+# 排空期间 worker 不再发送心跳，超时需覆盖整个排空时间，否则 master 会提前杀掉 worker
+timeout = graceful_timeout
+
+# 日志输出到 stderr，由 systemd journal 收集；访问日志由 Nginx 负责
+errorlog = '-'
+loglevel = 'info'
+
+
+def on_reload(arbiter):
+    arbiter.log.info('重新加载配置: %s', ', '.join(sorted(runtime_env)) or '（无运行时配置文件）')
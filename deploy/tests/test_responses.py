@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""
+ghproxy.responses 的单元测试（只依赖标准库）
+
+用法:
+    python3 -m unittest discover -s deploy/tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+# 不读取本机的运行时配置文件，缓存目录放在临时目录
+os.environ['GHPROXY_ENV_FILE'] = os.devnull
+os.environ.setdefault('GHPROXY_CACHE_DIR', tempfile.mkdtemp(prefix='ghproxy-test-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ghproxy.responses import MAX_RANGES, parse_range_header  # noqa: E402
+
+
+class ParseRangeHeaderTest(unittest.TestCase):
+
+    def test_single_range(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=990-2000', 1000), [(990, 999)])
+
+    def test_invalid_or_unsatisfiable(self):
+        self.assertIsNone(parse_range_header(None, 1000))
+        self.assertIsNone(parse_range_header('items=0-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=5-1', 1000))
+        self.assertIsNone(parse_range_header('bytes=a-b', 1000))
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=500-599,0-99,50-149', 1000), [(0, 149), (500, 599)])
+        self.assertEqual(parse_range_header('bytes=0-99,100-199', 1000), [(0, 199)])
+        self.assertEqual(parse_range_header('bytes=0-99,101-199', 1000), [(0, 99), (101, 199)])
+        self.assertEqual(parse_range_header('bytes=0-,-100', 1000), [(0, 999)])
+
+    def test_many_small_ranges(self):
+        disjoint = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES))
+        self.assertEqual(len(parse_range_header(f'bytes={disjoint}', 1000)), MAX_RANGES)
+        # 超过上限时忽略 Range，返回整个文件
+        disjoint = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(f'bytes={disjoint}', 1000))
+        # 合并后不超过上限的仍按区间返回
+        overlapping = ','.join('0-99' for _ in range(MAX_RANGES * 4))
+        self.assertEqual(parse_range_header(f'bytes={overlapping}', 1000), [(0, 99)])
+
+
+if __name__ == '__main__':
+    unittest.main()
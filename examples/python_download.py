@@ -7,17 +7,52 @@ Mirror 加速站 - Python 快速下载示例
     pip install requests
 
 使用方法：
-    python python_download.py
+    python python_download.py <原始URL> [保存路径]
+    python python_download.py -c 8 --sha256 <校验值> <原始URL> [保存路径]   # 8 个连接分段下载，可断点续传
 """
 
 import requests
 import sys
 import os
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import contextlib
+import concurrent.futures
 
 # 配置
 API_BASE_URL = "https://mirror.yljdteam.com"
 API_KEY = os.getenv("MIRROR_API_KEY", "")  # 从环境变量获取，或直接填写
 
+# 每次读取的块大小
+CHUNK_SIZE = 1024 * 1024
+# 并行下载时每段的大小
+SEGMENT_SIZE = 16 * 1024 * 1024
+# 加速地址的本地缓存（批量模式），重复运行时不再重复请求 generate 接口
+GENERATE_CACHE_PATH = os.getenv("MIRROR_CACHE_FILE", os.path.expanduser("~/.cache/mirror-download/generate.json"))
+GENERATE_CACHE_TTL = int(os.getenv("MIRROR_CACHE_TTL", "3600"))
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    进程内共用的 requests.Session：复用 keep-alive 连接，批量请求时不必每次重新握手
+    
+    连接池大小足够批量模式的并发线程使用
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=64)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
 def get_accelerated_url(original_url, api_key=None):
     """
     获取加速下载地址
@@ -47,7 +82,7 @@ def get_accelerated_url(original_url, api_key=None):
     
     # 使用 POST 方式
     try:
-        response = requests.post(
+        response = get_session().post(
             f"{API_BASE_URL}/api/download/generate",
             json={"url": original_url},
             headers={
@@ -94,7 +129,7 @@ def get_accelerated_url_get(original_url, api_key=None):
         import urllib.parse
         encoded_url = urllib.parse.quote(original_url, safe='')
         
-        response = requests.get(
+        response = get_session().get(
             f"{API_BASE_URL}/api/download/generate",
             params={"url": original_url},
             headers={
@@ -116,67 +151,739 @@ def get_accelerated_url_get(original_url, api_key=None):
             "error": f"网络错误: {str(e)}"
         }
 
-def download_file(accelerated_url, save_path=None):
+
+class GenerateCache:
+    """
+    generate 接口结果的本地缓存（JSON 文件，按原始 URL 保存加速地址与获取时间）
+    
+    只缓存成功的结果，超过 ttl 秒的条目视为过期
+    """
+    
+    def __init__(self, path=GENERATE_CACHE_PATH, ttl=GENERATE_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry and time.time() - entry["time"] < self.ttl:
+            return entry["result"]
+        return None
+    
+    def put(self, url, result):
+        with self.lock:
+            self.entries[url] = {"time": time.time(), "result": result}
+    
+    def save(self):
+        """写回磁盘，顺便清理过期条目"""
+        now = time.time()
+        with self.lock:
+            self.entries = {url: entry for url, entry in self.entries.items() if now - entry["time"] < self.ttl}
+            state = dict(self.entries)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def resolve_urls(urls, api_key=None, workers=16, cache=None):
+    """
+    并发获取多个链接的加速地址
+    
+    通过共用的 keep-alive 会话并发请求 generate 接口，缓存中未过期的结果直接使用
+    
+    Args:
+        urls: 原始下载链接列表
+        api_key: API Key
+        workers: 并发请求数
+        cache: GenerateCache（为 None 时不使用缓存）
+    
+    Returns:
+        dict: 原始链接 -> get_accelerated_url 的返回值
+    """
+    results = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        cached = cache.get(url) if cache else None
+        if cached:
+            results[url] = cached
+        else:
+            missing.append(url)
+    
+    if missing:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+            for url, result in zip(missing, pool.map(lambda url: get_accelerated_url(url, api_key), missing)):
+                results[url] = result
+                if cache and result.get("success"):
+                    cache.put(url, result)
+        if cache:
+            try:
+                cache.save()
+            except OSError as e:
+                print(f"⚠ 写入加速地址缓存失败: {str(e)}")
+    return results
+
+
+class Progress:
+    """
+    限频的进度输出
+    
+    每个数据块都 print(flush=True) 在多 GB 文件上会让下载变成 CPU 密集；
+    这里终端中每 0.5 秒刷新一次，输出重定向到文件时每 10 秒输出一行。quiet 时只计数不输出
+    """
+    
+    def __init__(self, total, done=0, quiet=False):
+        self.total = total
+        self.done = done
+        self.quiet = quiet
+        self.started = time.monotonic()
+        self.start_bytes = done
+        self.interactive = sys.stdout.isatty()
+        self.interval = 0.5 if self.interactive else 10
+        self.last_print = 0
+        self.lock = threading.Lock()
+    
+    def add(self, nbytes):
+        with self.lock:
+            self.done += nbytes
+        now = time.monotonic()
+        if not self.quiet and now - self.last_print >= self.interval:
+            self.last_print = now
+            self.show()
+    
+    def show(self, final=False):
+        if self.quiet:
+            return
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        speed = (self.done - self.start_bytes) / elapsed
+        line = f"下载进度: {format_size(self.done)}"
+        if self.total:
+            percent = self.done / self.total * 100
+            line += f" / {format_size(self.total)} ({percent:.1f}%)"
+            if speed > 0 and not final:
+                line += f"，剩余 {int((self.total - self.done) / speed)} 秒"
+        line += f"，{format_size(speed)}/s"
+        if self.interactive:
+            print(f"\r{line}    ", end="\n" if final else "", flush=True)
+        else:
+            print(line, flush=True)
+
+
+def format_size(nbytes):
+    """字节数转为易读的 KB / MB / GB"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            return f"{nbytes:.1f} {unit}" if unit != "B" else f"{int(nbytes)} B"
+        nbytes /= 1024
+
+
+def filename_from_response(response, url):
+    """从 Content-Disposition 或 URL 获取文件名"""
+    content_disposition = response.headers.get('Content-Disposition', '')
+    if 'filename=' in content_disposition:
+        return content_disposition.split('filename=')[1].strip('"\'')
+    from urllib.parse import urlparse
+    parsed = urlparse(url)
+    return os.path.basename(parsed.path) or 'download'
+
+
+def verify_file(path, size, sha256=None, digest=None):
+    """
+    下载完成后的校验：文件大小，以及指定时的 SHA-256
+    
+    Args:
+        digest: 下载过程中已经算好的 hashlib.sha256 对象；为 None 时重新读一遍文件计算
+    
+    Returns:
+        str or None: 校验失败的原因，通过时为 None
+    """
+    actual_size = os.path.getsize(path)
+    if size is not None and actual_size != size:
+        return f"文件大小不一致: {actual_size} != {size}"
+    if sha256:
+        if digest is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                while True:
+                    block = f.read(CHUNK_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+        if digest.hexdigest().lower() != sha256.lower():
+            return f"SHA-256 不一致: {digest.hexdigest()}"
+    return None
+
+
+def response_sha256(response):
+    """
+    服务器随响应给出的完整文件 SHA-256（Repr-Digest / Digest 响应头，中转服务缓存命中时返回）
+    
+    Returns:
+        str or None: 十六进制的 SHA-256，响应中没有时为 None
+    """
+    import base64
+    candidates = []
+    for item in response.headers.get('Repr-Digest', '').split(','):
+        name, _, value = item.strip().partition('=')
+        if name.lower() == 'sha-256' and value.startswith(':') and value.endswith(':'):
+            candidates.append(value[1:-1])
+    for item in response.headers.get('Digest', '').split(','):
+        name, _, value = item.strip().partition('=')
+        if name.lower() == 'sha-256':
+            candidates.append(value)
+    for value in candidates:
+        try:
+            digest = base64.b64decode(value, validate=True)
+        except ValueError:
+            continue
+        if len(digest) == 32:
+            return digest.hex()
+    return None
+
+
+class DownloadError(Exception):
+    """下载失败，消息为失败原因"""
+
+
+class FileChangedError(Exception):
+    """续传时服务器上的文件已变化"""
+
+
+def transfer_slot(slots):
+    """
+    占用一个全局连接名额（批量模式限制同时进行的 HTTP 传输总数）
+    
+    slots 为 threading.Semaphore，为 None 时不限制
+    """
+    return slots if slots is not None else contextlib.nullcontext()
+
+
+def download_file(accelerated_url, save_path=None, connections=1, sha256=None, slots=None, quiet=False):
     """
     下载文件
     
     Args:
         accelerated_url: 加速后的下载链接
         save_path: 保存路径（如果为 None，使用 URL 中的文件名）
+        connections: 并行连接数；大于 1 时分段并行下载，可断点续传（见 download_file_parallel）
+        sha256: 期望的 SHA-256（可选），下载完成后校验
+        slots: 全局连接名额（threading.Semaphore，可选）
+        quiet: 不输出进度
     
     Returns:
         bool: 是否成功
     """
     try:
-        response = requests.get(accelerated_url, stream=True, timeout=30)
-        response.raise_for_status()
+        save_path, _ = fetch_file(accelerated_url, save_path, connections, sha256, slots, quiet)
+    except DownloadError as e:
+        print(f"\n✗ {str(e)}")
+        return False
+    print(f"✓ 文件已保存到: {save_path}")
+    return True
+
+
+def download_file_parallel(accelerated_url, save_path=None, connections=4, sha256=None, slots=None, quiet=False):
+    """分段并行下载，支持断点续传（download_file 的 connections > 1 模式，说明见 fetch_parallel）"""
+    return download_file(accelerated_url, save_path, max(connections, 2), sha256, slots, quiet)
+
+
+def fetch_file(accelerated_url, save_path=None, connections=1, sha256=None, slots=None, quiet=False):
+    """
+    下载文件，失败时抛出 DownloadError
+    
+    Returns:
+        (保存路径, 文件大小)
+    """
+    if connections > 1:
+        return fetch_parallel(accelerated_url, save_path, connections, sha256, slots, quiet)
+    return fetch_single(accelerated_url, save_path, sha256, slots, quiet)
+
+
+def fetch_single(accelerated_url, save_path=None, sha256=None, slots=None, quiet=False):
+    """单连接下载（不可续传）"""
+    try:
+        with transfer_slot(slots):
+            response = get_session().get(accelerated_url, stream=True, timeout=30)
+            with response:
+                response.raise_for_status()
+                # 没有指定校验值时使用服务器给出的摘要
+                sha256 = sha256 or response_sha256(response)
+                
+                # 如果没有指定保存路径，从 URL 或 Content-Disposition 获取文件名
+                if not save_path:
+                    save_path = filename_from_response(response, accelerated_url)
+                
+                # 下载文件
+                total_size = int(response.headers.get('Content-Length', 0))
+                progress = Progress(total_size, quiet=quiet)
+                # 边下载边计算摘要，完成后不必再读一遍文件
+                digest = hashlib.sha256() if sha256 else None
+                
+                with open(save_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            if digest is not None:
+                                digest.update(chunk)
+                            progress.add(len(chunk))
+                progress.show(final=True)
+    except requests.exceptions.RequestException as e:
+        raise DownloadError(f"下载失败: {str(e)}") from None
+    
+    error = verify_file(save_path, total_size or None, sha256, digest)
+    if error:
+        raise DownloadError(f"校验失败: {error}")
+    return save_path, progress.done
+
+
+class ResumeJournal:
+    """
+    续传记录（<保存路径>.part.json）
+    
+    记录文件大小、校验值（ETag / Last-Modified）和每段已写入的字节数；
+    再次下载同一文件时只补齐未完成的部分，文件在服务器上变化时从头开始
+    """
+    
+    def __init__(self, path, url, size, validator, segment_size):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.segment_size = segment_size
+        count = (size + segment_size - 1) // segment_size
+        self.written = [0] * count
+        self.lock = threading.Lock()
+        self.saved_at = 0
+    
+    def segment(self, index):
+        """第 index 段的 (起始偏移, 结束偏移)（闭区间）"""
+        start = index * self.segment_size
+        return start, min(start + self.segment_size, self.size) - 1
+    
+    def remaining(self, index):
+        start, end = self.segment(index)
+        return end - start + 1 - self.written[index]
+    
+    def contiguous(self):
+        """从文件开头起连续写完的字节数"""
+        for index in range(len(self.written)):
+            if self.remaining(index) > 0:
+                return self.segment(index)[0] + self.written[index]
+        return self.size
+    
+    def load(self):
+        """读取已有的记录；与当前文件不匹配时返回 False"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (state.get("url") != self.url or state.get("size") != self.size
+                or (self.validator and not state.get("validator")) or state.get("segment_size") != self.segment_size
+                or len(state.get("written", [])) != len(self.written)):
+            return False
+        # 校验值变化（例如中转服务缓存命中后改用内容摘要作为 ETag）时仍用原来的校验值续传：
+        # 服务器上的文件确实变化时 If-Range 不匹配，服务器返回整个文件
+        self.validator = state.get("validator", "")
+        self.written = state["written"]
+        return True
+    
+    def advance(self, index, nbytes):
+        """第 index 段又写入了 nbytes；每秒最多写一次记录"""
+        with self.lock:
+            self.written[index] += nbytes
+            now = time.monotonic()
+            if now - self.saved_at >= 1 or self.remaining(index) == 0:
+                self.saved_at = now
+                self._save()
+    
+    def save(self):
+        with self.lock:
+            self._save()
+    
+    def _save(self):
+        state = {
+            "url": self.url,
+            "size": self.size,
+            "validator": self.validator,
+            "segment_size": self.segment_size,
+            "written": self.written
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+
+def probe(url):
+    """
+    用 Range: bytes=0-0 探测文件大小与是否支持分段下载
+    
+    Returns:
+        (requests.Response, 文件大小或 None, 校验值): 不支持 Range 时文件大小为 None
+    """
+    response = get_session().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30)
+    response.close()
+    response.raise_for_status()
+    etag = response.headers.get('ETag', '')
+    validator = etag if etag.startswith('"') else response.headers.get('Last-Modified', '')
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code != 206 or '/' not in content_range or content_range.endswith('/*'):
+        return response, None, validator
+    return response, int(content_range.rsplit('/', 1)[1]), validator
+
+
+def fetch_parallel(accelerated_url, save_path=None, connections=4, sha256=None, slots=None, quiet=False,
+                   segment_size=SEGMENT_SIZE, retries=5):
+    """
+    分段并行下载，支持断点续传
+    
+    文件按 segment_size 切成若干段，connections 个线程各自用 Range 请求一段，
+    用 os.pwrite 写入预先分配好大小的 <保存路径>.part；每段的进度记入续传记录，
+    中断后再次运行同一命令只下载剩余部分。全部完成后校验大小（和 SHA-256）再改名为保存路径。
+    SHA-256 在下载过程中按顺序对已写完的连续部分计算（刚写入的数据还在页缓存中），
+    完成时只需补算末尾；续传时上次已写完的部分要从磁盘读一遍。
+    服务器不支持 Range 时退回单连接下载。
+    
+    Args:
+        accelerated_url: 加速后的下载链接
+        save_path: 保存路径（如果为 None，使用 URL 中的文件名）
+        connections: 并行连接数
+        sha256: 期望的 SHA-256（可选）
+        slots: 全局连接名额（threading.Semaphore，可选），每段传输占用一个
+        quiet: 不输出进度
+        segment_size: 每段大小（字节）
+        retries: 每段失败后的重试次数
+    
+    Returns:
+        (保存路径, 文件大小)
+    """
+    try:
+        with transfer_slot(slots):
+            response, size, validator = probe(accelerated_url)
+    except requests.exceptions.RequestException as e:
+        raise DownloadError(f"下载失败: {str(e)}") from None
+    if not save_path:
+        save_path = filename_from_response(response, accelerated_url)
+    if not size:
+        if not quiet:
+            print("服务器不支持分段下载，改用单连接下载")
+        return fetch_single(accelerated_url, save_path, sha256, slots, quiet)
+    
+    # 服务器给出了摘要时，本地已有的同一文件不再重复下载
+    sha256 = sha256 or response_sha256(response)
+    if sha256 and os.path.exists(save_path) and verify_file(save_path, size, sha256) is None:
+        if not quiet:
+            print(f"本地文件与服务器内容一致（SHA-256），跳过下载: {save_path}")
+        return save_path, size
+    
+    # 后续请求直接使用重定向后的地址
+    url = response.url
+    part_path = save_path + ".part"
+    journal = ResumeJournal(part_path + ".json", accelerated_url, size, validator, segment_size)
+    if os.path.exists(part_path) and journal.load():
+        validator = journal.validator
+        if not quiet:
+            print(f"继续上次的下载: 已完成 {format_size(sum(journal.written))}")
+    
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        # 预先分配文件大小，各段直接写入自己的偏移
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        journal.save()
         
-        # 如果没有指定保存路径，从 URL 或 Content-Disposition 获取文件名
-        if not save_path:
-            # 尝试从 Content-Disposition 获取文件名
-            content_disposition = response.headers.get('Content-Disposition', '')
-            if 'filename=' in content_disposition:
-                save_path = content_disposition.split('filename=')[1].strip('"\'')
+        pending = queue.Queue()
+        for index in range(len(journal.written)):
+            if journal.remaining(index) > 0:
+                pending.put(index)
+        progress = Progress(size, sum(journal.written), quiet)
+        failures = []
+        write_lock = threading.Lock()
+        # 中断时通知各线程停止写入，等它们退出后才能关闭文件
+        stopped = threading.Event()
+        
+        def write_at(data, offset):
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fd, data, offset)
             else:
-                # 从 URL 获取文件名
-                from urllib.parse import urlparse
-                parsed = urlparse(accelerated_url)
-                save_path = os.path.basename(parsed.path) or 'download'
+                with write_lock:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    os.write(fd, data)
         
-        # 下载文件
-        total_size = int(response.headers.get('Content-Length', 0))
-        downloaded = 0
+        def read_at(length, offset):
+            if hasattr(os, 'pread'):
+                return os.pread(fd, length, offset)
+            with write_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                return os.read(fd, length)
         
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        print(f"\r下载进度: {percent:.1f}% ({downloaded}/{total_size} bytes)", end='', flush=True)
+        # 各段乱序完成，摘要只能按顺序计算：由主线程在等待下载时跟进已连续写完的部分
+        digest = hashlib.sha256() if sha256 else None
+        hashed = 0
         
-        print(f"\n✓ 文件已保存到: {save_path}")
-        return True
+        def hash_written():
+            nonlocal hashed
+            limit = journal.contiguous()
+            while hashed < limit:
+                block = read_at(min(CHUNK_SIZE, limit - hashed), hashed)
+                if not block:
+                    break
+                digest.update(block)
+                hashed += len(block)
         
-    except requests.exceptions.RequestException as e:
-        print(f"✗ 下载失败: {str(e)}")
-        return False
+        def fetch_segment(session, index):
+            start, end = journal.segment(index)
+            offset = start + journal.written[index]
+            headers = {"Range": f"bytes={offset}-{end}"}
+            if validator:
+                headers["If-Range"] = validator
+            with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as r:
+                if r.status_code == 200:
+                    # If-Range 不匹配：文件在服务器上已变化
+                    raise FileChangedError("服务器上的文件已变化，请删除 .part 文件后重新下载")
+                r.raise_for_status()
+                if not r.headers.get('Content-Range', '').startswith(f"bytes {offset}-"):
+                    raise requests.exceptions.RequestException(f"Content-Range 不匹配: {r.headers.get('Content-Range')}")
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    chunk = chunk[:end + 1 - offset]
+                    if not chunk or stopped.is_set():
+                        break
+                    write_at(chunk, offset)
+                    offset += len(chunk)
+                    journal.advance(index, len(chunk))
+                    progress.add(len(chunk))
+            if journal.remaining(index) > 0:
+                raise requests.exceptions.RequestException("连接提前关闭")
+        
+        def worker():
+            session = get_session()
+            while not failures:
+                try:
+                    index = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for attempt in range(retries + 1):
+                    try:
+                        with transfer_slot(slots):
+                            fetch_segment(session, index)
+                        break
+                    except FileChangedError as e:
+                        failures.append(str(e))
+                        return
+                    except requests.exceptions.RequestException as e:
+                        if attempt == retries or failures:
+                            failures.append(f"第 {index + 1} 段下载失败: {str(e)}")
+                            return
+                        time.sleep(min(2 ** attempt, 10))
+                    except Exception as e:
+                        # 写入失败（如磁盘已满）不重试，该段未完成的部分留给下次续传
+                        failures.append(f"第 {index + 1} 段写入失败: {str(e)}")
+                        return
+        
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(connections, pending.qsize()))]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    if digest is not None:
+                        hash_written()
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            failures.append("已中断")
+            stopped.set()
+            for thread in threads:
+                thread.join()
+            journal.save()
+            raise DownloadError(f"已中断，再次运行同一命令可继续下载（{part_path}）") from None
+        progress.show(final=True)
+        journal.save()
+        if digest is not None and not failures:
+            hash_written()
+    finally:
+        os.close(fd)
+    
+    if failures:
+        raise DownloadError(f"{failures[0]}；再次运行同一命令可继续下载")
+    # 没有摘要时 verify_file 只比较大小，预分配的文件大小总是对的，还要确认每段都已写完
+    if any(journal.remaining(index) > 0 for index in range(len(journal.written))):
+        raise DownloadError("部分分段未完成；再次运行同一命令可继续下载")
+    error = verify_file(part_path, size, sha256, digest)
+    if error:
+        raise DownloadError(f"校验失败: {error}")
+    os.replace(part_path, save_path)
+    os.remove(journal.path)
+    return save_path, size
+
+
+def read_manifest(path):
+    """
+    读取清单文件
+    
+    每行一个文件：<原始URL> [保存文件名] [sha256=<校验值>]，空行和 # 开头的行忽略；
+    也可以是 JSON 数组：[{"url": ..., "path": ..., "sha256": ...}, ...]
+    
+    Returns:
+        list: [{"url": str, "path": str or None, "sha256": str or None}, ...]
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return [{"url": item["url"], "path": item.get("path"), "sha256": item.get("sha256")} for item in json.loads(text)]
+    items = []
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        item = {"url": fields[0], "path": None, "sha256": None}
+        for field in fields[1:]:
+            if field.startswith("sha256="):
+                item["sha256"] = field[len("sha256="):]
+            else:
+                item["path"] = field
+        items.append(item)
+    return items
+
+
+def download_manifest(items, dest_dir=".", api_key=None, jobs=4, connections=1, max_connections=16,
+                      resolve_workers=16, cache=None):
+    """
+    批量下载清单中的文件
+    
+    先并发获取所有加速地址（共用 keep-alive 会话，命中本地缓存的不再请求），
+    再由 jobs 个线程同时下载（每个文件按段下载，失败的段自动重试，中断后再次运行时续传）；
+    所有下载（包括分段下载的各段）同时进行的 HTTP 传输不超过 max_connections
+    
+    Args:
+        items: read_manifest 的返回值
+        dest_dir: 保存目录（清单中未指定文件名时使用 URL 中的文件名）
+        api_key: API Key
+        jobs: 同时下载的文件数
+        connections: 每个文件的分段连接数
+        max_connections: 全局同时进行的传输数上限
+        resolve_workers: 获取加速地址的并发数
+        cache: GenerateCache（可选）
+    
+    Returns:
+        list: 每个文件的结果 {"url", "path", "status", "size", "seconds", "error"}
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    started = time.monotonic()
+    resolved = resolve_urls([item["url"] for item in items], api_key, resolve_workers, cache)
+    print(f"已获取 {len(resolved)} 个加速地址，用时 {time.monotonic() - started:.1f} 秒")
+    
+    slots = threading.BoundedSemaphore(max_connections)
+    
+    def run(item):
+        report = {"url": item["url"], "path": None, "status": "failed", "size": 0, "seconds": 0, "error": None}
+        result = resolved[item["url"]]
+        if not result.get("success"):
+            report["error"] = result.get("error", "获取加速地址失败")
+            return report
+        accelerated_url = result["data"]["acceleratedUrl"]
+        save_path = os.path.join(dest_dir, item["path"]) if item["path"] else None
+        if save_path is None:
+            from urllib.parse import urlparse
+            save_path = os.path.join(dest_dir, os.path.basename(urlparse(item["url"]).path) or "download")
+        begin = time.monotonic()
+        try:
+            # 批量模式总是按段下载：单连接时也能分段重试、下次运行时续传
+            report["path"], report["size"] = fetch_parallel(
+                accelerated_url, save_path, connections, item["sha256"], slots, quiet=True)
+            report["status"] = "ok"
+        except DownloadError as e:
+            report["path"] = save_path
+            report["error"] = str(e)
+        report["seconds"] = round(time.monotonic() - begin, 2)
+        mark = "✓" if report["status"] == "ok" else "✗"
+        print(f"{mark} {os.path.basename(save_path)} {format_size(report['size'])} "
+              f"{report['seconds']} 秒{'' if report['error'] is None else '，' + report['error']}", flush=True)
+        return report
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(run, items))
+
+
+def print_report(reports, elapsed):
+    """输出批量下载的汇总"""
+    ok = [report for report in reports if report["status"] == "ok"]
+    failed = [report for report in reports if report["status"] != "ok"]
+    total = sum(report["size"] for report in ok)
+    print()
+    print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+    print(f"📊 批量下载: ✅ {len(ok)} 成功, ❌ {len(failed)} 失败")
+    print(f"   共 {format_size(total)}，用时 {elapsed:.1f} 秒，平均 {format_size(total / max(elapsed, 1e-6))}/s")
+    if ok:
+        slowest = max(ok, key=lambda report: report["seconds"])
+        print(f"   最慢: {os.path.basename(slowest['path'])} {slowest['seconds']} 秒")
+    for report in failed:
+        print(f"   ✗ {report['url']}: {report['error']}")
+    print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+
 
 def main():
     """主函数 - 示例用法"""
     if len(sys.argv) < 2:
         print("使用方法:")
-        print(f"  python {sys.argv[0]} <原始URL> [保存路径]")
+        print(f"  python {sys.argv[0]} [-c 连接数] [--sha256 校验值] <原始URL> [保存路径]")
+        print(f"  python {sys.argv[0]} --manifest 清单文件 [-d 保存目录] [-j 同时下载数] [-c 连接数] [--report report.json]")
         print("\n示例:")
         print(f"  python {sys.argv[0]} https://github.com/ollama/ollama/releases/download/v0.1.0/ollama-linux-amd64")
         print(f"  python {sys.argv[0]} https://www.python.org/ftp/python/3.12.0/python-3.12.0-amd64.exe python.exe")
+        print(f"  python {sys.argv[0]} -c 8 https://github.com/ollama/ollama/releases/download/v0.13.4/ollama-linux-amd64.tgz")
+        print("\n选项:")
+        print("  -c, --connections N  分段并行下载的连接数（默认 1）；中断后再次运行同一命令继续下载")
+        print("  --sha256 HEX         下载完成后校验 SHA-256")
+        print("  --manifest FILE      批量下载清单中的文件（每行: URL [文件名] [sha256=校验值]）")
+        print("  -d, --dir DIR        批量下载的保存目录（默认当前目录）")
+        print("  -j, --jobs N         同时下载的文件数（默认 4）")
+        print("  --max-connections N  所有下载同时进行的连接数上限（默认 16）")
+        print("  --report FILE        把每个文件的结果写入 JSON 报告")
+        print("  --no-cache           不使用加速地址缓存（默认缓存 1 小时，见 MIRROR_CACHE_FILE / MIRROR_CACHE_TTL）")
         print("\n环境变量:")
         print("  设置 MIRROR_API_KEY 环境变量，或直接在代码中修改 API_KEY")
         sys.exit(1)
     
-    original_url = sys.argv[1]
-    save_path = sys.argv[2] if len(sys.argv) > 2 else None
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", nargs="?")
+    parser.add_argument("save_path", nargs="?")
+    parser.add_argument("-c", "--connections", type=int, default=1)
+    parser.add_argument("--sha256")
+    parser.add_argument("--manifest")
+    parser.add_argument("-d", "--dir", default=".")
+    parser.add_argument("-j", "--jobs", type=int, default=4)
+    parser.add_argument("--max-connections", type=int, default=16)
+    parser.add_argument("--report")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+    
+    if args.manifest:
+        started = time.monotonic()
+        items = read_manifest(args.manifest)
+        print(f"清单: {len(items)} 个文件")
+        reports = download_manifest(
+            items, args.dir, jobs=args.jobs, connections=args.connections, max_connections=args.max_connections,
+            cache=None if args.no_cache else GenerateCache()
+        )
+        print_report(reports, time.monotonic() - started)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(reports, f, ensure_ascii=False, indent=2)
+            print(f"报告已保存到: {args.report}")
+        sys.exit(0 if all(report["status"] == "ok" for report in reports) else 1)
+    if not args.url:
+        parser.error("缺少原始 URL")
+    
+    original_url = args.url
+    save_path = args.save_path
     
     print(f"原始链接: {original_url}")
     print("正在获取加速地址...")
@@ -196,7 +903,8 @@ def main():
     # 下载文件
     if save_path or input("\n是否下载文件? (y/n): ").lower() == 'y':
         print("\n开始下载...")
-        download_file(accelerated_url, save_path)
+        if not download_file(accelerated_url, save_path, args.connections, args.sha256):
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
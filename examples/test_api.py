@@ -6,6 +6,8 @@
 import requests
 import os
 import sys
+import time
+import concurrent.futures
 
 API_BASE = "https://mirror.yljdteam.com"
 API_KEY = os.getenv("MIRROR_API_KEY", "")
@@ -43,13 +45,14 @@ def test_api():
     success_count = 0
     fail_count = 0
     
-    for i, test_case in enumerate(test_cases, 1):
-        print(f"[测试 {i}/{len(test_cases)}] {test_case['name']}")
-        print(f"  原始 URL: {test_case['url']}")
-        
+    # 所有用例共用一个 keep-alive 会话并发请求，结果按用例顺序输出
+    session = requests.Session()
+    
+    def run_case(test_case):
+        started = time.monotonic()
         try:
             # 测试 POST 方式
-            response = requests.post(
+            response = session.post(
                 f"{API_BASE}/api/download/generate",
                 json={"url": test_case["url"]},
                 headers={
@@ -58,23 +61,32 @@ def test_api():
                 },
                 timeout=10
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("success"):
-                    accelerated_url = result["data"]["acceleratedUrl"]
-                    print(f"  ✅ 成功")
-                    print(f"  加速 URL: {accelerated_url}")
-                    success_count += 1
-                else:
-                    print(f"  ❌ 失败: {result.get('error', '未知错误')}")
-                    fail_count += 1
+            return response, None, time.monotonic() - started
+        except requests.exceptions.RequestException as e:
+            return None, e, time.monotonic() - started
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        outcomes = list(pool.map(run_case, test_cases))
+    
+    for i, (test_case, (response, error, elapsed)) in enumerate(zip(test_cases, outcomes), 1):
+        print(f"[测试 {i}/{len(test_cases)}] {test_case['name']}")
+        print(f"  原始 URL: {test_case['url']}")
+        
+        if error is not None:
+            print(f"  ❌ 网络错误: {str(error)}")
+            fail_count += 1
+        elif response.status_code == 200:
+            result = response.json()
+            if result.get("success"):
+                accelerated_url = result["data"]["acceleratedUrl"]
+                print(f"  ✅ 成功（{elapsed * 1000:.0f} ms）")
+                print(f"  加速 URL: {accelerated_url}")
+                success_count += 1
             else:
-                print(f"  ❌ HTTP {response.status_code}: {response.text[:100]}")
+                print(f"  ❌ 失败: {result.get('error', '未知错误')}")
                 fail_count += 1
-                
-        except requests.exceptions.RequestException as e:
-            print(f"  ❌ 网络错误: {str(e)}")
+        else:
+            print(f"  ❌ HTTP {response.status_code}: {response.text[:100]}")
             fail_count += 1
         
         print()
@@ -83,7 +95,7 @@ def test_api():
     print("[测试] GET 方式")
     try:
         test_url = "https://example.com/test.zip"
-        response = requests.get(
+        response = session.get(
             f"{API_BASE}/api/download/generate",
             params={"url": test_url},
             headers={"X-API-Key": API_KEY},
@@ -4,8 +4,8 @@
 # -----------------------------------------
 #
 # 功能：
-# - 安装 nginx、Python3、pip、Flask、requests
-# - 安装 github_proxy_gz.py 到 /opt/github-proxy
+# - 安装 nginx、Python3、pip、Flask、requests、gunicorn
+# - 安装 github_proxy_gz.py、ghproxy 包与 gunicorn 配置到 /opt/github-proxy
 # - 生成一个简单的 systemd service（可选）
 # - 安装 deploy/nginx.github-proxy.conf 到 /etc/nginx/sites-available/github-proxy.conf
 #
@@ -29,11 +29,16 @@ echo "[GZ] 安装 nginx 与 Python 依赖 ..."
 apt-get update -y
 apt-get install -y nginx python3 python3-pip
 pip3 install --upgrade pip
-pip3 install flask requests
+pip3 install flask requests gunicorn
 
 echo "[GZ] 安装 github_proxy_gz.py 到 /opt/github-proxy ..."
 mkdir -p /opt/github-proxy
 cp "$REPO_DIR/scripts/github_proxy_gz.py" /opt/github-proxy/github_proxy_gz.py
+rm -rf /opt/github-proxy/ghproxy
+cp -r "$REPO_DIR/deploy/ghproxy" /opt/github-proxy/ghproxy
+cp "$REPO_DIR/deploy/gunicorn.conf.py" /opt/github-proxy/gunicorn.conf.py
+mkdir -p /etc/github-proxy
+touch /etc/github-proxy/proxy.env
 
 echo "[GZ] 创建 systemd 服务（/etc/systemd/system/github-proxy.service）..."
 cat >/etc/systemd/system/github-proxy.service <<'UNIT'
@@ -44,9 +49,15 @@ After=network-online.target
 [Service]
 Type=simple
 WorkingDirectory=/opt/github-proxy
-ExecStart=/usr/bin/python3 /opt/github-proxy/github_proxy_gz.py
+ExecStart=/usr/bin/python3 -m gunicorn -c /opt/github-proxy/gunicorn.conf.py
+# systemctl reload 平滑替换 worker（重新读取 /etc/github-proxy/proxy.env），进行中的下载不中断
+ExecReload=/bin/kill -s HUP $MAINPID
 Restart=always
 RestartSec=5
+KillMode=mixed
+TimeoutStopSec=660
+# 只写模块名：gunicorn.conf.py 按 proxy.env 中的 GHPROXY_SERVER 加载 app 或 asgi_app
+Environment="GHPROXY_APP=github_proxy_gz"
 
 # 如需通过 Shadowsocks 等上游代理出网，请在这里设置 HTTP_PROXY/HTTPS_PROXY
 # Environment="HTTP_PROXY=socks5h://127.0.0.1:1080"
@@ -126,6 +137,9 @@ if [[ "$CONFIG_MODE" == "1" ]]; then
    - 运行：
        systemctl daemon-reload
        systemctl restart github-proxy.service
+   - 或者写入 /etc/github-proxy/proxy.env（HTTP_PROXY=... 每行一个），再运行
+       systemctl reload github-proxy.service
+     平滑切换，不中断正在进行的下载。
 
 3. 前端中，将 GitHub 下载加速前缀设置为：
    https://$GZ_DOMAIN:9090/github/...
@@ -148,6 +162,9 @@ else
    - 运行：
        systemctl daemon-reload
        systemctl restart github-proxy.service
+   - 或者写入 /etc/github-proxy/proxy.env（HTTP_PROXY=... 每行一个），再运行
+       systemctl reload github-proxy.service
+     平滑切换，不中断正在进行的下载。
 
 3. 测试服务是否正常：
    curl http://$GZ_IP:9090/status
@@ -5,119 +5,46 @@ Guangzhou GitHub Release 下载代理
 
 部署位置：广州节点（如 violetteam.cloud）。
 
+本文件只是入口，实现在 deploy/ghproxy 包中（与 deploy/guangzhou-github-proxy.py 共用）。
+deploy_gz.sh 会把包复制到 /opt/github-proxy/ghproxy/。
+
 功能：
 - /status         -> 服务状态
 - /download?url=  -> 通用下载
 - /github/<path>  -> 直接拉取 https://github.com/<path>
+- /github/<owner>/<repo>.git -> git clone 地址（smart HTTP，缓存引用通告与 packfile）
+- /metrics        -> Prometheus 指标
+- /health         -> 健康检查
 
 代理：
-- 通过环境变量 HTTP_PROXY / HTTPS_PROXY 读取上游代理（例如本地 ss-local）。
-"""
-
-import os
-import logging
-
-from flask import Flask, request, Response, stream_with_context, jsonify
-import requests
-
-app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
-
-
-def get_proxies() -> dict:
-    http_proxy = os.getenv("HTTP_PROXY", "")
-    https_proxy = os.getenv("HTTPS_PROXY", http_proxy)
-    if not http_proxy and not https_proxy:
-        return {}
-    return {"http": http_proxy, "https": https_proxy}
-
-
-@app.route("/")
-def index():
-    return """
-<h1>GitHub Download Proxy (Guangzhou)</h1>
-<p>Usage:</p>
-<ul>
-  <li><code>/download?url=GITHUB_URL</code></li>
-  <li><code>/github/owner/repo/path/to/file</code></li>
-  <li><code>/status</code> - Service status</li>
-</ul>
-""".strip()
-
-
-@app.route("/status")
-def status():
-    return jsonify({"status": "ok", "proxy": bool(get_proxies())})
+- 通过环境变量 HTTP_PROXY / HTTPS_PROXY 读取上游代理（例如本地 ss-local）；
+  本节点未设置时直连（deploy 节点默认使用 http://127.0.0.1:8118）。
 
+配置：
+- 所有配置项（缓存、连接池、超时、分段、续传、上游出口等）见
+  `python3 github_proxy_gz.py --check-config`，可写在 /etc/github-proxy/proxy.env 中。
 
-def download_file(url: str) -> Response:
-    try:
-        proxies = get_proxies()
-        headers = {"User-Agent": "Mozilla/5.0"}
-
-        # HEAD 先获取类型/长度
-        head_resp = requests.head(
-            url,
-            headers=headers,
-            proxies=proxies or None,
-            timeout=10,
-            allow_redirects=True,
-        )
-        head_resp.raise_for_status()
-
-        content_type = head_resp.headers.get("Content-Type", "application/octet-stream")
-        content_length = head_resp.headers.get("Content-Length", "")
-
-        def generate():
-            with requests.get(
-                url,
-                headers=headers,
-                proxies=proxies or None,
-                stream=True,
-                timeout=300,
-            ) as r:
-                r.raise_for_status()
-                for chunk in r.iter_content(chunk_size=1024 * 1024):
-                    if chunk:
-                        yield chunk
-
-        filename = os.path.basename(url.split("?")[0]) or "download.bin"
-
-        response_headers = {
-            "Content-Type": content_type,
-            "Content-Disposition": f'attachment; filename="{filename}"',
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        }
-        if content_length:
-            response_headers["Content-Length"] = content_length
-
-        return Response(stream_with_context(generate()), headers=response_headers)
-
-    except Exception as exc:  # noqa: BLE001
-        app.logger.error("Download error for %s: %s", url, exc)
-        return jsonify({"error": str(exc)}), 500
+生产部署：
+- 使用 deploy/gunicorn.conf.py 以多进程方式运行（GHPROXY_APP=github_proxy_gz，
+  按 GHPROXY_SERVER 加载 app 或 asgi_app），`systemctl reload` 平滑重载，进行中的下载不会中断。
+"""
 
+import os
+import sys
 
-@app.route("/download")
-def download():
-    url = request.args.get("url", "").strip()
-    if not url:
-        return jsonify({"error": "Missing url"}), 400
-    app.logger.info("Download request: %s", url)
-    return download_file(url)
+# 广州节点默认直连；显式设置的 HTTP_PROXY（包括配置文件中的）仍然生效
+os.environ.setdefault("HTTP_PROXY", "")
 
+_here = os.path.dirname(os.path.realpath(__file__))
+# 部署后 ghproxy 包与本文件同目录，在仓库中则位于 deploy/ 下
+for _path in (os.path.join(_here, "..", "deploy"), _here):
+    if os.path.isdir(os.path.join(_path, "ghproxy")):
+        sys.path.insert(0, os.path.abspath(_path))
+        break
 
-@app.route("/github/<path:url_suffix>")
-def github_proxy(url_suffix: str):
-    github_url = f"https://github.com/{url_suffix}"
-    app.logger.info("GitHub proxy direct download: %s", github_url)
-    return download_file(github_url)
+from ghproxy import app, asgi_app, main  # noqa: E402
 
+__all__ = ["app", "asgi_app"]
 
 if __name__ == "__main__":
-    print("Starting GitHub Proxy Server (Guangzhou) on 0.0.0.0:18080 ...")
-    app.run(host="0.0.0.0", port=18080, threaded=True, debug=False)
-
-
+    sys.exit(main())